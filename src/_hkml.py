@@ -5,15 +5,19 @@ import argparse
 import base64
 import datetime
 import email.utils
+import gzip
 import json
 import mailbox
+import mmap
 import os
+import re
 import subprocess
-import tempfile
+import threading
 import time
 import sys
 
 import _hkml_date
+import _hkml_git_batch
 import hkml_cache
 import hkml_init
 
@@ -34,11 +38,20 @@ def atom_tag(node):
     return node.tag[len(prefix):]
 
 nr_public_inbox_queries = 0
+
+# Threads that cannot ask questions to the user, e.g., the mails list
+# generation worker of hkml_view_mails, set 'enabled' of this to False.
+interactive = threading.local()
+
+def is_interactive():
+    return getattr(interactive, 'enabled', True)
+
 def delay_public_inbox_query():
     '''Delay public inbox server query, to avoid overloading the server.'''
     global nr_public_inbox_queries
     nr_public_inbox_queries += 1
-    if nr_public_inbox_queries > 0 and nr_public_inbox_queries % 10 == 0:
+    if nr_public_inbox_queries > 0 and nr_public_inbox_queries % 10 == 0 \
+            and is_interactive():
         answer = input('you queried public inbox %d times.  Is it sane? [y/N] '
                        % nr_public_inbox_queries)
         if answer.lower() != 'y':
@@ -59,15 +72,22 @@ def fetch_mbox_from_public_inbox(msgid):
     except Exception as e:
         return None, '%s' % e
 
+# Object having get_body(mail) method, which returns the body of the mail that
+# prefetched in background, or None.  Set by _hkml_prefetch.
+prefetched_bodies = None
+
 class Mail:
-    gitid = None
-    gitdir = None
-    subject = None
-    date = None
-    subject_tags = None
-    series = None
-    __fields = None
-    mbox = None
+    # Tens of thousands of Mail objects can be made for a list.  Use slots to
+    # save memory.
+    __slots__ = [
+            'gitid', 'gitdir', 'subject', 'date', 'subject_tags', 'series',
+            # parsed and decoded fields
+            '__fields',
+            # header field name to the list of the not yet decoded values
+            '__raw_header',
+            # offset of the body in mbox
+            '__body_offset',
+            'mbox']
 
     def set_subject_tags_series(self):
         subject = self.subject
@@ -94,7 +114,7 @@ class Mail:
             return mail
         self = cls()
         self.gitid = gitid
-        self.gitdir = gitdir
+        self.gitdir = sys.intern(gitdir)
         self.date = _hkml_date.parse_iso_date(date)
         self.subject = subject
         self.set_subject_tags_series()
@@ -102,6 +122,15 @@ class Mail:
         hkml_cache.set_mail(self)
         return self
 
+    @classmethod
+    def from_mbox_uncached(cls, mbox):
+        '''Return a Mail for only reading fields of the mbox, without putting
+        it in the cache'''
+        self = cls()
+        self.mbox = mbox
+        self.__fields = {}
+        return self
+
     def parse_atom(self, entry, mailing_list):
         self.__fields = {}
         pi_url = get_manifest()['site']
@@ -139,7 +168,16 @@ class Mail:
                     'in-reply-to'].split()[0]
 
     def __init__(self, mbox=None, kvpairs=None, atom_entry=None, atom_ml=None):
+        self.gitid = None
+        self.gitdir = None
+        self.subject = None
+        self.date = None
         self.subject_tags = []
+        self.series = None
+        self.__fields = None
+        self.__raw_header = None
+        self.__body_offset = None
+        self.mbox = None
 
         if mbox is None and kvpairs is None and atom_entry is None:
             return
@@ -149,6 +187,8 @@ class Mail:
         elif kvpairs is not None:
             self.gitid = kvpairs['gitid']
             self.gitdir = kvpairs['gitdir']
+            if self.gitdir is not None:
+                self.gitdir = sys.intern(self.gitdir)
             self.subject = kvpairs['subject']
             self.mbox = kvpairs['mbox']
             if 'msgid' in kvpairs:
@@ -177,6 +217,9 @@ class Mail:
 
     def to_kvpairs(self):
         if self.mbox == None:
+            if self.__raw_header is not None:
+                # mbox has dropped by drop_mbox()
+                self.set_mbox()
             # ensure mbox is set.  TODO: don't parse it unnecessarily
             self.get_msgid()
         return {
@@ -208,7 +251,7 @@ class Mail:
             return '%s' % self.date
 
         if not field_name in self.__fields:
-            self.__parse_mbox()
+            self.__parse_field(field_name)
 
         if not field_name in self.__fields:
             return None
@@ -229,15 +272,25 @@ class Mail:
     def get_body(self):
         return self.get_field('body')
 
+    def drop_mbox(self):
+        '''Drop mbox and parsed body of git-based mails after parsing the
+        header, to save memory.  mbox is read again from the git if the body
+        or the mbox is needed.'''
+        if self.gitid is None or self.gitdir is None:
+            return
+        if self.__raw_header is None:
+            return
+        self.mbox = None
+        self.__fields.pop('body', None)
+
     def set_mbox(self):
         if self.gitdir is not None and self.gitid is not None:
-            gitdir = self.gitdir
-            if not os.path.isabs(gitdir):
-                gitdir = os.path.join(get_hkml_dir(), gitdir)
-            cmd = ['git', '--git-dir=%s' % gitdir, 'show', '%s:m' % self.gitid]
             try:
-                self.mbox = cmd_str_output(cmd)
+                self.mbox = _hkml_git_batch.read_blob(
+                        mail_gitdir_path(self.gitdir), '%s:m' % self.gitid)
             except:
+                self.mbox = None
+            if self.mbox is None:
                 self.mbox = ''
             return
         if 'message-id' in self.__fields:
@@ -254,87 +307,147 @@ class Mail:
         print('cannot get mbox')
         exit(1)
 
-    def __parse_body(self, parsed, mbox_lines, idx):
+    def __parse_body(self):
+        if self.mbox is None:
+            # mbox has dropped by drop_mbox()
+            self.set_mbox()
         try:
             # 'm' doesn't have start 'From' line in some case.  Add a fake one.
             mbox_str = '\n'.join(['From mboxrd@z Thu Jan  1 00:00:00 1970',
                 self.mbox])
             msg = mailbox.Message(mbox_str.encode())
-            parsed['body'] = mbox_body_decoded(msg)
+            self.__fields['body'] = mbox_body_decoded(msg)
         except:
             # Still decode() could fail due to encoding
-            parsed['body'] = '\n'.join(mbox_lines[idx:])
+            body = self.mbox[self.__body_offset:]
 
-            encoding_key = 'Content-Transfer-Encoding'.lower()
-            if encoding_key in parsed and parsed[encoding_key] == 'base64':
+            encoding = self.get_field('Content-Transfer-Encoding')
+            if encoding == 'base64':
                 try:
-                    parsed['body'] = base64.b64decode(parsed['body']).decode()
+                    body = base64.b64decode(body).decode()
                 except:
                     pass
+            self.__fields['body'] = body
+
+    def __parse_field(self, field_name):
+        '''Parse and decode only the given field'''
+        if field_name == 'body' and prefetched_bodies is not None:
+            body = prefetched_bodies.get_body(self)
+            if body is not None and self.__fields is not None:
+                self.__fields['body'] = body
+                return
 
-    def parse_mbox_header(self, parsed, mbox_lines):
-        # todo: use mailbox.Message.items()
-        in_header = True
-        key = None
-        for idx, line in enumerate(mbox_lines):
-            if in_header:
-                if line and line[0] in [' ', '\t'] and key:
-                    parsed[key] += ' %s' % line.strip()
-                    continue
-                line = line.strip()
-                key = line.split(':')[0].lower()
-                if key:
-                    val = line[len(key) + 2:]
-                    if key == 'message-id':
-                        if len(val.split()) >= 1:
-                            val = val.split()[0]
-                    decoded_header = email.header.decode_header(val)
-                    try:
-                        val = str(email.header.make_header(decoded_header))
-                    except UnicodeDecodeError:
-                        # just forgive...
-                        pass
-                    except LookupError:
-                        # just forgive...
-                        pass
-                    # handle multiple to: and cc: lines
-                    if key in ['to', 'cc'] and key in parsed:
-                        parsed[key] += ', %s' % val
-                    else:
-                        parsed[key] = val
-                elif line == '':
-                    in_header = False
-                continue
-            break
-        return idx
+        if self.__raw_header is None:
+            self.__parse_mbox()
 
-    def __parse_mbox(self):
-        if not self.mbox:
-            self.set_mbox()
+        if field_name == 'body':
+            self.__parse_body()
+            return
+
+        # some mail puts information in addition to message id on in-reply-to
+        # header.  E.g., 87ikvefswp.fsf@yhuang6-desk2.ccr.corp.intel.com
+        if field_name == 'in-reply-to-msgid':
+            in_reply_to = self.get_field('in-reply-to')
+            if in_reply_to and in_reply_to.split():
+                self.__fields[field_name] = in_reply_to.split()[0]
+            else:
+                self.__fields[field_name] = None
+            return
+
+        if not field_name in self.__raw_header:
+            return
+        vals = [decode_header_value(v) for v in self.__raw_header[field_name]]
+        # handle multiple to: and cc: lines
+        if field_name in ['to', 'cc']:
+            val = ', '.join(vals)
+        else:
+            val = vals[-1]
 
-        parsed = {}
-        mbox_lines = self.mbox.split('\n')
-        body_start_idx = self.parse_mbox_header(parsed, mbox_lines)
-        self.__parse_body(parsed, mbox_lines, body_start_idx)
+        if field_name == 'message-id' and len(val.split()) >= 1:
+            val = val.split()[0]
 
         # for lore-pasted string case
-        if 'date' in parsed:
-            tokens = parsed['date'].split()
+        if field_name == 'date':
+            tokens = val.split()
             if tokens[-2:] == ['[thread', 'overview]']:
-                parsed['date'] = ' '.join(tokens[:-2])
+                val = ' '.join(tokens[:-2])
 
-        # some mail puts information in addition to message id on in-reply-to
-        # header.  E.g., 87ikvefswp.fsf@yhuang6-desk2.ccr.corp.intel.com
-        parsed['in-reply-to-msgid'] = None
-        if 'in-reply-to' in parsed and parsed['in-reply-to']:
-            parsed['in-reply-to-msgid'] = parsed['in-reply-to'].split()[0]
+        self.__fields[field_name] = val
+
+    def __parse_mbox(self):
+        '''Parse only the header, without decoding the fields'''
+        if not self.mbox:
+            self.set_mbox()
 
-        self.__fields = parsed
+        self.__raw_header, self.__body_offset = parse_mbox_raw_header(
+                self.mbox)
+        self.__fields = {}
 
     def url(self):
         site = get_manifest()['site']
         return '%s/%s' % (site, self.get_msgid()[1:-1])
 
+def parse_mbox_raw_header(mbox):
+    '''Return a dict of lowercase header field name to the list of the not yet
+    decoded values of the field, and the offset of the body in mbox'''
+    raw_header = {}
+    key = None
+    pos = 0
+    while pos < len(mbox):
+        end = mbox.find('\n', pos)
+        if end == -1:
+            end = len(mbox)
+        line = mbox[pos:end]
+        pos = end + 1
+
+        if line and line[0] in [' ', '\t'] and key:
+            raw_header[key][-1] += ' %s' % line.strip()
+            continue
+        line = line.strip()
+        key = sys.intern(line.split(':')[0].lower())
+        if key:
+            if not key in raw_header:
+                raw_header[key] = []
+            raw_header[key].append(line[len(key) + 2:])
+        elif line == '':
+            break
+    return raw_header, min(pos, len(mbox))
+
+def decode_header_value(val):
+    decoded_header = email.header.decode_header(val)
+    try:
+        return str(email.header.make_header(decoded_header))
+    except UnicodeDecodeError:
+        # just forgive...
+        return val
+    except LookupError:
+        # just forgive...
+        return val
+
+def mail_gitdir_path(gitdir):
+    if not os.path.isabs(gitdir):
+        gitdir = os.path.join(get_hkml_dir(), gitdir)
+    return gitdir
+
+def prefetch_mboxes(mails):
+    '''Set mbox of git-based mails using one git process per gitdir'''
+    gitdir_mails = {}
+    for mail in mails:
+        if mail.mbox or mail.gitid is None or mail.gitdir is None:
+            continue
+        if not mail.gitdir in gitdir_mails:
+            gitdir_mails[mail.gitdir] = []
+        gitdir_mails[mail.gitdir].append(mail)
+    for gitdir, mails_of_gitdir in gitdir_mails.items():
+        try:
+            mboxes = _hkml_git_batch.read_blobs(
+                    mail_gitdir_path(gitdir),
+                    ['%s:m' % m.gitid for m in mails_of_gitdir])
+        except:
+            continue
+        for mail, mbox in zip(mails_of_gitdir, mboxes):
+            mail.mbox = mbox if mbox is not None else ''
+
 def mbox_body_decoded(message):
     '''message: email.message.Message'''
     while message.is_multipart():
@@ -351,47 +464,87 @@ def mbox_body_decoded(message):
             payload = payload.decode('utf-8')
     return payload
 
-def mbox_message_to_str(message):
-    strs = []
-    for key, value in message.items():
-        strs.append('%s: %s' % (key, value))
-    strs.append('')
-    strs.append(mbox_body_decoded(message))
-    return '\n'.join(strs)
+def decode_mbox_bytes(mbox_bytes):
+    try:
+        return mbox_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        return mbox_bytes.decode('cp437')
+
+def mbox_message_bytes_to_str(message_bytes, mboxrd):
+    if mboxrd:
+        # mboxrd escapes body lines starting with 'From ' with '>'
+        message_bytes = re.sub(rb'(?m)^>(>*From )', rb'\1', message_bytes)
+    return decode_mbox_bytes(message_bytes).strip()
+
+def iter_mbox_messages_gz(filepath, mboxrd):
+    lines = []
+    with gzip.open(filepath, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From '):
+                if lines:
+                    yield mbox_message_bytes_to_str(b''.join(lines), mboxrd)
+                lines = []
+            else:
+                lines.append(line)
+    if lines:
+        yield mbox_message_bytes_to_str(b''.join(lines), mboxrd)
+
+def iter_mbox_messages(filepath, mboxrd=False):
+    '''Yield strings of messages in the mbox file, one by one.  The initial
+    'From ' line of the file can be missed.  Lines starting with '>From ' are
+    unescaped only if 'mboxrd' is True, since other mbox formats keep those
+    as is.'''
+    if filepath.endswith('.gz'):
+        yield from iter_mbox_messages_gz(filepath, mboxrd)
+        return
 
-def __read_mbox_file(filepath):
-    mails = []
+    if os.path.getsize(filepath) == 0:
+        return
+    with open(filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:5] == b'From ':
+                start = mm.find(b'\n') + 1
+                if start == 0:
+                    return
+            else:
+                # the initial from line is missed
+                start = 0
+            while True:
+                # every 'From ' line starts a new message, like mailbox.mbox
+                end = mm.find(b'\nFrom ', start)
+                if end == -1:
+                    yield mbox_message_bytes_to_str(mm[start:], mboxrd)
+                    return
+                yield mbox_message_bytes_to_str(mm[start:end + 1], mboxrd)
+                start = mm.find(b'\n', end + 1) + 1
+                if start == 0:
+                    return
+
+def iter_mbox_file_mails(filepath, mboxrd=False):
+    '''Yield non-broken Mail objects in the mbox file, one by one'''
     if filepath[-5:] == '.json':
         with open(filepath, 'r') as f:
             for kvp in json.load(f):
                 mail = Mail(kvpairs=kvp)
                 if mail.broken():
                     continue
-                mails.append(mail)
-            return mails
+                yield mail
+        return
 
-    for message in mailbox.mbox(filepath):
-        mail = Mail(mbox=mbox_message_to_str(message))
+    for mbox in iter_mbox_messages(filepath, mboxrd):
+        if not mbox:
+            continue
+        mail = Mail(mbox=mbox)
         if mail.broken():
             continue
-        mails.append(mail)
-    return mails
+        yield mail
 
-def read_mbox_file(filepath):
-    mails = __read_mbox_file(filepath)
-    if len(mails) > 0:
-        return mails
-
-    # maybe mbox file but the initial from line is missed.
-    with open(filepath, 'r') as f:
-        orig_content = f.read()
-    updated_content = '\n'.join(
-            ['From hackermail Thu Jan  1 00:00:00 1970', orig_content])
-    fd, tmp_path = tempfile.mkstemp(prefix='hkml_tmp_mbox_')
-    with open(tmp_path, 'w') as f:
-        f.write(updated_content)
-    mails = __read_mbox_file(tmp_path)
-    os.remove(tmp_path)
+def read_mbox_file(filepath, max_nr_mails=None, mboxrd=False):
+    mails = []
+    for mail in iter_mbox_file_mails(filepath, mboxrd):
+        if max_nr_mails is not None and len(mails) >= max_nr_mails:
+            break
+        mails.append(mail)
     return mails
 
 def read_mails_from_clipboard():
@@ -0,0 +1,172 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Read git blobs via long-lived 'git cat-file --batch' processes, instead of
+# forking 'git show' for each blob.
+
+import atexit
+import collections
+import os
+import subprocess
+import threading
+
+class CatFileBatch:
+    gitdir = None
+    proc = None
+
+    def __init__(self, gitdir):
+        self.gitdir = gitdir
+        self.proc = subprocess.Popen(
+                ['git', '--git-dir=%s' % gitdir, 'cat-file', '--batch'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL)
+
+    def read_response(self):
+        header = self.proc.stdout.readline()
+        if header == b'':
+            raise Exception('git cat-file --batch for %s terminated' %
+                            self.gitdir)
+        # '<oid> <type> <size>', or '<objname> missing' like error
+        fields = header.split()
+        if len(fields) != 3 or not fields[2].isdigit():
+            return None
+        content = self.proc.stdout.read(int(fields[2]))
+        # drop the trailing newline
+        self.proc.stdout.read(1)
+        return content
+
+    def read_many(self, objnames):
+        '''Return contents of the objects in bytes, in the order of objnames.
+        Content of objects that not found are None.'''
+        # write requests from another thread, so that git can stream the
+        # responses without waiting for each request.
+        def write_requests():
+            try:
+                for objname in objnames:
+                    self.proc.stdin.write(b'%s\n' % objname.encode())
+                self.proc.stdin.flush()
+            except OSError:
+                # the process is terminated.  read_response() will fail.
+                pass
+
+        writer = threading.Thread(target=write_requests)
+        writer.start()
+        contents = [self.read_response() for objname in objnames]
+        writer.join()
+        return contents
+
+    def close(self):
+        '''Terminate the process.  The process might be broken, or in the
+        middle of writing responses that nobody will read'''
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+# gitdir to CatFileBatch map
+batches = {}
+
+class PrefetchedBlobs:
+    '''(gitdir, objname) to prefetched content map.  Each entry is removed
+    when it is read via read_blob().  Oldest entries are dropped if total
+    length of the contents exceeds max_bytes, since some prefetched blobs
+    are never read, e.g., those of mails that filtered out'''
+    max_bytes = None
+    nr_bytes = None
+    blobs = None
+    lock = None
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nr_bytes = 0
+        self.blobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.blobs
+
+    def __len__(self):
+        with self.lock:
+            return len(self.blobs)
+
+    def add(self, key, content):
+        with self.lock:
+            if key in self.blobs:
+                self.nr_bytes -= len(self.blobs.pop(key) or '')
+            self.blobs[key] = content
+            self.nr_bytes += len(content or '')
+            while self.nr_bytes > self.max_bytes and len(self.blobs) > 0:
+                _, old_content = self.blobs.popitem(last=False)
+                self.nr_bytes -= len(old_content or '')
+
+    def clear(self):
+        with self.lock:
+            self.blobs.clear()
+            self.nr_bytes = 0
+
+    def pop(self, key):
+        '''Return the content and remove it.  Return False if not
+        prefetched'''
+        with self.lock:
+            if not key in self.blobs:
+                return False
+            content = self.blobs.pop(key)
+            self.nr_bytes -= len(content or '')
+            return content
+
+# maximum total length of the prefetched blobs
+max_prefetched_bytes = 64 * 1024 * 1024
+
+prefetched_blobs = PrefetchedBlobs(max_prefetched_bytes)
+
+def get_batch(gitdir):
+    gitdir = os.path.abspath(gitdir)
+    if not gitdir in batches:
+        batches[gitdir] = CatFileBatch(gitdir)
+    return batches[gitdir]
+
+def close_batches():
+    for batch in batches.values():
+        try:
+            batch.close()
+        except:
+            pass
+    batches.clear()
+
+atexit.register(close_batches)
+
+def decode_blob(content):
+    try:
+        return content.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return content.decode('cp437').strip()
+
+def read_blobs(gitdir, objnames):
+    '''Return decoded contents of the blobs, in the order of objnames'''
+    try:
+        contents = get_batch(gitdir).read_many(objnames)
+    except Exception:
+        # the process might be broken.  Retry with a new one.
+        batches.pop(os.path.abspath(gitdir)).close()
+        contents = get_batch(gitdir).read_many(objnames)
+    return [decode_blob(c) if c is not None else None for c in contents]
+
+def read_blob(gitdir, objname):
+    '''Return decoded content of the blob, or None if not found'''
+    content = prefetched_blobs.pop((os.path.abspath(gitdir), objname))
+    if content is not False:
+        return content
+    return read_blobs(gitdir, [objname])[0]
+
+def prefetch_blobs(gitdir, objnames):
+    '''Read the blobs in advance, for later read_blob() calls'''
+    gitdir = os.path.abspath(gitdir)
+    objnames = [o for o in objnames if not (gitdir, o) in prefetched_blobs]
+    if len(objnames) == 0:
+        return
+    contents = read_blobs(gitdir, objnames)
+    for objname, content in zip(objnames, contents):
+        prefetched_blobs.add((gitdir, objname), content)
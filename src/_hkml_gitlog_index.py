@@ -0,0 +1,252 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Per-epoch index of mails in mailing list archive git repos.
+#
+# The index is a text file under 'gitlog_index' dir of the hkml dir, at the
+# path of the epoch git dir relative to the 'archives' dir, e.g.,
+# 'gitlog_index/damon/git/0.git'.  The first line is the commit id of the tip that the index is updated for.
+# Each of the remaining lines is for a mail, and has below space-separated
+# fields.
+#
+#     <commit> <author timestamp> <author date> <msgid> <in-reply-to> <subject>
+#
+# <in-reply-to> is the message id of the parent mail, or '-' if the mail is
+# not a reply.  The lines are sorted by the author timestamp, so that mails of
+# a date range can be found via a binary search on the file, and misordered
+# dates of git log output need no special handling.
+#
+# Building the index reads all mails of the epoch, so it is built only by
+# 'hkml fetch --build_gitlog_index'.  Once built, 'hkml fetch' updates it for
+# commits made after the last indexed tip.  The lines for the new commits are
+# merged with only the indexed lines that are not older than the new ones,
+# and the first line is invalidated while the file is modified.  If the index
+# is not up to date with the git repo, callers fall back to 'git log'.
+
+import os
+import subprocess
+
+import _hkml
+import _hkml_date
+import _hkml_git_batch
+import _hkml_state
+
+# number of mails to read at once
+read_chunk_sz = 1000
+# report progress of building the index for every this number of mails.
+# Should be a multiple of read_chunk_sz.
+progress_report_interval = 10000
+
+def index_path(mdir):
+    archives_dir = os.path.join(_hkml.get_hkml_dir(), 'archives')
+    mdir = os.path.abspath(mdir)
+    rel_path = os.path.relpath(mdir, archives_dir)
+    if rel_path.startswith('..'):
+        rel_path = mdir.lstrip(os.sep)
+    return os.path.join(_hkml.get_hkml_dir(), 'gitlog_index', rel_path)
+
+def remove_old_index(mdir):
+    '''Remove the index file that made in the git dir by old versions'''
+    old_path = os.path.join(mdir, 'hkml_gitlog_index')
+    if os.path.isfile(old_path):
+        os.remove(old_path)
+
+def index_exists(mdir):
+    return os.path.isfile(index_path(mdir))
+
+def git_tip(mdir):
+    try:
+        return subprocess.check_output(
+                ['git', '--git-dir=%s' % mdir, 'rev-parse', 'HEAD'],
+                stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None
+
+def read_index_tip(mdir):
+    if not os.path.isfile(index_path(mdir)):
+        return None
+    with open(index_path(mdir), 'rb') as f:
+        return f.readline().decode().strip()
+
+def header_msgid(raw_header, field_name):
+    if not field_name in raw_header:
+        return '-'
+    fields = raw_header[field_name][-1].split()
+    if len(fields) == 0:
+        return '-'
+    return fields[0]
+
+def mails_reply_info(mdir, commits, report_progress):
+    '''Return a list of (msgid, in-reply-to msgid) of the commits' mails'''
+    infos = []
+    chunk_sz = read_chunk_sz
+    for i in range(0, len(commits), chunk_sz):
+        if report_progress is not None and i > 0 and \
+                i % progress_report_interval == 0:
+            report_progress('indexing %s: %d/%d mails' %
+                            (mdir, i, len(commits)))
+        mboxes = _hkml_git_batch.read_blobs(
+                mdir, ['%s:m' % c for c in commits[i:i + chunk_sz]])
+        for mbox in mboxes:
+            if mbox is None:
+                infos.append(['-', '-'])
+                continue
+            raw_header, _ = _hkml.parse_mbox_raw_header(mbox)
+            infos.append([header_msgid(raw_header, 'message-id'),
+                          header_msgid(raw_header, 'in-reply-to')])
+    return infos
+
+def new_index_lines(mdir, commits_range, report_progress):
+    gitlog_lines = _hkml.cmd_lines_output(
+            ['git', '--git-dir=%s' % mdir, 'log', '--date=iso-strict',
+             '--pretty=%H %ad %s', commits_range])
+    entries = []
+    for line in gitlog_lines:
+        fields = line.split(' ', 2)
+        if len(fields) < 2:
+            continue
+        if len(fields) == 2:
+            fields.append('')
+        entries.append(fields)
+    infos = mails_reply_info(mdir, [e[0] for e in entries], report_progress)
+    lines = []
+    for (commit, date, subject), (msgid, in_reply_to) in zip(entries, infos):
+        timestamp = int(_hkml_date.parse_iso_date(date).timestamp())
+        lines.append(' '.join([commit, '%d' % timestamp, date, msgid,
+                               in_reply_to, subject]))
+    return lines
+
+def line_timestamp(line):
+    return int(line.split(b' ', 2)[1])
+
+def str_line_timestamp(line):
+    return int(line.split(' ', 2)[1])
+
+def write_index(mdir, tip, lines):
+    '''Write the index from scratch'''
+    lines = sorted(lines, key=str_line_timestamp)
+    _hkml_state.write_atomic(index_path(mdir),
+                             '\n'.join([tip] + lines) + '\n')
+
+def append_index_lines(mdir, tip, lines):
+    '''Add lines for new commits to the index'''
+    lines = sorted(lines, key=str_line_timestamp)
+    with open(index_path(mdir), 'r+b') as f:
+        f.readline()
+        data_start = f.tell()
+        file_sz = os.fstat(f.fileno()).st_size
+        # invalidate the index while modifying it
+        f.seek(0)
+        f.write(b'0' * len(tip))
+        f.flush()
+        if len(lines) > 0:
+            # new commits are usually newer than the indexed ones.  Merge only
+            # the indexed lines that not older than the oldest new one.
+            offset = first_line_offset_after(
+                    f, data_start, file_sz, str_line_timestamp(lines[0]))
+            f.seek(offset)
+            tail = [l for l in f.read().decode().split('\n') if l]
+            # sorted() is stable, so indexed lines keep their order
+            lines = sorted(tail + lines, key=str_line_timestamp)
+            f.seek(offset)
+            f.truncate()
+            f.write(('\n'.join(lines) + '\n').encode())
+            f.flush()
+        f.seek(0)
+        f.write(tip.encode())
+
+def update_index(mdir, report_progress=None):
+    '''Update the index for commits made after the last update, or build it
+    if it doesn't exist.  report_progress is called with progress messages
+    if it is not None.  Returns an error'''
+    tip = git_tip(mdir)
+    if tip is None:
+        return 'cannot get tip of %s' % mdir
+    remove_old_index(mdir)
+    os.makedirs(os.path.dirname(index_path(mdir)), exist_ok=True)
+    with _hkml_state.FileLock(index_path(mdir)):
+        old_tip = read_index_tip(mdir)
+        if old_tip == tip:
+            return None
+        # invalidated index is built from scratch
+        if old_tip is not None and len(old_tip) == len(tip) and \
+                old_tip != '0' * len(tip):
+            try:
+                lines = new_index_lines(
+                        mdir, '%s..%s' % (old_tip, tip), report_progress)
+            except Exception:
+                # maybe old tip has gone.  Build from scratch.
+                lines = None
+            if lines is not None:
+                append_index_lines(mdir, tip, lines)
+                return None
+        try:
+            lines = new_index_lines(mdir, tip, report_progress)
+        except Exception as e:
+            return 'indexing %s failed (%s)' % (mdir, e)
+        write_index(mdir, tip, lines)
+    return None
+
+def first_line_offset_after(f, data_start, file_sz, timestamp):
+    '''Return offset of the first line having timestamp >= given one'''
+    def line_offset_from(offset):
+        # first line start offset from given offset
+        f.seek(offset - 1)
+        f.readline()
+        return f.tell()
+
+    def line_is_after(offset):
+        line_offset = line_offset_from(offset)
+        if line_offset >= file_sz:
+            return True
+        return line_timestamp(f.readline()) >= timestamp
+
+    lo, hi = data_start, file_sz
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if line_is_after(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return line_offset_from(lo)
+
+def get_gitlog_lines(mdir, since, until, max_nr_mails, min_nr_mails):
+    '''Return 'git log --pretty="%H %ad %s"'-like lines for mails in the
+    date range, newest first.  If min_nr_mails is not None, return
+    min_nr_mails newest mails before until, ignoring since.  Return None if
+    the index is unavailable or outdated.'''
+    tip = read_index_tip(mdir)
+    if tip is None or tip != git_tip(mdir):
+        return None
+
+    file_sz = os.path.getsize(index_path(mdir))
+    with open(index_path(mdir), 'rb') as f:
+        f.readline()
+        data_start = f.tell()
+        start = data_start
+        if since is not None and min_nr_mails is None:
+            start = first_line_offset_after(
+                    f, data_start, file_sz, int(since.timestamp()))
+        end = file_sz
+        if until is not None:
+            end = first_line_offset_after(
+                    f, data_start, file_sz, int(until.timestamp()) + 1)
+        if end <= start:
+            return []
+        f.seek(start)
+        index_lines = f.read(end - start).decode().split('\n')
+        # the index could be updated in the meantime
+        f.seek(0)
+        if f.readline().decode().strip() != tip:
+            return None
+
+    lines = []
+    for index_line in reversed(index_lines):
+        fields = index_line.split(' ', 5)
+        if len(fields) < 6:
+            continue
+        lines.append(' '.join([fields[0], fields[2], fields[5]]))
+    if min_nr_mails is not None:
+        return lines[:int(min_nr_mails)]
+    if max_nr_mails is not None:
+        return lines[:int(max_nr_mails)]
+    return lines
@@ -2,10 +2,12 @@
 # SPDX-License-Identifier: GPL-2.0
 
 import datetime
+import hashlib
 import os
 import json
 
 import _hkml
+import _hkml_state
 import hkml_list
 
 '''
@@ -23,22 +25,21 @@ def get_last_cursor_positions():
     global last_cursor_positions
 
     if last_cursor_positions is None:
-        if not os.path.isfile(last_cursor_positions_file_path()):
-            last_cursor_positions = {}
-        else:
-            with open(last_cursor_positions_file_path(), 'r') as f:
-                last_cursor_positions = json.load(f)
+        last_cursor_positions = _hkml_state.read_json(
+                last_cursor_positions_file_path(), default={})
     return last_cursor_positions
 
-def writeback_last_cursor_positions():
-    last_cursor_positions = get_last_cursor_positions()
-    with open(last_cursor_positions_file_path(), 'w') as f:
-        json.dump(last_cursor_positions, f, indent=4)
+def set_cursor_position(positions, cache_key, position):
+    positions[cache_key] = position
+    return positions
 
 def record_last_cursor_position(cache_key, position):
-    last_cursor_positions = get_last_cursor_positions()
-    last_cursor_positions[cache_key] = position
-    writeback_last_cursor_positions()
+    set_cursor_position(get_last_cursor_positions(), cache_key, position)
+    _hkml_state.update_json(
+            last_cursor_positions_file_path(),
+            lambda positions: set_cursor_position(
+                positions, cache_key, position),
+            default={}, defer=True)
 
 def get_last_cursor_position(cache_key):
     '''
@@ -65,28 +66,28 @@ def get_cache_history():
     global cache_history
 
     if cache_history is None:
-        if not os.path.isfile(cache_history_file_path()):
-            cache_history = {}
-        else:
-            with open(cache_history_file_path(), 'r') as f:
-                cache_history = json.load(f)
+        cache_history = _hkml_state.read_json(
+                cache_history_file_path(), default={})
     return cache_history
 
-def writeback_cache_history():
-    history = get_cache_history()
-    with open(cache_history_file_path(), 'w') as f:
-        json.dump(history, f, indent=4)
-
-def record_cache_creation(cache_key):
-    history = get_cache_history()
+def add_cache_creation_date(history, cache_key, date_str):
     if not cache_key in history:
         history[cache_key] = {}
     create_dates = []
     if 'create_dates' in history[cache_key]:
         create_dates = history[cache_key]['create_dates'][-9:]
-    create_dates.append(datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S'))
+    create_dates.append(date_str)
     history[cache_key]['create_dates'] = create_dates
-    writeback_cache_history()
+    return history
+
+def record_cache_creation(cache_key):
+    date_str = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+    add_cache_creation_date(get_cache_history(), cache_key, date_str)
+    _hkml_state.update_json(
+            cache_history_file_path(),
+            lambda history: add_cache_creation_date(
+                history, cache_key, date_str),
+            default={}, defer=True)
 
 def get_cache_creation_dates(key):
     history = get_cache_history()
@@ -105,40 +106,135 @@ command, or 'thread_output' of generated by thread command.
 Values are a dict containing below key/values.
 - 'output': formatted text to display the mails list.
 - 'mail_items': a list of MailListMailItem.to_kvpairs() outputs
-- 'date': last accessed date
+- 'date': last accessed date.  Saved in only the index file, described below.
 - 'create_date': created date.  Removed after v1.1.7.
 - 'create_dates': last up to ten created dates of same key.  Removed after v1.1.9.
+
+Each value is saved in its own file under 'list_output_cache.d' directory,
+while the last accessed dates of all keys are saved in 'index' file of the
+directory.  Hence finding the last list or updating the last accessed date
+reads and writes only the index file and the file for the key.  All values
+were saved in one 'list_output_cache' file until v1.6.6.
+
+mails_lists_cache is the content of the index file.  Keys are the cache keys.
+Values are a dict containing below key/values.
+- 'file': name of the file for the value.
+- 'date': last accessed date.
 '''
 mails_lists_cache = None
+# loaded values.  keys are the cache keys.
+cached_list_outputs = {}
+# keys of values that need to be written back
+dirty_keys = set()
+# files of deleted values
+files_to_remove = set()
+need_index_update = False
 
 def list_output_cache_file_path():
     return os.path.join(_hkml.get_hkml_dir(), 'list_output_cache')
 
+def list_output_cache_dir_path():
+    return os.path.join(_hkml.get_hkml_dir(), 'list_output_cache.d')
+
+def list_output_cache_index_path():
+    return os.path.join(list_output_cache_dir_path(), 'index')
+
+def list_output_file_name(key):
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def set_cached_list_outputs(key, outputs, date_str):
+    global need_index_update
+
+    cache = get_mails_lists_cache()
+    cache[key] = {'file': list_output_file_name(key), 'date': date_str}
+    cached_list_outputs[key] = outputs
+    dirty_keys.add(key)
+    need_index_update = True
+
+def migrate_list_output_cache_file():
+    '''Convert the old list_output_cache file into the per-key files'''
+    with open(list_output_cache_file_path(), 'r') as f:
+        old_cache = json.load(f)
+    if old_cache is None:
+        old_cache = {}
+    for key, outputs in old_cache.items():
+        set_cached_list_outputs(key, outputs, outputs.pop('date', ''))
+    writeback_list_output()
+    os.remove(list_output_cache_file_path())
+
 def get_mails_lists_cache():
     global mails_lists_cache
 
-    if mails_lists_cache is None:
-        if not os.path.isfile(list_output_cache_file_path()):
-            mails_lists_cache = {}
-        else:
-            with open(list_output_cache_file_path(), 'r') as f:
-                mails_lists_cache = json.load(f)
     if mails_lists_cache is None:
         mails_lists_cache = {}
+        if os.path.isfile(list_output_cache_index_path()):
+            with open(list_output_cache_index_path(), 'r') as f:
+                mails_lists_cache = json.load(f)
+        elif os.path.isfile(list_output_cache_file_path()):
+            migrate_list_output_cache_file()
     return mails_lists_cache
 
 def writeback_list_output():
+    global need_index_update
+
+    cache = get_mails_lists_cache()
+    if not os.path.isdir(list_output_cache_dir_path()):
+        os.mkdir(list_output_cache_dir_path())
+    for key in dirty_keys:
+        if not key in cache:
+            continue
+        _hkml_state.write_json(
+                os.path.join(list_output_cache_dir_path(),
+                             cache[key]['file']),
+                cached_list_outputs[key], indent=None)
+    dirty_keys.clear()
+    for file_name in files_to_remove:
+        path = os.path.join(list_output_cache_dir_path(), file_name)
+        for file_path in [path, _hkml_state.lock_file_path(path)]:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+    files_to_remove.clear()
+    if need_index_update:
+        _hkml_state.write_json(list_output_cache_index_path(), cache)
+        need_index_update = False
+
+def load_list_outputs(key):
     cache = get_mails_lists_cache()
-    with open(list_output_cache_file_path(), 'w') as f:
-        json.dump(cache, f, indent=4)
+    if not key in cache:
+        return None
+    if not key in cached_list_outputs:
+        try:
+            with open(os.path.join(list_output_cache_dir_path(),
+                                   cache[key]['file']), 'r') as f:
+                cached_list_outputs[key] = json.load(f)
+        except (OSError, ValueError):
+            del_cached_list_outputs(key)
+            return None
+    return cached_list_outputs[key]
+
+def del_cached_list_outputs(key):
+    global need_index_update
 
-def get_cached_list_outputs(key):
     cache = get_mails_lists_cache()
     if not key in cache:
+        return
+    files_to_remove.add(cache[key]['file'])
+    del cache[key]
+    if key in cached_list_outputs:
+        del cached_list_outputs[key]
+    dirty_keys.discard(key)
+    need_index_update = True
+
+def get_cached_list_outputs(key):
+    global need_index_update
+
+    outputs = load_list_outputs(key)
+    if outputs is None:
         return None
-    outputs = cache[key]
     # update last accessed date
-    outputs['date'] = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+    date_str = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+    get_mails_lists_cache()[key]['date'] = date_str
+    need_index_update = True
     return outputs
 
 def mail_items_from_kvpairs(kvpairs):
@@ -155,16 +251,17 @@ def get_list_for(key):
         mail_items=mail_items_from_kvpairs(outputs.get('mail_items', [])),
         line_nr_mail_idx_map=None)
 
-def get_last_list(except_thread=True):
+def keys_sorted_by_date():
     cache = get_mails_lists_cache()
+    return sorted(cache.keys(), key=lambda x: cache[x]['date'])
+
+def get_last_list(except_thread=True):
+    keys = keys_sorted_by_date()
     if except_thread is True:
-        keys = [k for k in cache if k != 'thread_output']
-    else:
-        keys = [k for k in cache]
+        keys = [k for k in keys if k != 'thread_output']
     if not keys:
         return None
-    key = sorted(keys, key=lambda x: cache[x]['date'])[-1]
-    return get_list_for(key)
+    return get_list_for(keys[-1])
 
 def get_last_thread():
     outputs = get_cached_list_outputs('thread_output')
@@ -183,9 +280,11 @@ def invalidate_cached_outputs(source):
         except:
             pass
     for key in keys_to_del:
-        del cache[key]
+        del_cached_list_outputs(key)
 
-def set_item(key, list_data, keep_date=False):
+def set_item(key, list_data, keep_date=False, defer=False):
+    '''Cache list_data for the key.  If defer is True, the files are written
+    at the next _hkml_state.flush()'''
     list_str = list_data.text
     if list_data.mail_items is None:
         mail_items = None
@@ -193,11 +292,12 @@ def set_item(key, list_data, keep_date=False):
         mail_items = [i.to_kvpairs() for i in list_data.mail_items]
     cache = get_mails_lists_cache()
     changed = True
-    if key in cache:
+    old_outputs = load_list_outputs(key)
+    if old_outputs is not None:
         changed = True
-        if 'mail_items' in cache[key]:
-            changed = cache[key]['mail_items'] != mail_items
-    if keep_date is False:
+        if 'mail_items' in old_outputs:
+            changed = old_outputs['mail_items'] != mail_items
+    if keep_date is False or old_outputs is None:
         date_str = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
     else:
         date_str = cache[key]['date']
@@ -216,34 +316,37 @@ def set_item(key, list_data, keep_date=False):
         list_str = '# (cached output)\n%s' % list_str
 
 
-    cache[key] = {
+    set_cached_list_outputs(key, {
             'output': list_str,
             'mail_items': mail_items,
-            'date': date_str,        # last referenced date
-            }
+            }, date_str)
     max_cache_sz = 64
     if len(cache) == max_cache_sz:
-        keys = sorted(cache.keys(), key=lambda x: cache[x]['date'])
-        del cache[keys[0]]
-    writeback_list_output()
+        del_cached_list_outputs(keys_sorted_by_date()[0])
+    if defer:
+        _hkml_state.defer_call(list_output_cache_dir_path(),
+                               writeback_list_output)
+    else:
+        writeback_list_output()
     if changed and keep_date is False:
         record_cache_creation(key)
 
 def get_mail(idx, not_thread_idx=False):
-    cache = get_mails_lists_cache()
-    sorted_keys = sorted(cache.keys(), key=lambda x: cache[x]['date'])
+    sorted_keys = keys_sorted_by_date()
     if not_thread_idx and sorted_keys[-1] == 'thread_output':
         last_key = sorted_keys[-2]
     else:
         last_key = sorted_keys[-1]
-    outputs = cache[last_key]
-    list_data = get_list_for(last_key)
-    if list_data is None:
+    outputs = get_cached_list_outputs(last_key)
+    if outputs is None or not 'mail_items' in outputs:
         return None
-    if idx >= len(list_data.mail_items):
+    if idx >= len(outputs['mail_items']):
         return None
-    list_data.mail_items[idx].set_mail()
-    mail = list_data.mail_items[idx].mail
+    # decode only the item of the index
+    mail_item = hkml_list.MailListMailItem.from_kvpairs(
+            outputs['mail_items'][idx])
+    mail_item.set_mail()
+    mail = mail_item.mail
     if mail is None:
         return None
 
@@ -253,6 +356,7 @@ def get_mail(idx, not_thread_idx=False):
     output_string_lines = ['# last reference: %d' % idx,
                            '#'] + output_string_lines
     outputs['output'] = '\n'.join(output_string_lines)
+    dirty_keys.add(last_key)
     writeback_list_output()
 
     return mail
@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Delivery queue for monitoring results notification mails.
+#
+# Notifications are sent by a background thread, so that slow or failing
+# mail delivery doesn't block the monitoring.  Notifications for same
+# recipients that made within a digest window are sent as one mail.  Failed
+# deliveries are retried after increasing delays.
+
+import datetime
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+
+import _hkml
+
+class NotiMail:
+    # list of mail addresses
+    recipients = None
+    # list of (monitor request name, notification text)
+    notis = None
+    # time to send the mail
+    send_time = None
+    nr_failures = None
+
+    def __init__(self, recipients, send_time):
+        self.recipients = recipients
+        self.notis = []
+        self.send_time = send_time
+        self.nr_failures = 0
+
+    def subject(self):
+        if len(self.notis) == 1:
+            return '[hkml-noti] for monitor request %s' % self.notis[0][0]
+        return '[hkml-noti] %d notifications for monitor requests %s' % (
+                len(self.notis), ', '.join(
+                    sorted(set(['%s' % name for name, _ in self.notis]))))
+
+    def content(self):
+        return '\n'.join([
+            'Subject: %s' % self.subject(), '',
+            '\n\n'.join([text for _, text in self.notis])])
+
+def send_mail_git(recipients, content):
+    fd, tmp_path = tempfile.mkstemp(prefix='hkml_monitor_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    try:
+        _hkml.cmd_str_output(['git', 'send-email', tmp_path,
+                              '--8bit-encoding=UTF-8', '--confirm', 'never',
+                              '--to'] + recipients)
+    except Exception as e:
+        return 'git send-email fail (%s)' % e
+    finally:
+        os.remove(tmp_path)
+    return None
+
+def send_mail_sendmail(recipients, content, sendmail_cmd):
+    '''Send the mail using sendmail-like command, which receives the
+    recipients as arguments, and the mail via stdin'''
+    content = '\n'.join([
+        'To: %s' % ', '.join(recipients),
+        'Date: %s' % datetime.datetime.now().astimezone().strftime(
+            '%a, %d %b %Y %H:%M:%S %z'),
+        content])
+    try:
+        subprocess.run(shlex.split(sendmail_cmd) + recipients,
+                       input=content.encode(), check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError) as e:
+        return '%s fail (%s)' % (sendmail_cmd, e)
+    return None
+
+class NotiQueue:
+    # seconds to wait for more notifications for same recipients
+    digest_window = None
+    # sendmail-like command to use instead of 'git send-email'
+    sendmail_cmd = None
+    # seconds to wait before retrying a failed delivery
+    retry_delays = [60, 300, 1800]
+
+    mails = None
+    cond = None
+    thread = None
+    stopping = False
+
+    def __init__(self, digest_window=0, sendmail_cmd=None):
+        self.digest_window = digest_window
+        self.sendmail_cmd = sendmail_cmd
+        self.mails = []
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Send pending mails without waiting for the digest window, and
+        stop the thread'''
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join()
+
+    def add(self, recipients, request_name, noti_text):
+        with self.cond:
+            mail = None
+            for m in self.mails:
+                if m.recipients == recipients and m.nr_failures == 0:
+                    mail = m
+                    break
+            if mail is None:
+                mail = NotiMail(recipients, time.time() + self.digest_window)
+                self.mails.append(mail)
+            mail.notis.append([request_name, noti_text])
+            self.cond.notify()
+
+    def send(self, mail):
+        if self.sendmail_cmd is None:
+            return send_mail_git(mail.recipients, mail.content())
+        return send_mail_sendmail(mail.recipients, mail.content(),
+                                  self.sendmail_cmd)
+
+    def handle_failure(self, mail, err):
+        mail.nr_failures += 1
+        if self.stopping or mail.nr_failures > len(self.retry_delays):
+            print('giving up sending noti mail to %s (%s)' %
+                  (', '.join(mail.recipients), err))
+            return
+        delay = self.retry_delays[mail.nr_failures - 1]
+        print('sending noti mail failed (%s).  Retry after %d seconds' %
+              (err, delay))
+        mail.send_time = time.time() + delay
+        with self.cond:
+            self.mails.append(mail)
+
+    def __run(self):
+        while True:
+            with self.cond:
+                now = time.time()
+                mails_to_send = [m for m in self.mails
+                                 if self.stopping or m.send_time <= now]
+                if len(mails_to_send) == 0:
+                    if self.stopping:
+                        return
+                    timeout = None
+                    if len(self.mails) > 0:
+                        timeout = min([m.send_time for m in self.mails]) - now
+                    self.cond.wait(timeout)
+                    continue
+                for mail in mails_to_send:
+                    self.mails.remove(mail)
+
+            for mail in mails_to_send:
+                err = self.send(mail)
+                if err is not None:
+                    self.handle_failure(mail, err)
@@ -0,0 +1,367 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Local search engine for public-inbox search query strings.
+#
+# Emulates the public-inbox search query syntax on the locally fetched
+# mailing list archives, so that 'hkml list --pisearch' works without the
+# network for locally mirrored mailing lists.  Supported syntax is below.
+#
+#     <prefix>:<term>   term for the prefix's fields.  Prefixes are s
+#                       (subject), f (from), t (to), c (cc), tc (to and cc),
+#                       a (from, to and cc), b (body), bs (subject and body),
+#                       m (message-id), and d/dt/rt (date range).
+#     <term>            term for subject, from, to, cc and body.
+#     "<words>"         phrase term.
+#     -<term>, NOT      negation.
+#     AND, OR           conjunction (default) and disjunction.  OR has lower
+#                       precedence than AND.  Parentheses are not supported.
+#
+# Date ranges are '<date>..<date>', '<date>..', '..<date>' or '<date>', where
+# <date> is YYYYMMDD, YYYYMMDDHHMMSS, '<N>.<unit>.ago' or what
+# _hkml_date.parse_date() supports.  Unlike public-inbox, which matches words
+# with stemming, terms are matched as case-insensitive substrings.  Queries
+# that don't bound the date of the mails search only mails of last
+# default_search_days days, to avoid scanning the whole history.
+#
+# Queries can also be given in the URL-encoded form of public-inbox search
+# URLs, e.g., 's:foo+d:2.weeks.ago..'.
+
+import datetime
+import os
+import shlex
+import string
+import urllib.parse
+
+import _hkml
+import _hkml_date
+import _hkml_git_batch
+import hkml_config
+import hkml_list
+
+prefix_fields = {
+        's': ['subject'], 'f': ['from'], 't': ['to'], 'c': ['cc'],
+        'tc': ['to', 'cc'], 'a': ['from', 'to', 'cc'], 'b': ['body'],
+        'bs': ['subject', 'body'], 'm': ['message-id'],
+        '': ['subject', 'from', 'to', 'cc', 'body']}
+date_prefixes = ['d', 'dt', 'rt']
+
+# public-inbox returns up to 200 search results
+default_max_nr_mails = 200
+# date range of the search for queries having no date bound
+default_search_days = 365
+
+# characters that can be in URL query strings without being encoded
+url_query_chars = set(string.ascii_letters + string.digits +
+                      "-._~+%:=&!$'*,;/?@")
+
+class QueryTerm:
+    fields = None       # None for date terms
+    value = None        # lowercase value for non-date terms
+    since = None
+    until = None
+    negated = False
+
+def parse_date_point(date_str, is_end):
+    '''Return datetime of a date range point and an error'''
+    if date_str == '':
+        return None, None
+    if date_str.isdigit() and len(date_str) in [8, 14]:
+        numbers = [int(date_str[:4]), int(date_str[4:6]), int(date_str[6:8])]
+        if len(date_str) == 14:
+            numbers += [int(date_str[8:10]), int(date_str[10:12]),
+                        int(date_str[12:14])]
+        try:
+            the_date = datetime.datetime(*numbers).astimezone()
+        except ValueError as e:
+            return None, '%s' % e
+    else:
+        fields = date_str.split('.')
+        if len(fields) == 3 and fields[2] == 'ago' and fields[0].isdigit():
+            units = {'minutes': 1, 'hours': 60, 'days': 60 * 24,
+                     'weeks': 60 * 24 * 7, 'months': 60 * 24 * 30,
+                     'years': 60 * 24 * 365}
+            unit = fields[1] if fields[1].endswith('s') else fields[1] + 's'
+            if not unit in units:
+                return None, 'unsupported date unit (%s)' % fields[1]
+            return datetime.datetime.now().astimezone() - datetime.timedelta(
+                    minutes=int(fields[0]) * units[unit]), None
+        the_date, err = _hkml_date.parse_date(date_str.replace('.', ' '))
+        if err is not None:
+            return None, 'wrong date (%s, %s)' % (date_str, err)
+        if len(date_str.replace('.', ' ').split()) != 3:
+            return the_date, None
+    if is_end and the_date.hour == 0 and the_date.minute == 0 and \
+            the_date.second == 0:
+        # date-only end of range includes the day
+        the_date += datetime.timedelta(days=1, seconds=-1)
+    return the_date, None
+
+def parse_date_range(value):
+    '''Return since and until of a date range, and an error'''
+    if '..' in value:
+        start, end = value.split('..', 1)
+    else:
+        start, end = value, value
+    since, err = parse_date_point(start, False)
+    if err is not None:
+        return None, None, err
+    until, err = parse_date_point(end, True)
+    if err is not None:
+        return None, None, err
+    return since, until, None
+
+def is_url_encoded(query_str):
+    '''Return whether the query is the URL-encoded form, which encodes spaces
+    as '+' and literal '+' as '%2B'.  Consecutive, leading or trailing '+'
+    are taken as literal ones, e.g., 's:C++'.'''
+    if not '+' in query_str and not '%' in query_str:
+        return False
+    if '++' in query_str or query_str.startswith('+') or \
+            query_str.endswith('+'):
+        return False
+    for c in query_str:
+        if not c in url_query_chars:
+            return False
+    return True
+
+def parse_query(query_str):
+    '''Return a list of lists of QueryTerm (disjunction of conjunctions) and
+    an error'''
+    if is_url_encoded(query_str):
+        query_str = urllib.parse.unquote_plus(query_str)
+    try:
+        tokens = shlex.split(query_str)
+    except ValueError as e:
+        return None, 'wrong query (%s)' % e
+    groups = [[]]
+    negate_next = False
+    for token in tokens:
+        if token == 'AND':
+            continue
+        if token == 'OR':
+            groups.append([])
+            continue
+        if token == 'NOT':
+            negate_next = True
+            continue
+        if token.startswith('(') or token.endswith(')'):
+            return None, 'parentheses are not supported'
+
+        term = QueryTerm()
+        term.negated = negate_next
+        negate_next = False
+        if token.startswith('-') and len(token) > 1:
+            term.negated = not term.negated
+            token = token[1:]
+        prefix = ''
+        value = token
+        if ':' in token and token.split(':')[0] in \
+                list(prefix_fields.keys()) + date_prefixes:
+            prefix, value = token.split(':', 1)
+        if prefix in date_prefixes:
+            term.since, term.until, err = parse_date_range(value)
+            if err is not None:
+                return None, err
+        else:
+            term.fields = prefix_fields[prefix]
+            term.value = value.lower()
+            if prefix == 'm':
+                term.value = term.value.strip('<>')
+        groups[-1].append(term)
+    groups = [g for g in groups if len(g) > 0]
+    if len(groups) == 0:
+        return None, 'empty query'
+    return groups, None
+
+def group_date_range(group):
+    '''Return a date range that covers all mails the conjunction can match'''
+    since, until = None, None
+    for term in group:
+        if term.fields is not None or term.negated:
+            continue
+        if term.since is not None and (since is None or term.since > since):
+            since = term.since
+        if term.until is not None and (until is None or term.until < until):
+            until = term.until
+    return since, until
+
+def query_date_range(groups):
+    '''Return a date range that covers all mails the query can match'''
+    ranges = [group_date_range(group) for group in groups]
+    sinces = [since for since, _ in ranges]
+    untils = [until for _, until in ranges]
+    since = None if None in sinces else min(sinces)
+    until = None if None in untils else max(untils)
+    return since, until
+
+def field_text(field, subject, mail):
+    '''Return the field's text, or None if it is unknown without the mail'''
+    if field == 'subject':
+        return subject
+    if mail is None:
+        return None
+    if field == 'body':
+        text = mail.get_body()
+    else:
+        text = mail.get_field(field)
+    if text is None:
+        return ''
+    if field == 'message-id':
+        return text.strip('<>').lower()
+    return text.lower()
+
+def term_matches(term, subject, date, mail):
+    '''Returns True, False, or None if unknown without the mail'''
+    if term.fields is None:
+        matches = ((term.since is None or date >= term.since) and
+                   (term.until is None or date <= term.until))
+    else:
+        matches = False
+        for field in term.fields:
+            text = field_text(field, subject, mail)
+            if text is None:
+                matches = None
+                continue
+            if field == 'message-id':
+                found = text == term.value
+            else:
+                found = term.value in text
+            if found:
+                matches = True
+                break
+    if matches is None:
+        return None
+    return matches is not term.negated
+
+def query_matches(groups, subject, date, mail):
+    '''Returns True, False, or None if unknown without the mail'''
+    subject = subject.lower()
+    answers = []
+    for group in groups:
+        answer = True
+        for term in group:
+            matches = term_matches(term, subject, date, mail)
+            if matches is False:
+                answer = False
+                break
+            if matches is None:
+                answer = None
+        if answer is True:
+            return True
+        answers.append(answer)
+    if None in answers:
+        return None
+    return False
+
+def search_mdir(mdir, groups, since, until, max_nr_mails, mails):
+    lines = hkml_list.get_mails_gitlog_lines(
+            mdir, since, until, None, None, None, use_min_nr_mails=False)
+    chunk_sz = 1000
+    for i in range(0, len(lines), chunk_sz):
+        matched_lines = []
+        lines_to_read = []
+        for line in lines[i:i + chunk_sz]:
+            fields = line.split(' ', 2)
+            if len(fields) < 3:
+                continue
+            date = _hkml_date.parse_iso_date(fields[1])
+            matches = query_matches(groups, fields[2], date, None)
+            if matches is True:
+                matched_lines.append(line)
+            elif matches is None:
+                lines_to_read.append([line, fields[0], fields[2], date])
+        if len(lines_to_read) > 0:
+            mboxes = _hkml_git_batch.read_blobs(
+                    mdir, ['%s:m' % l[1] for l in lines_to_read])
+            for (line, _, subject, date), mbox in zip(lines_to_read, mboxes):
+                if not mbox:
+                    continue
+                mail = _hkml.Mail.from_mbox_uncached(mbox)
+                if query_matches(groups, subject, date, mail):
+                    matched_lines.append(line)
+        # keep the newest-first order of the lines
+        matched_lines = set(matched_lines)
+        for line in lines[i:i + chunk_sz]:
+            if not line in matched_lines:
+                continue
+            mail = hkml_list.git_log_output_line_to_mail(line, mdir)
+            if mail is None or mail.mbox == '':
+                continue
+            mails.append(mail)
+            if len(mails) >= max_nr_mails:
+                return
+
+def is_mirrored(mailing_list):
+    '''Return whether the mailing list is fetched to this machine and local
+    search is enabled'''
+    config = hkml_config.read_config_file()
+    if config.get('pisearch-local', 'true').lower() in ['false', 'no', 'n',
+                                                        '0']:
+        return False
+    if not _hkml.is_valid_mail_list(mailing_list):
+        return False
+    for mdir in _hkml.mail_list_data_paths(mailing_list):
+        if os.path.isdir(mdir):
+            return True
+    return False
+
+def search_mails(mailing_list, query_str, max_nr_mails=None):
+    '''Return mails of the locally fetched mailing list that matches the
+    public-inbox search query, newest first, and an error'''
+    if max_nr_mails is None:
+        max_nr_mails = default_max_nr_mails
+    groups, err = parse_query(query_str)
+    if err is not None:
+        return None, err
+    since, until = query_date_range(groups)
+    since_defaulted = since is None
+    if since_defaulted:
+        if until is not None:
+            end = until
+        else:
+            end = datetime.datetime.now().astimezone()
+        since = end - datetime.timedelta(days=default_search_days)
+    mails = []
+    missing_mdirs = []
+    for mdir in _hkml.mail_list_data_paths(mailing_list):
+        if not os.path.isdir(mdir):
+            missing_mdirs.append(mdir)
+            continue
+        try:
+            search_mdir(mdir, groups, since, until, max_nr_mails, mails)
+        except Exception as e:
+            return None, 'searching %s failed (%s)' % (mdir, e)
+        if len(mails) >= max_nr_mails:
+            break
+    for notice in search_notices(mailing_list, since_defaulted, missing_mdirs,
+                                 len(mails), max_nr_mails):
+        print(notice)
+    return mails, None
+
+def search_notices(mailing_list, since_defaulted, missing_mdirs, nr_mails,
+                   max_nr_mails):
+    '''Return messages for letting users know how the local search result
+    could be different from that of public-inbox'''
+    notices = []
+    if nr_mails >= max_nr_mails:
+        notices.append('local search shows only newest %d matching mails' %
+                       max_nr_mails)
+    else:
+        if since_defaulted:
+            notices.append(' '.join([
+                'local search searched only mails of last %d days.' %
+                default_search_days,
+                'Add a d: term to search older mails.']))
+        if len(missing_mdirs) > 0:
+            notices.append(' '.join([
+                'local search searched only fetched epochs of %s,' %
+                mailing_list,
+                'while %d epochs are not fetched.' % len(missing_mdirs),
+                'Fetch those via \'hkml fetch %s --epochs %d\'.' % (
+                    mailing_list, len(_hkml.mail_list_data_paths(
+                        mailing_list)))]))
+    if len(notices) > 0:
+        notices.append(' '.join([
+            'To search via the public-inbox server, do',
+            '\'hkml config set pisearch-local false\'.']))
+    return notices
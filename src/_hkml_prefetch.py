@@ -0,0 +1,216 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Prefetch bodies of listed mails in background, for the mails list view.
+#
+# A worker thread reads and decodes bodies of the mails around the focused row
+# of the list first, and then those of the other mails of the list, into an
+# LRU cache of limited size.  Mail.get_body() looks up the cache, so opening
+# or searching the mails doesn't wait for git.
+
+import atexit
+import collections
+import threading
+
+import _hkml
+import _hkml_git_batch
+
+# maximum total length of the cached bodies
+max_cache_bytes = 64 * 1024 * 1024
+
+class BodyCache:
+    '''LRU cache of decoded mail bodies, keyed by (gitdir, gitid)'''
+    max_bytes = None
+    nr_bytes = None
+    bodies = None
+    lock = None
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nr_bytes = 0
+        self.bodies = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_body(self, mail):
+        key = (mail.gitdir, mail.gitid)
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None:
+                self.bodies.move_to_end(key)
+            return body
+
+    def has(self, key):
+        with self.lock:
+            return key in self.bodies
+
+    def add(self, key, body):
+        with self.lock:
+            if key in self.bodies:
+                self.nr_bytes -= len(self.bodies.pop(key))
+            self.bodies[key] = body
+            self.nr_bytes += len(body)
+            while self.nr_bytes > self.max_bytes and len(self.bodies) > 1:
+                _, old_body = self.bodies.popitem(last=False)
+                self.nr_bytes -= len(old_body)
+
+    def full(self):
+        with self.lock:
+            return self.nr_bytes >= self.max_bytes
+
+class BodyPrefetcher:
+    # number of mails before and after the focused one to prefetch first
+    window = 50
+    # number of mails to prefetch at once.  Switching to another list takes
+    # effect after the current batch.
+    batch_size = 16
+
+    cache = None
+    mail_items = None
+    focus_idx = None
+    # index of next mail_items to prefetch after the window
+    low_prio_idx = None
+    # keys of mails that tried for current mail_items
+    tried_keys = None
+
+    cond = None
+    thread = None
+    stopping = False
+    # gitdir to CatFileBatch, used by only the worker thread
+    batches = None
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.cond = threading.Condition()
+        self.batches = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join()
+        for batch in self.batches.values():
+            try:
+                batch.close()
+            except:
+                pass
+        self.batches.clear()
+
+    def set_focus(self, mail_items, focus_idx):
+        if mail_items is self.mail_items and focus_idx == self.focus_idx:
+            return
+        with self.cond:
+            if mail_items is not self.mail_items:
+                # switched to another list.  Stop prefetching the old one.
+                self.mail_items = mail_items
+                self.low_prio_idx = 0
+                self.tried_keys = set()
+            self.focus_idx = focus_idx
+            self.cond.notify()
+
+    def add_candidate(self, mail_item, mails):
+        mail = mail_item.mail
+        if mail is None or mail.gitid is None or mail.gitdir is None:
+            return
+        key = (mail.gitdir, mail.gitid)
+        if key in self.tried_keys:
+            return
+        self.tried_keys.add(key)
+        if self.cache.has(key):
+            return
+        mails.append(mail)
+
+    def next_batch(self):
+        '''Returns mails to prefetch next.  Should be called with the cond
+        lock held'''
+        mails = []
+        mail_items = self.mail_items
+        if mail_items is None or len(mail_items) == 0:
+            return mails
+        focus_idx = min(self.focus_idx, len(mail_items) - 1)
+        start = max(focus_idx - self.window, 0)
+        end = min(focus_idx + self.window + 1, len(mail_items))
+        # users usually scroll down
+        for idx in list(range(focus_idx, end)) + list(
+                range(focus_idx - 1, start - 1, -1)):
+            self.add_candidate(mail_items[idx], mails)
+            if len(mails) == self.batch_size:
+                return mails
+        # don't evict the bodies of the window for the other mails
+        if len(mails) > 0 or self.cache.full():
+            return mails
+        while self.low_prio_idx < len(mail_items) and \
+                len(mails) < self.batch_size:
+            self.add_candidate(mail_items[self.low_prio_idx], mails)
+            self.low_prio_idx += 1
+        return mails
+
+    def read_mboxes(self, gitdir, gitids):
+        if not gitdir in self.batches:
+            self.batches[gitdir] = _hkml_git_batch.CatFileBatch(
+                    _hkml.mail_gitdir_path(gitdir))
+        try:
+            contents = self.batches[gitdir].read_many(
+                    ['%s:m' % gitid for gitid in gitids])
+        except Exception:
+            # the process might be broken.  Use a new one next time.
+            self.batches.pop(gitdir).close()
+            return [None] * len(gitids)
+        return [_hkml_git_batch.decode_blob(c) if c is not None else None
+                for c in contents]
+
+    def prefetch(self, mails):
+        gitdir_gitids = {}
+        for mail in mails:
+            if not mail.gitdir in gitdir_gitids:
+                gitdir_gitids[mail.gitdir] = []
+            gitdir_gitids[mail.gitdir].append(mail.gitid)
+        for gitdir, gitids in gitdir_gitids.items():
+            for gitid, mbox in zip(gitids, self.read_mboxes(gitdir, gitids)):
+                if not mbox:
+                    continue
+                try:
+                    body = _hkml.Mail.from_mbox_uncached(mbox).get_body()
+                except Exception:
+                    continue
+                if body is not None:
+                    self.cache.add((gitdir, gitid), body)
+
+    def __run(self):
+        while True:
+            with self.cond:
+                mails = []
+                while not self.stopping:
+                    mails = self.next_batch()
+                    if len(mails) > 0:
+                        break
+                    self.cond.wait()
+                if self.stopping:
+                    return
+            self.prefetch(mails)
+
+prefetcher = None
+
+def stop():
+    global prefetcher
+
+    if prefetcher is None:
+        return
+    prefetcher.stop()
+    _hkml.prefetched_bodies = None
+    prefetcher = None
+
+def set_focus(mail_items, focus_idx):
+    '''Start prefetching bodies of the mails of mail_items, from those around
+    focus_idx-th one.  If mail_items is different from that of the last call,
+    stop prefetching for the old mail_items'''
+    global prefetcher
+
+    if prefetcher is None:
+        prefetcher = BodyPrefetcher(BodyCache(max_cache_bytes))
+        _hkml.prefetched_bodies = prefetcher.cache
+        prefetcher.start()
+        atexit.register(stop)
+    prefetcher.set_focus(mail_items, focus_idx)
@@ -6,14 +6,6 @@ https://sashiko.dev provides AI review results of kernel patches.  Fetch the
 results and show those on the terminal.
 '''
 
-requests_import_success = False
-
-try:
-    import requests
-    requests_import_success = True
-except:
-    pass
-
 class SashikoDevReview:
     result = None
     status = None
@@ -32,21 +24,30 @@ class SashikoDevReview:
 msgid_output_cache = {}
 session = None
 
+def get_session():
+    '''Return requests session and an error.  requests module is imported
+    here, since importing it takes long time'''
+    global session
+    if session is None:
+        try:
+            import requests
+        except:
+            # TODO: add more guide about how to install the module
+            return None, 'requests python module import fail'
+        session = requests.session()
+        session.headers.update({'User-Agent': 'hkml/1.5.4'})
+    return session, None
+
 def get_review(msgid):
     '''
     Return SashikoDevReview and an error
     '''
-    if requests_import_success is False:
-        # TODO: add more guide about how to install the module
-        return None, 'requests python module import fail'
-
     if msgid in msgid_output_cache:
         return msgid_output_cache[msgid], None
 
-    global session
-    if session is None:
-        session = requests.session()
-        session.headers.update({'User-Agent': 'hkml/1.5.4'})
+    session, err = get_session()
+    if err is not None:
+        return None, err
     resp = session.get('https://sashiko.dev/api/patch',
                        params={'id': msgid}, timeout=10)
     if resp.status_code != 200:
@@ -79,10 +80,9 @@ def get_reviews(msgid):
     '''
     Return SashikoDevReview objects for the thread and an error
     '''
-    global session
-    if session is None:
-        session = requests.session()
-        session.headers.update({'User-Agent': 'hkml/1.5.4'})
+    session, err = get_session()
+    if err is not None:
+        return None, err
     resp = session.get('https://sashiko.dev/api/patch',
                        params={'id': msgid}, timeout=10)
     if resp.status_code != 200:
@@ -0,0 +1,336 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Full-text search index of the cached mails.
+#
+# The index is kept in the sqlite mails cache database, in below tables.
+#
+#     search_docs(id, key, mail_rowid)
+#         mails cache keys of the indexed mails, and rowids of the mails table
+#         entries that are indexed.  Mails of changed rowids are indexed again.
+#     search_tokens(id, token)
+#         tokens found in the indexed mails.
+#     search_token_trigrams(trigram, token_id)
+#         substrings of three characters of the tokens that are not longer
+#         than max_trigram_token_len.  Tokens having a keyword of three or more
+#         characters are found by intersecting the tokens having each trigram
+#         of the keyword, and checking the tokens.  Longer tokens, and tokens
+#         for shorter keywords, are scanned.
+#     search_postings(token_id, doc_id, fields)
+#         mails having the token, and bitmask of the fields (field_bits) that
+#         have the token.
+#
+# Tokens are case-preserved maximal sequences of word characters.  Hence a
+# keyword consisting of only word characters is in a field if and only if it
+# is a substring of a token of the field.  For other keywords, the index gives
+# only candidate mails, and callers should check the real field values.
+#
+# The index is updated for all cached mails by 'hkml search', and for each
+# mail that its body is checked without the index by the list filter.
+
+import json
+import re
+
+import _hkml
+import hkml_cache
+
+field_bits = {'from': 1, 'to': 2, 'cc': 4, 'subject': 8, 'body': 16}
+token_pattern = re.compile(r'\w+')
+# longer tokens, e.g., base64-encoded lines, are not trigram-indexed
+max_trigram_token_len = 64
+
+tables_initialized = False
+
+def get_conn():
+    '''Return sqlite connection having the index tables, or None if the cache
+    backend doesn't support the index'''
+    global tables_initialized
+
+    if hkml_cache.cache_backend() != 'sqlite':
+        return None
+    conn = hkml_cache.get_sqlite_conn()
+    if tables_initialized is True:
+        return conn
+    conn.execute(
+            'CREATE TABLE IF NOT EXISTS search_docs '
+            '(id INTEGER PRIMARY KEY, key TEXT UNIQUE, mail_rowid INTEGER)')
+    conn.execute(
+            'CREATE TABLE IF NOT EXISTS search_tokens '
+            '(id INTEGER PRIMARY KEY, token TEXT UNIQUE)')
+    conn.execute(
+            'CREATE TABLE IF NOT EXISTS search_postings '
+            '(token_id INTEGER, doc_id INTEGER, fields INTEGER, '
+            'PRIMARY KEY (token_id, doc_id)) WITHOUT ROWID')
+    conn.execute(
+            'CREATE INDEX IF NOT EXISTS search_postings_doc '
+            'ON search_postings (doc_id)')
+    conn.execute(
+            'CREATE INDEX IF NOT EXISTS search_tokens_length '
+            'ON search_tokens (length(token))')
+    conn.execute(
+            'CREATE TABLE IF NOT EXISTS search_token_trigrams '
+            '(trigram TEXT, token_id INTEGER, '
+            'PRIMARY KEY (trigram, token_id)) WITHOUT ROWID')
+    build_token_trigrams(conn)
+    tables_initialized = True
+    return conn
+
+def trigrams(text):
+    return set([text[i:i + 3] for i in range(len(text) - 2)])
+
+def token_trigrams(token_ids):
+    '''Return rows of search_token_trigrams for the tokens of the ids'''
+    return [[trigram, token_id] for token, token_id in token_ids.items()
+            if len(token) <= max_trigram_token_len
+            for trigram in trigrams(token)]
+
+def build_token_trigrams(conn):
+    '''Build token trigrams for tokens that indexed before the trigrams
+    introduced'''
+    if conn.execute('SELECT value FROM meta WHERE name = ?',
+                    ('search_token_trigrams_built',)).fetchone() is not None:
+        return
+    # replaced by the trigrams
+    conn.execute('DROP TABLE IF EXISTS search_token_suffixes')
+    conn.execute('DELETE FROM meta WHERE name = ?',
+                 ('search_token_suffixes_built',))
+    conn.executemany(
+            'INSERT OR IGNORE INTO search_token_trigrams VALUES (?, ?)',
+            token_trigrams({token: token_id for token_id, token in
+                            conn.execute('SELECT id, token FROM search_tokens')
+                            }))
+    conn.execute('INSERT INTO meta VALUES (?, ?)',
+                 ('search_token_trigrams_built', '1'))
+    conn.commit()
+
+def mail_key(mail):
+    return hkml_cache.get_cache_key(mail.gitid, mail.gitdir, mail.get_msgid())
+
+def mail_token_fields(mail):
+    '''Return a dict of tokens in the mail and bitmasks of their fields'''
+    token_fields = {}
+    for field, bit in field_bits.items():
+        if field == 'body':
+            text = mail.get_body()
+        else:
+            text = mail.get_field(field)
+        if text is None:
+            continue
+        for token in token_pattern.findall(text):
+            token_fields[token] = token_fields.get(token, 0) | bit
+    return token_fields
+
+def token_ids(conn, tokens):
+    '''Return a dict of the tokens and their ids.  Tokens that not yet in the
+    index are added'''
+    ids = {}
+    chunk_sz = 500
+    for i in range(0, len(tokens), chunk_sz):
+        chunk = tokens[i:i + chunk_sz]
+        for token_id, token in conn.execute(
+                'SELECT id, token FROM search_tokens WHERE token IN (%s)' %
+                ', '.join(['?'] * len(chunk)), chunk):
+            ids[token] = token_id
+    new_ids = {}
+    for token in tokens:
+        if not token in ids:
+            new_ids[token] = conn.execute(
+                    'INSERT INTO search_tokens (token) VALUES (?)',
+                    (token,)).lastrowid
+    conn.executemany(
+            'INSERT OR IGNORE INTO search_token_trigrams VALUES (?, ?)',
+            token_trigrams(new_ids))
+    ids.update(new_ids)
+    return ids
+
+def remove_docs(conn, doc_ids):
+    for doc_id in doc_ids:
+        conn.execute('DELETE FROM search_postings WHERE doc_id = ?',
+                     (doc_id,))
+        conn.execute('DELETE FROM search_docs WHERE id = ?', (doc_id,))
+
+def __index_mail(conn, key, mail_rowid, mail):
+    row = conn.execute('SELECT id FROM search_docs WHERE key = ?',
+                       (key,)).fetchone()
+    if row is not None:
+        remove_docs(conn, [row[0]])
+    cursor = conn.execute(
+            'INSERT INTO search_docs (key, mail_rowid) VALUES (?, ?)',
+            (key, mail_rowid))
+    doc_id = cursor.lastrowid
+    token_fields = mail_token_fields(mail)
+    ids = token_ids(conn, list(token_fields.keys()))
+    conn.executemany(
+            'INSERT INTO search_postings VALUES (?, ?, ?)',
+            [[ids[t], doc_id, fields] for t, fields in token_fields.items()])
+    if indexed_docs_cache is not None:
+        indexed_docs_cache[key] = mail_rowid
+    update_candidates_cache(key, token_fields)
+
+def index_mail(mail):
+    '''Index the mail if it is cached but not indexed'''
+    conn = get_conn()
+    if conn is None:
+        return
+    key = mail_key(mail)
+    row = conn.execute('SELECT rowid FROM mails WHERE key = ?',
+                       (key,)).fetchone()
+    if row is None:
+        return
+    if get_indexed_docs().get(key) == row[0]:
+        return
+    __index_mail(conn, key, row[0], mail)
+    hkml_cache.sqlite_written()
+
+def update_index(print_progress=False):
+    '''Index cached mails that not indexed, and unindex evicted mails.
+    Returns number of newly indexed mails and an error'''
+    global indexed_docs_cache
+
+    conn = get_conn()
+    if conn is None:
+        return 0, 'the index needs sqlite cache backend'
+
+    stale_docs = [row[0] for row in conn.execute(
+        'SELECT d.id FROM search_docs d LEFT JOIN mails m ON m.key = d.key '
+        'WHERE m.rowid IS NOT d.mail_rowid')]
+    remove_docs(conn, stale_docs)
+    if len(stale_docs) > 0:
+        indexed_docs_cache = None
+        candidates_cache.clear()
+
+    to_index = conn.execute(
+            'SELECT m.rowid, m.key, m.kvpairs FROM mails m '
+            'LEFT JOIN search_docs d ON d.key = m.key '
+            'WHERE d.id IS NULL').fetchall()
+    for idx, (mail_rowid, key, kvpairs) in enumerate(to_index):
+        if print_progress and idx > 0 and idx % 1000 == 0:
+            print('indexed %d/%d mails' % (idx, len(to_index)))
+        mail = _hkml.Mail(kvpairs=json.loads(kvpairs))
+        if mail.broken():
+            continue
+        __index_mail(conn, key, mail_rowid, mail)
+    conn.commit()
+    return len(to_index), None
+
+# key: mails cache key of indexed mails, value: indexed mails table rowid
+indexed_docs_cache = None
+
+def get_indexed_docs():
+    global indexed_docs_cache
+
+    if indexed_docs_cache is None:
+        indexed_docs_cache = {}
+        conn = get_conn()
+        for key, mail_rowid in conn.execute(
+                'SELECT key, mail_rowid FROM search_docs'):
+            indexed_docs_cache[key] = mail_rowid
+    return indexed_docs_cache
+
+# key: (keyword, fields bitmask), value: (candidate mail keys, exact)
+candidates_cache = {}
+
+def update_candidates_cache(key, token_fields):
+    '''Update candidates_cache for a newly indexed mail'''
+    for (keyword, mask), (candidates, exact) in candidates_cache.items():
+        if candidates is None:
+            continue
+        candidates.discard(key)
+        for part in token_pattern.findall(keyword):
+            found = False
+            for token, fields in token_fields.items():
+                if fields & mask and part in token:
+                    found = True
+                    break
+            if not found:
+                break
+        else:
+            candidates.add(key)
+
+def part_token_ids(conn, part):
+    '''Return ids of tokens having the part as a substring'''
+    part_trigrams = list(trigrams(part))
+    if len(part_trigrams) == 0:
+        return [row[0] for row in conn.execute(
+            'SELECT id FROM search_tokens WHERE instr(token, ?) > 0',
+            (part,))]
+    ids = [row[0] for row in conn.execute(
+        'SELECT t.id FROM search_tokens t WHERE t.id IN '
+        '(SELECT token_id FROM search_token_trigrams WHERE trigram IN (%s) '
+        'GROUP BY token_id HAVING COUNT(*) = ?) '
+        'AND instr(t.token, ?) > 0' % ', '.join(['?'] * len(part_trigrams)),
+        part_trigrams + [len(part_trigrams), part])]
+    ids += [row[0] for row in conn.execute(
+        'SELECT id FROM search_tokens WHERE length(token) > ? '
+        'AND instr(token, ?) > 0', (max_trigram_token_len, part))]
+    return ids
+
+def keyword_candidates(keyword, fields):
+    '''Return a set of keys of mails that might have the keyword in any of the
+    fields, and whether the set is exact.  The set is None if every mail is a
+    candidate.'''
+    mask = 0
+    for field in fields:
+        mask |= field_bits[field]
+    if (keyword, mask) in candidates_cache:
+        return candidates_cache[(keyword, mask)]
+
+    conn = get_conn()
+    candidates = None
+    for part in token_pattern.findall(keyword):
+        ids = part_token_ids(conn, part)
+        keys = set()
+        chunk_sz = 500
+        for i in range(0, len(ids), chunk_sz):
+            chunk = ids[i:i + chunk_sz]
+            keys.update([row[0] for row in conn.execute(
+                'SELECT DISTINCT d.key FROM search_postings p '
+                'JOIN search_docs d ON d.id = p.doc_id '
+                'WHERE p.token_id IN (%s) AND (p.fields & ?) != 0' %
+                ', '.join(['?'] * len(chunk)), chunk + [mask])])
+        if candidates is None:
+            candidates = keys
+        else:
+            candidates &= keys
+    exact = token_pattern.fullmatch(keyword) is not None
+    candidates_cache[(keyword, mask)] = (candidates, exact)
+    return candidates, exact
+
+def keywords_in_field(keywords, field, key):
+    '''Same to hkml_list.keywords_in(keywords, <field of the mail>), but using
+    the index.  Returns None if the index cannot answer.'''
+    if keywords is None:
+        return True
+    if get_conn() is None:
+        return None
+    if not key in get_indexed_docs():
+        return None
+    answers = []
+    for sub_keywords in keywords:
+        answer = True
+        for keyword in sub_keywords:
+            if keyword is None:
+                continue
+            candidates, exact = keyword_candidates(keyword, [field])
+            if candidates is not None and not key in candidates:
+                answer = False
+                break
+            if not exact:
+                answer = None
+        if answer is True:
+            return True
+        answers.append(answer)
+    if None in answers:
+        return None
+    return False
+
+def search(keywords, fields):
+    '''Return keys of indexed mails that might have all the keywords in any
+    of the fields, and whether the result is exact'''
+    keys = set(get_indexed_docs().keys())
+    all_exact = True
+    for keyword in keywords:
+        candidates, exact = keyword_candidates(keyword, fields)
+        if candidates is not None:
+            keys &= candidates
+        all_exact = all_exact and exact
+    return keys, all_exact
@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Measure the time for importing each module during hkml startup, for 'hkml
+# --profile_startup'.
+
+import builtins
+import sys
+import time
+
+orig_import = None
+start_time = None
+# list of [module name, depth, cumulative seconds, self seconds], in the
+# import order
+import_records = []
+# records of modules that being imported
+import_stack = []
+
+def profiling_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name in sys.modules:
+        return orig_import(name, globals, locals, fromlist, level)
+    record = [name, len(import_stack), 0, 0]
+    import_records.append(record)
+    import_stack.append(record)
+    start = time.perf_counter()
+    try:
+        return orig_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        import_stack.pop()
+        record[2] = elapsed
+        record[3] += elapsed
+        if len(import_stack) > 0:
+            import_stack[-1][3] -= elapsed
+
+def start():
+    global orig_import
+    global start_time
+
+    start_time = time.perf_counter()
+    orig_import = builtins.__import__
+    builtins.__import__ = profiling_import
+
+def report(min_time=0.0001):
+    '''Stop the profiling and print the time for importing each module that
+    took at least min_time seconds to stderr'''
+    total_time = time.perf_counter() - start_time
+    builtins.__import__ = orig_import
+
+    lines = ['%8s %8s  %s' % ('cumul_ms', 'self_ms', 'module')]
+    for name, depth, cumul_time, self_time in import_records:
+        if cumul_time < min_time:
+            continue
+        lines.append('%8.2f %8.2f  %s%s' % (
+            cumul_time * 1000, self_time * 1000, '  ' * depth, name))
+    lines.append('')
+    lines.append('total startup time: %.2f ms (%d modules imported)' %
+                 (total_time * 1000, len(import_records)))
+    print('\n'.join(lines), file=sys.stderr)
@@ -0,0 +1,127 @@
+# SPDX-License-Identifier: GPL-2.0
+
+# Writeback layer for hkml state files.
+#
+# Files are written atomically, by writing a temporary file in the same
+# directory and renaming it to the file.  Writers hold an exclusive flock() on
+# a hidden '.<file name>.lock' file in the same directory while reading and
+# writing the file, so that concurrent hkml processes (e.g., the interactive
+# viewer and the monitor daemon) don't clobber each other's changes.
+#
+# Frequent small changes, like the usage history events and the cursor
+# positions, are deferred and coalesced, using update_json() with defer=True.
+# Deferred updates are applied to the latest content of the file under the
+# lock at flush(), which is called at exit and when the interactive viewer is
+# idle.  Writebacks that not fit in update_json() can also be deferred and
+# coalesced, using defer_call().
+
+import atexit
+import fcntl
+import json
+import os
+
+# key: file path, value: list of functions that receive the file content and
+# return the updated content
+pending_updates = {}
+# key: caller-defined key, value: function to call at flush()
+pending_calls = {}
+
+def lock_file_path(path):
+    return os.path.join(os.path.dirname(path),
+                        '.%s.lock' % os.path.basename(path))
+
+class FileLock:
+    path = None
+    fd = None
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = os.open(lock_file_path(self.path), os.O_RDWR | os.O_CREAT,
+                          0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+def write_atomic(path, content):
+    '''Write the content to the file atomically.  Caller should hold the
+    lock'''
+    tmp_path = os.path.join(os.path.dirname(path), '.%s.tmp.%d' % (
+        os.path.basename(path), os.getpid()))
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def dump_json(data, indent, sort_keys):
+    return json.dumps(data, indent=indent, sort_keys=sort_keys)
+
+def read_json(path, default=None):
+    '''Return the json-loaded content of the file, or default if the file
+    doesn't exist'''
+    if not os.path.isfile(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_json(path, data, indent=4, sort_keys=False):
+    '''Write json-dumped data to the file, atomically and with the lock'''
+    content = dump_json(data, indent, sort_keys)
+    with FileLock(path):
+        write_atomic(path, content)
+
+def __apply_updates(path, update_fns, default, indent, sort_keys):
+    with FileLock(path):
+        try:
+            data = read_json(path, default)
+        except ValueError:
+            # broken file.  Overwrite.
+            data = default
+        for update_fn in update_fns:
+            data = update_fn(data)
+        write_atomic(path, dump_json(data, indent, sort_keys))
+    return data
+
+def update_json(path, update_fn, default=None, indent=4, sort_keys=False,
+                defer=False):
+    '''Update the json file with the latest content of the file.
+
+    update_fn receives the json-loaded content of the file (default if the
+    file doesn't exist) and returns the updated content.  If defer is True,
+    the update is made at the next flush().  Returns the updated content if
+    not deferred.'''
+    if defer is False:
+        return __apply_updates(path, [update_fn], default, indent, sort_keys)
+    if not path in pending_updates:
+        pending_updates[path] = [[], default, indent, sort_keys]
+    pending_updates[path][0].append(update_fn)
+    return None
+
+def defer_call(key, fn):
+    '''Call fn at the next flush().  Only the last function for the same key
+    is called'''
+    pending_calls[key] = fn
+
+def has_pending_updates():
+    return len(pending_updates) > 0 or len(pending_calls) > 0
+
+def flush():
+    '''Apply deferred updates'''
+    while len(pending_calls) > 0:
+        key = next(iter(pending_calls))
+        pending_calls.pop(key)()
+    while len(pending_updates) > 0:
+        path = next(iter(pending_updates))
+        update_fns, default, indent, sort_keys = pending_updates.pop(path)
+        __apply_updates(path, update_fns, default, indent, sort_keys)
+
+atexit.register(flush)
@@ -3,10 +3,13 @@
 import datetime
 import json
 import os
+import sqlite3
 import sys
+import threading
 import time
 
 import _hkml
+import _hkml_state
 
 # Cache is constructed with multiple files.
 # active cache: Contains most recently added cache entries.
@@ -21,29 +24,69 @@ import _hkml
 #
 # When reading the cache, active cache is first read, then archived caches one
 # by one, recent archive first, until the item is found.
+#
+# Above describes the 'json' backend.  The default 'sqlite' backend instead
+# keeps all entries in a single sqlite3 database file, 'mails_cache.db', and
+# does point lookups and writes, so that the startup time doesn't increase
+# with the size of the cache.  Its total size is limited to the sum of the
+# active and archived caches size limits of the 'json' backend, by evicting
+# oldest entries.  On first use, entries of existing json cache files are
+# imported to the database.
+
+cache_backends = ['sqlite', 'json']
+default_cache_backend = 'sqlite'
+
+cache_config = None
 
 def load_cache_config():
+    global cache_config
+
+    if cache_config is not None:
+        return cache_config
+
     cache_config_path = os.path.join(_hkml.get_hkml_dir(),
                                      'mails_cache_config')
     if not os.path.isfile(cache_config_path):
-        return {'max_active_cache_sz': 100 * 1024 * 1024,
-                'max_archived_caches': 9}
+        cache_config = {'max_active_cache_sz': 100 * 1024 * 1024,
+                        'max_archived_caches': 9,
+                        'backend': default_cache_backend}
+        return cache_config
 
     with open(cache_config_path, 'r') as f:
-        return json.load(f)
+        cache_config = json.load(f)
+    # backend has introduced after v1.6.6
+    if not 'backend' in cache_config:
+        cache_config['backend'] = default_cache_backend
+    return cache_config
+
+def set_cache_config(max_active_cache_sz, max_archived_caches, backend):
+    global cache_config
 
-def set_cache_config(max_active_cache_sz, max_archived_caches):
     cache_config_path = os.path.join(_hkml.get_hkml_dir(),
                                      'mails_cache_config')
-    with open(cache_config_path, 'w') as f:
-        json.dump({'max_active_cache_sz': max_active_cache_sz,
-                   'max_archived_caches': max_archived_caches}, f, indent=4)
+    cache_config = {'max_active_cache_sz': max_active_cache_sz,
+                    'max_archived_caches': max_archived_caches,
+                    'backend': backend}
+    _hkml_state.write_json(cache_config_path, cache_config)
+
+def cache_backend():
+    return load_cache_config()['backend']
 
 # dict having gitid/gitdir or msgid as key, Mail kvpairs as value.
 
-archived_caches = []
+# archived cache file path to the loaded cache dict.
+archived_caches = {}
 active_cache = None
 
+# Each archived cache file has a sidecar file, '<archive file>.keys', which
+# contains keys of the archived cache including those of msgid_key_map, one
+# key per line.  It is written when the archive is made, or when the archive
+# is loaded for the first time if it has made before the sidecar introduced.
+# Using it, archived caches that don't have a key are skipped without loading.
+
+# archived cache file path to the set of keys of the archive.
+archived_cache_keys = {}
+
 need_file_update = False
 
 def get_cache_key(gitid=None, gitdir=None, msgid=None):
@@ -56,13 +99,55 @@ def list_archive_files():
     """Return a list of archived cache files sorted in recent one first"""
     archive_files = []
     for file_ in os.listdir(_hkml.get_hkml_dir()):
-        if file_.startswith('mails_cache_archive_'):
+        if (file_.startswith('mails_cache_archive_') and
+                not file_.endswith('.keys')):
             archive_files.append(
                     os.path.join(_hkml.get_hkml_dir(), file_))
     # name is mails_cache_archive_<timestamp>
     archive_files.sort(reverse=True)
     return archive_files
 
+def archive_keys_file_path(archive_file):
+    return '%s.keys' % archive_file
+
+def write_archive_keys_file(archive_file, cache):
+    keys = [k for k in cache.keys() if k != 'msgid_key_map']
+    # msgid_key_map has introduced from v1.1.6
+    if 'msgid_key_map' in cache:
+        keys += cache['msgid_key_map'].keys()
+    with open(archive_keys_file_path(archive_file), 'w') as f:
+        f.write('\n'.join(sorted(set(keys))))
+    archived_cache_keys[archive_file] = set(keys)
+
+def get_archive_keys(archive_file):
+    '''Return the set of keys of the archive, or None if unknown'''
+    if archive_file in archived_cache_keys:
+        return archived_cache_keys[archive_file]
+    keys_file = archive_keys_file_path(archive_file)
+    if not os.path.isfile(keys_file):
+        return None
+    with open(keys_file, 'r') as f:
+        archived_cache_keys[archive_file] = set(f.read().split('\n'))
+    return archived_cache_keys[archive_file]
+
+def archive_active_cache(cache_path):
+    archive_file = os.path.join(
+            _hkml.get_hkml_dir(), 'mails_cache_archive_%s' %
+            datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S'))
+    os.rename(cache_path, archive_file)
+    try:
+        with open(archive_file, 'r') as f:
+            write_archive_keys_file(archive_file, json.load(f))
+    except Exception as e:
+        sys.stderr.write('cannot make keys file of %s (%s)\n' %
+                         (archive_file, e))
+
+    archive_files = list_archive_files()
+    if len(archive_files) > load_cache_config()['max_archived_caches']:
+        os.remove(archive_files[-1])
+        if os.path.isfile(archive_keys_file_path(archive_files[-1])):
+            os.remove(archive_keys_file_path(archive_files[-1]))
+
 def get_active_mails_cache():
     global active_cache
 
@@ -74,25 +159,20 @@ def get_active_mails_cache():
     if os.path.isfile(cache_path):
         stat = os.stat(cache_path)
         if stat.st_size >= load_cache_config()['max_active_cache_sz']:
-            os.rename(
-                    cache_path, os.path.join(
-                        _hkml.get_hkml_dir(), 'mails_cache_archive_%s' %
-                        datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')))
-            archive_files = list_archive_files()
-            if len(archive_files) > load_cache_config()['max_archived_caches']:
-                os.remove(archive_files[-1])
+            archive_active_cache(cache_path)
         else:
             with open(cache_path, 'r') as f:
                 active_cache = json.load(f)
     return active_cache
 
-def load_one_more_archived_cache():
-    archive_files = list_archive_files()
-    if len(archive_files) == len(archived_caches):
-        return False
-    with open(archive_files[len(archived_caches)], 'r') as f:
-        archived_caches.append(json.load(f))
-    return True
+def get_archived_cache(archive_file):
+    if archive_file in archived_caches:
+        return archived_caches[archive_file]
+    with open(archive_file, 'r') as f:
+        archived_caches[archive_file] = json.load(f)
+    if get_archive_keys(archive_file) is None:
+        write_archive_keys_file(archive_file, archived_caches[archive_file])
+    return archived_caches[archive_file]
 
 def __get_kvpairs(key, cache):
     if not key in cache:
@@ -103,27 +183,281 @@ def __get_kvpairs(key, cache):
         return None
     return cache[key]
 
-def get_kvpairs(gitid=None, gitdir=None, key=None):
-    if key is None:
-        key = get_cache_key(gitid, gitdir)
-
+def json_get_kvpairs(key):
     cache = get_active_mails_cache()
     kvpairs = __get_kvpairs(key, cache)
     if kvpairs is not None:
         return kvpairs
 
-    for cache in archived_caches:
-        kvpairs = __get_kvpairs(key, cache)
-        if kvpairs is not None:
-            return kvpairs
-
-    while load_one_more_archived_cache() == True:
-        kvpairs = __get_kvpairs(key, archived_caches[-1])
+    for archive_file in list_archive_files():
+        if not archive_file in archived_caches:
+            keys = get_archive_keys(archive_file)
+            if keys is not None and not key in keys:
+                continue
+        kvpairs = __get_kvpairs(key, get_archived_cache(archive_file))
         if kvpairs is not None:
             return kvpairs
 
     return None
 
+# sqlite backend.
+#
+# 'mails' table has the cache keys and json-dumped Mail kvpairs.  Rowids of the
+# table are used as the order of the insertions, for eviction of old entries.
+# 'msgid_keys' table is the counterpart of the json backend's msgid_key_map.
+# 'thread_parents' table is the thread index.  It has message ids of the
+# cached mails and those of their parent mails (in-reply-to), so that threads
+# can be constructed without parsing the mails.
+#
+# sqlite connections cannot be shared by threads, and mails can be cached from
+# a worker thread (e.g., list generation of the interactive viewer).  Hence
+# each thread uses its own connection.
+#
+# Other hkml processes (e.g., the monitor daemon) could use the database at the
+# same time.  The database is in the WAL mode so that readers don't wait for
+# the writer, and writes are committed every sqlite_commit_batch_size writes
+# and at the next _hkml_state.flush(), rather than holding the write lock
+# until writeback_mails().
+
+sqlite_conns = threading.local()
+# seconds to wait for the lock that other processes hold
+sqlite_busy_timeout = 30
+sqlite_commit_batch_size = 1000
+
+def sqlite_db_path():
+    return os.path.join(_hkml.get_hkml_dir(), 'mails_cache.db')
+
+def json_cache_files():
+    '''Return json cache files sorted in old one first'''
+    files = list(reversed(list_archive_files()))
+    active_cache_path = os.path.join(_hkml.get_hkml_dir(),
+                                     'mails_cache_active')
+    if os.path.isfile(active_cache_path):
+        files.append(active_cache_path)
+    return files
+
+def sqlite_migrate_json_caches(conn):
+    '''Import entries of json backend cache files, if not yet done'''
+    if conn.execute('SELECT value FROM meta WHERE name = ?',
+                    ('json_migrated',)).fetchone() is not None:
+        return
+    for cache_path in json_cache_files():
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except Exception as e:
+            sys.stderr.write('cannot migrate %s (%s)\n' % (cache_path, e))
+            continue
+        for key, kvpairs in cache.items():
+            if key == 'msgid_key_map':
+                continue
+            # the cache might somehow be corrupted with non-mail value.
+            if not isinstance(kvpairs, dict) or not 'gitid' in kvpairs:
+                continue
+            conn.execute('INSERT OR REPLACE INTO mails VALUES (?, ?)',
+                         (key, json.dumps(kvpairs)))
+        if 'msgid_key_map' in cache:
+            conn.executemany('INSERT OR REPLACE INTO msgid_keys VALUES (?, ?)',
+                             cache['msgid_key_map'].items())
+    conn.execute('INSERT INTO meta VALUES (?, ?)', ('json_migrated', '1'))
+    conn.commit()
+
+def get_sqlite_conn():
+    '''Return the sqlite connection of the calling thread'''
+    sqlite_conn = getattr(sqlite_conns, 'conn', None)
+    if sqlite_conn is not None:
+        return sqlite_conn
+
+    sqlite_conn = sqlite3.connect(sqlite_db_path(),
+                                  timeout=sqlite_busy_timeout)
+    sqlite_conns.conn = sqlite_conn
+    sqlite_conns.nr_uncommitted = 0
+    sqlite_conn.execute('PRAGMA journal_mode=WAL')
+    # WAL mode is safe from corruption with this
+    sqlite_conn.execute('PRAGMA synchronous=NORMAL')
+    sqlite_conn.execute(
+            'CREATE TABLE IF NOT EXISTS mails '
+            '(key TEXT PRIMARY KEY, kvpairs TEXT)')
+    sqlite_conn.execute(
+            'CREATE TABLE IF NOT EXISTS msgid_keys '
+            '(msgid TEXT PRIMARY KEY, key TEXT)')
+    sqlite_conn.execute(
+            'CREATE TABLE IF NOT EXISTS meta '
+            '(name TEXT PRIMARY KEY, value TEXT)')
+    sqlite_conn.execute(
+            'CREATE TABLE IF NOT EXISTS thread_parents '
+            '(msgid TEXT PRIMARY KEY, parent TEXT)')
+    sqlite_conn.execute(
+            'CREATE INDEX IF NOT EXISTS thread_parents_parent '
+            'ON thread_parents (parent)')
+    sqlite_migrate_json_caches(sqlite_conn)
+    sqlite_build_thread_index(sqlite_conn)
+    return sqlite_conn
+
+def commit_sqlite_conn():
+    '''Commit the writes to the sqlite connection of the calling thread, if
+    exists'''
+    sqlite_conn = getattr(sqlite_conns, 'conn', None)
+    if sqlite_conn is None:
+        return
+    sqlite_conns.nr_uncommitted = 0
+    sqlite_conn.commit()
+
+def sqlite_written():
+    '''Let the writes to the sqlite connection of the calling thread be
+    committed, every sqlite_commit_batch_size calls and at the next
+    _hkml_state.flush()'''
+    sqlite_conns.nr_uncommitted += 1
+    if sqlite_conns.nr_uncommitted >= sqlite_commit_batch_size:
+        commit_sqlite_conn()
+    else:
+        _hkml_state.defer_call(sqlite_db_path(), commit_sqlite_conn)
+
+def close_sqlite_conn():
+    '''Commit and close the sqlite connection of the calling thread, if
+    exists'''
+    sqlite_conn = getattr(sqlite_conns, 'conn', None)
+    if sqlite_conn is None:
+        return
+    commit_sqlite_conn()
+    sqlite_conns.conn = None
+    sqlite_conn.close()
+
+def mbox_parent_msgid(mbox):
+    raw_header, _ = _hkml.parse_mbox_raw_header(mbox)
+    if not 'in-reply-to' in raw_header:
+        return None
+    fields = raw_header['in-reply-to'][-1].split()
+    if len(fields) == 0:
+        return None
+    return fields[0]
+
+def sqlite_build_thread_index(conn):
+    '''Build thread index for mails that cached before the index introduced'''
+    if conn.execute('SELECT value FROM meta WHERE name = ?',
+                    ('thread_index_built',)).fetchone() is not None:
+        return
+    rows = []
+    for row in conn.execute('SELECT kvpairs FROM mails'):
+        kvpairs = json.loads(row[0])
+        if kvpairs.get('msgid') is None or not kvpairs.get('mbox'):
+            continue
+        rows.append([kvpairs['msgid'], mbox_parent_msgid(kvpairs['mbox'])])
+    conn.executemany('INSERT OR REPLACE INTO thread_parents VALUES (?, ?)',
+                     rows)
+    conn.execute('INSERT INTO meta VALUES (?, ?)', ('thread_index_built', '1'))
+    conn.commit()
+
+def sqlite_get_kvpairs(key):
+    conn = get_sqlite_conn()
+    row = conn.execute('SELECT kvpairs FROM mails WHERE key = ?',
+                       (key,)).fetchone()
+    if row is None:
+        row = conn.execute(
+                'SELECT mails.kvpairs FROM msgid_keys JOIN mails '
+                'ON mails.key = msgid_keys.key WHERE msgid_keys.msgid = ?',
+                (key,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+def sqlite_set_kvpairs(key, msgid, kvpairs, overwrite):
+    conn = get_sqlite_conn()
+    if overwrite is False:
+        if conn.execute('SELECT 1 FROM mails WHERE key = ?',
+                        (key,)).fetchone() is not None:
+            return False
+    else:
+        if skip_overwrite(kvpairs, sqlite_get_kvpairs(key)):
+            return False
+    conn.execute('INSERT OR REPLACE INTO mails VALUES (?, ?)',
+                 (key, json.dumps(kvpairs)))
+    if key != msgid:
+        conn.execute('INSERT OR REPLACE INTO msgid_keys VALUES (?, ?)',
+                     (msgid, key))
+    if msgid is not None and kvpairs['mbox']:
+        conn.execute('INSERT OR REPLACE INTO thread_parents VALUES (?, ?)',
+                     (msgid, mbox_parent_msgid(kvpairs['mbox'])))
+    sqlite_written()
+    return True
+
+def sqlite_used_bytes(conn):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return (page_count - freelist_count) * page_size
+
+def sqlite_evict_old_entries(conn):
+    config = load_cache_config()
+    max_sz = config['max_active_cache_sz'] * (
+            config['max_archived_caches'] + 1)
+    used_bytes = sqlite_used_bytes(conn)
+    if used_bytes <= max_sz:
+        return
+    nr_mails = conn.execute('SELECT COUNT(*) FROM mails').fetchone()[0]
+    # evict oldest entries of the overflowed size, plus ten percent of the
+    # limit, to avoid evicting entries on every writeback.
+    nr_evict = int(nr_mails * (used_bytes - max_sz * 0.9) / used_bytes) + 1
+    conn.execute('DELETE FROM mails WHERE rowid IN '
+                 '(SELECT rowid FROM mails ORDER BY rowid LIMIT ?)',
+                 (nr_evict,))
+    conn.execute('DELETE FROM msgid_keys WHERE key NOT IN '
+                 '(SELECT key FROM mails)')
+    conn.execute('DELETE FROM thread_parents WHERE '
+                 'msgid NOT IN (SELECT msgid FROM msgid_keys) AND '
+                 'msgid NOT IN (SELECT key FROM mails)')
+
+def get_ancestor_msgids(msgid):
+    '''Return message ids of the mail and its ancestors that cached, from the
+    given one to the root.  Returns None if the thread index is unavailable.
+    '''
+    if cache_backend() != 'sqlite':
+        return None
+    conn = get_sqlite_conn()
+    msgids = []
+    while msgid is not None and not msgid in msgids:
+        row = conn.execute('SELECT parent FROM thread_parents WHERE msgid = ?',
+                           (msgid,)).fetchone()
+        if row is None:
+            break
+        msgids.append(msgid)
+        msgid = row[0]
+    return msgids
+
+def get_thread_msgids(msgid):
+    '''Return message ids of the cached mails of the thread having the given
+    mail, root first.  Returns None if the thread index is unavailable.'''
+    ancestors = get_ancestor_msgids(msgid)
+    if ancestors is None:
+        return None
+    if len(ancestors) == 0:
+        return []
+    conn = get_sqlite_conn()
+    msgids = [ancestors[-1]]
+    seen = set(msgids)
+    idx = 0
+    while idx < len(msgids):
+        for row in conn.execute(
+                'SELECT msgid FROM thread_parents WHERE parent = ?',
+                (msgids[idx],)):
+            if not row[0] in seen:
+                seen.add(row[0])
+                msgids.append(row[0])
+        idx += 1
+    return msgids
+
+def sqlite_writeback():
+    sqlite_evict_old_entries(get_sqlite_conn())
+    commit_sqlite_conn()
+
+def get_kvpairs(gitid=None, gitdir=None, key=None):
+    if key is None:
+        key = get_cache_key(gitid, gitdir)
+
+    if cache_backend() == 'sqlite':
+        return sqlite_get_kvpairs(key)
+    return json_get_kvpairs(key)
+
 def get_mail(gitid=None, gitdir=None, key=None):
     kvpairs = get_kvpairs(gitid, gitdir, key)
     if kvpairs is not None:
@@ -136,11 +470,9 @@ def get_mbox(gitid=None, gitdir=None, key=None):
         return kvpairs['mbox']
     return None
 
-def skip_overwrite(mail, cache, key):
-    if not key in cache:
+def skip_overwrite(mail_kvpair, cached_kvpair):
+    if cached_kvpair is None:
         return True
-    cached_kvpair = cache[key]
-    mail_kvpair = mail.to_kvpairs()
     for mkey in mail_kvpair.keys():
         if not mkey in cached_kvpair:
             return False
@@ -154,8 +486,17 @@ def set_mail(mail, overwrite=False):
     if mail.broken():
         return
 
-    cache = get_active_mails_cache()
     msgid = mail.get_msgid()
+    if cache_backend() == 'sqlite':
+        if mail.gitid is not None and mail.gitdir is not None:
+            key = get_cache_key(mail.gitid, mail.gitdir)
+        else:
+            key = msgid
+        if sqlite_set_kvpairs(key, msgid, mail.to_kvpairs(), overwrite):
+            need_file_update = True
+        return
+
+    cache = get_active_mails_cache()
     if mail.gitid is not None and mail.gitdir is not None:
         key = get_cache_key(mail.gitid, mail.gitdir)
         # msgid_key_map has introduced from v1.1.6
@@ -167,23 +508,42 @@ def set_mail(mail, overwrite=False):
     if overwrite is False:
         if key in cache:
             return
-        for archived_cache in archived_caches:
+        for archived_cache in archived_caches.values():
             if key in archived_cache:
                 return
     else:
-        if skip_overwrite(mail, cache, key):
+        if skip_overwrite(mail.to_kvpairs(), cache.get(key)):
             return
 
     cache[key] = mail.to_kvpairs()
     need_file_update = True
 
 def writeback_mails():
+    global need_file_update
+
     if not need_file_update:
         return
+    need_file_update = False
+    if cache_backend() == 'sqlite':
+        sqlite_writeback()
+        return
     cache_path = os.path.join(_hkml.get_hkml_dir(), 'mails_cache_active')
     with open(cache_path, 'w') as f:
         json.dump(get_active_mails_cache(), f, indent=4)
 
+def pr_mail_parsing_time(mails_kvpairs):
+    # Mail() parses only the header.  The body is parsed by get_body().
+    before_timestamp = time.time()
+    mails = [_hkml.Mail(kvpairs=kvpairs) for kvpairs in mails_kvpairs]
+    print('%f seconds for parsing mail headers' %
+          (time.time() - before_timestamp))
+
+    before_timestamp = time.time()
+    for mail in mails:
+        mail.get_body()
+    print('%f seconds for parsing mail bodies' %
+          (time.time() - before_timestamp))
+
 def pr_cache_stat(cache_path, profile_mail_parsing_time):
     print('Stat of %s' % cache_path)
     cache_stat = os.stat(cache_path)
@@ -198,22 +558,55 @@ def pr_cache_stat(cache_path, profile_mail_parsing_time):
 
     if profile_mail_parsing_time is not True:
         return
+    # the cache might somehow be corrupted with non-mail value.
+    pr_mail_parsing_time(
+            [cache[key] for key in cache if 'gitid' in cache[key]])
+
+def pr_sqlite_cache_stat(profile_mail_parsing_time):
+    db_path = sqlite_db_path()
+    print('Stat of %s' % db_path)
+    print('cache size: %.3f MiB' % (os.stat(db_path).st_size / 1024 / 1024))
+
     before_timestamp = time.time()
-    for key in cache:
-        # the cache might somehow be corrupted with non-mail value.
-        if not 'gitid' in cache[key]:
-            continue
-        _hkml.Mail(kvpairs=cache[key])
-    print('%f seconds for parsing mails' % (time.time() - before_timestamp))
+    conn = get_sqlite_conn()
+    print('%f seconds for opening cache' % (time.time() - before_timestamp))
+    print('%.3f MiB used' % (sqlite_used_bytes(conn) / 1024 / 1024))
+    print('%d mails in cache' %
+          conn.execute('SELECT COUNT(*) FROM mails').fetchone()[0])
+    print('%d msgid to key mappings' %
+          conn.execute('SELECT COUNT(*) FROM msgid_keys').fetchone()[0])
+
+    row = conn.execute(
+            'SELECT key FROM mails ORDER BY rowid DESC LIMIT 1').fetchone()
+    if row is not None:
+        before_timestamp = time.time()
+        sqlite_get_kvpairs(row[0])
+        print('%f seconds for a point lookup' %
+              (time.time() - before_timestamp))
+
+    if profile_mail_parsing_time is not True:
+        return
+    pr_mail_parsing_time(
+            [json.loads(row[0])
+             for row in conn.execute('SELECT kvpairs FROM mails')])
 
 def show_cache_status(config_only, profile_mail_parsing_time):
     cache_config = load_cache_config()
+    print('backend: %s' % cache_config['backend'])
     print('max active cache file size: %.3f MiB' %
           (cache_config['max_active_cache_sz'] / 1024 / 1024))
+    print('max archived caches: %d' % cache_config['max_archived_caches'])
     if config_only is True:
         return
     print()
 
+    if cache_config['backend'] == 'sqlite':
+        if not os.path.isfile(sqlite_db_path()) and not json_cache_files():
+            print('no cache exist')
+            exit(1)
+        pr_sqlite_cache_stat(profile_mail_parsing_time)
+        return
+
     cache_path = os.path.join(_hkml.get_hkml_dir(), 'mails_cache_active')
     if not os.path.isfile(cache_path):
         print('no cache exist')
@@ -229,7 +622,11 @@ def main(args):
     if args.action == 'status':
         show_cache_status(args.config_only, args.profile_mail_parsing_time)
     elif args.action == 'config':
-        set_cache_config(args.max_active_cache_sz, args.max_archived_caches)
+        backend = args.backend
+        if backend is None:
+            backend = cache_backend()
+        set_cache_config(args.max_active_cache_sz, args.max_archived_caches,
+                         backend)
 
 def set_argparser(parser):
     parser.description = 'manage mails cache'
@@ -256,3 +653,7 @@ def set_argparser(parser):
     parser_config.add_argument(
             'max_archived_caches', type=int, metavar='<int>',
             help='maximum number of archived caches')
+    parser_config.add_argument(
+            '--backend', choices=cache_backends,
+            help='storage backend of the cache.  Keep the current one if '
+            'not given')
@@ -5,6 +5,7 @@ import os
 import sys
 
 import _hkml
+import _hkml_state
 
 '''
 The file is a json format, having a list of strings.
@@ -24,15 +25,27 @@ def read_config_file():
             global_config = json.load(f)
     return global_config
 
-def write_config_file(config):
-    with open(config_file_path(), 'w') as f:
-        json.dump(config, f, indent=4, sort_keys=True)
+def set_config_value(config, name, value):
+    config[name] = value
+    return config
+
+def remove_config_value(config, name):
+    config.pop(name, None)
+    return config
+
+def update_config_file(update_fn):
+    '''Apply update_fn to the latest content of the config file, which
+    another hkml process might have changed after read_config_file()'''
+    global global_config
+
+    global_config = _hkml_state.update_json(
+            config_file_path(), update_fn, default={}, sort_keys=True)
 
 def main(args):
     config = read_config_file()
     if args.action == 'set':
-        config[args.name] = args.value
-        write_config_file(config)
+        update_config_file(
+                lambda c: set_config_value(c, args.name, args.value))
         return
     elif args.action == 'get':
         if args.name is None:
@@ -42,8 +55,9 @@ def main(args):
         print('%s' % config[args.name])
         return
     elif args.action == 'remove':
-        del config[args.name]
-        write_config_file(config)
+        if not args.name in config:
+            raise KeyError(args.name)
+        update_config_file(lambda c: remove_config_value(c, args.name))
         return
     raise Exception("Bug!  Please report to hkml maintainer!")
 
@@ -15,6 +15,9 @@ def export_mails(mails, export_file, human_readable=False):
         for mail in mails:
             if mail.mbox is None:
                 mail.get_msgid()
+            if mail.mbox is None:
+                # mbox has dropped by drop_mbox()
+                mail.set_mbox()
             if human_readable:
                 f.write(hkml_open.mail_display_str(
                     mail, head_columns=None, valid_mbox=True))
@@ -1,34 +1,236 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0
 
+import concurrent.futures
+import json
 import os
 import subprocess
+import time
 
 import _hkml
+import _hkml_gitlog_index
 import _hkml_list_cache
+import _hkml_state
+import hkml_config
 
-def fetch_mail(mail_lists, quiet=False, epochs=1):
+'''
+Fetch state of each epoch git dir is saved in 'hkml_fetch_state' file of the
+dir, as a json dict having below key/values.
+- 'last_fetch': timestamp of the last fetch
+- 'tip': commit id of the tip after the last fetch
+
+Based on it, fetch of an epoch is skipped if it was fetched less than max_age
+seconds ago, or if check_remote_tip is set and the tip of the remote repo is
+same to the local one.  Defaults of those can be set via 'fetch-max-age' and
+'fetch-check-remote-tip' configs, so that 'hkml list --fetch' and 'hkml
+monitor' also use those.
+'''
+
+def fetch_state_path(local_path):
+    return os.path.join(local_path, 'hkml_fetch_state')
+
+def read_fetch_state(local_path):
+    try:
+        with open(fetch_state_path(local_path), 'r') as f:
+            return json.load(f)
+    except:
+        return {}
+
+def write_fetch_state(local_path, tip):
+    _hkml_state.write_json(fetch_state_path(local_path),
+                           {'last_fetch': time.time(), 'tip': tip})
+
+def remote_tip(git_url):
+    try:
+        output = subprocess.check_output(
+                ['git', 'ls-remote', git_url, 'HEAD'],
+                stderr=subprocess.DEVNULL).decode().split()
+    except:
+        return None
+    if len(output) == 0:
+        return None
+    return output[0]
+
+def epoch_is_fresh(git_url, local_path, max_age, check_remote_tip):
+    '''Return whether fetch of the epoch can be skipped, and the reason'''
+    if not os.path.isdir(local_path):
+        return False, None
+    state = read_fetch_state(local_path)
+    if max_age is not None and 'last_fetch' in state:
+        age = time.time() - state['last_fetch']
+        if age < max_age:
+            return True, 'fetched %d seconds ago' % age
+    if check_remote_tip:
+        local_tip = _hkml_gitlog_index.git_tip(local_path)
+        if local_tip is not None and local_tip == remote_tip(git_url):
+            write_fetch_state(local_path, local_tip)
+            return True, 'remote tip is same'
+    return False, None
+
+def default_fetch_policy():
+    '''Return max_age and check_remote_tip from the config'''
+    config = hkml_config.read_config_file()
+    max_age = None
+    if 'fetch-max-age' in config:
+        max_age = float(config['fetch-max-age'])
+    check_remote_tip = config.get('fetch-check-remote-tip', 'false')
+    check_remote_tip = check_remote_tip.lower() in ['true', 'yes', 'y', '1']
+    return max_age, check_remote_tip
+
+class ListFetchResult:
+    mail_list = None
+    outputs = None      # list of output lines
+    duration = None     # seconds
+    nr_bytes = None     # increased bytes of the local git dirs
+    updated = None      # whether new commits are received
+    failed = None       # whether any git command failed
+
+    # print outputs of git commands as those are made, instead of keeping
+    # those in outputs.  For showing progress of serial fetches.
+    stream = None
+    # whether to measure nr_bytes
+    measure_bytes = None
+
+    def __init__(self, mail_list, stream=False, measure_bytes=False):
+        self.mail_list = mail_list
+        self.outputs = []
+        self.duration = 0
+        self.nr_bytes = 0
+        self.updated = False
+        self.failed = False
+        self.stream = stream
+        self.measure_bytes = measure_bytes
+
+    def add_output(self, output):
+        if self.stream:
+            print(output)
+        else:
+            self.outputs.append(output)
+
+def git_dir_bytes(local_path):
+    '''Return bytes of the objects in the git dir'''
+    try:
+        lines = _hkml.cmd_lines_output(
+                ['git', '--git-dir=%s' % local_path, 'count-objects', '-v'])
+    except:
+        return 0
+    kib = 0
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name in ['size', 'size-pack'] and value.strip().isdigit():
+            kib += int(value)
+    return kib * 1024
+
+def fetch_epoch(git_url, local_path, result, max_age, check_remote_tip,
+                build_gitlog_index):
+    fresh, reason = epoch_is_fresh(
+            git_url, local_path, max_age, check_remote_tip)
+    if fresh:
+        result.add_output('skip fetching %s (%s)' % (local_path, reason))
+        update_gitlog_index(local_path, result, build_gitlog_index)
+        return
+
+    bytes_before = 0
+    if not os.path.isdir(local_path):
+        cmd = 'git clone --mirror %s %s' % (git_url, local_path)
+        tip_before = None
+    else:
+        cmd = 'git --git-dir=%s remote update' % local_path
+        tip_before = _hkml_gitlog_index.git_tip(local_path)
+        if result.measure_bytes:
+            bytes_before = git_dir_bytes(local_path)
+    result.add_output(cmd)
+    if result.stream:
+        returncode = subprocess.call(cmd.split())
+    else:
+        proc = subprocess.run(cmd.split(), stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+        returncode = proc.returncode
+        output = proc.stdout.decode(errors='ignore').strip()
+        if output:
+            result.add_output(output)
+    if returncode != 0:
+        result.failed = True
+
+    if not os.path.isdir(local_path):
+        return
+    if result.measure_bytes:
+        result.nr_bytes += git_dir_bytes(local_path) - bytes_before
+    tip_after = _hkml_gitlog_index.git_tip(local_path)
+    if tip_after != tip_before:
+        result.updated = True
+    if returncode == 0:
+        write_fetch_state(local_path, tip_after)
+    update_gitlog_index(local_path, result, build_gitlog_index)
+
+def update_gitlog_index(local_path, result, build):
+    '''Update the gitlog index of the epoch if it exists.  Build it if build
+    is True'''
+    if not build and not _hkml_gitlog_index.index_exists(local_path):
+        return
+    if build and not _hkml_gitlog_index.index_exists(local_path):
+        result.add_output('building gitlog index of %s' % local_path)
+    err = _hkml_gitlog_index.update_index(local_path, result.add_output)
+    if err is not None:
+        result.add_output('updating gitlog index failed (%s)' % err)
+
+def fetch_list(mlist, epochs, site, max_age, check_remote_tip, stream=False,
+               measure_bytes=False, build_gitlog_index=False):
+    result = ListFetchResult(mlist, stream, measure_bytes)
+    start_time = time.time()
+    repo_paths = _hkml.mail_list_repo_paths(mlist)[:epochs]
+    local_paths = _hkml.mail_list_data_paths(mlist)[:epochs]
+    for idx, repo_path in enumerate(repo_paths):
+        git_url = '%s%s' % (site, repo_path)
+        fetch_epoch(git_url, local_paths[idx], result, max_age,
+                    check_remote_tip, build_gitlog_index)
+    result.duration = time.time() - start_time
+    return result
+
+def pr_fetch_summary(results):
+    print('# fetch summary')
+    for result in sorted(results, key=lambda r: r.duration, reverse=True):
+        print('# %s: %.3f seconds, %.3f MiB%s' % (
+            result.mail_list, result.duration,
+            result.nr_bytes / 1024 / 1024,
+            ', updated' if result.updated else ''))
+
+def fetch_mail(mail_lists, quiet=False, epochs=1, jobs=1, max_age=None,
+               check_remote_tip=None, build_gitlog_index=False):
     site = _hkml.get_manifest()['site']
-    for mlist in mail_lists:
-        _hkml_list_cache.invalidate_cached_outputs(mlist)
-        repo_paths = _hkml.mail_list_repo_paths(mlist)[:epochs]
-        local_paths = _hkml.mail_list_data_paths(mlist)[:epochs]
-
-        for idx, repo_path in enumerate(repo_paths):
-            git_url = '%s%s' % (site, repo_path)
-            local_path = local_paths[idx]
-            if not os.path.isdir(local_path):
-                cmd = 'git clone --mirror %s %s' % (git_url, local_path)
-            else:
-                cmd = 'git --git-dir=%s remote update' % local_path
-            if not quiet:
-                print(cmd)
-                subprocess.call(cmd.split())
-            else:
-                with open(os.devnull, 'w') as f:
-                    subprocess.call(cmd.split(), stdout=f)
+    default_max_age, default_check_remote_tip = default_fetch_policy()
+    if max_age is None:
+        max_age = default_max_age
+    if check_remote_tip is None:
+        check_remote_tip = default_check_remote_tip
+    # parallel fetches' outputs are printed per list, after the fetch
+    stream = not quiet and jobs <= 1
+    # only for the summary
+    measure_bytes = not quiet and len(mail_lists) > 1
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(jobs, 1)) as executor:
+        futures = [executor.submit(fetch_list, mlist, epochs, site, max_age,
+                                   check_remote_tip, stream, measure_bytes,
+                                   build_gitlog_index)
+                   for mlist in mail_lists]
+        # print outputs of each list at once, as the fetch is completed
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            # show errors even in quiet mode
+            if (not quiet or result.failed) and len(result.outputs) > 0:
+                print('\n'.join(result.outputs))
+
+    for result in results:
+        if result.updated:
+            _hkml_list_cache.invalidate_cached_outputs(result.mail_list)
     _hkml_list_cache.writeback_list_output()
 
+    if not quiet and len(results) > 1:
+        print()
+        pr_fetch_summary(results)
+
 def fetched_mail_lists():
     archive_dir = os.path.join(_hkml.get_hkml_dir(), 'archives')
     return [d for d in os.listdir(archive_dir)
@@ -42,7 +244,11 @@ def main(args):
         print('mail lists to fetch is not specified')
         exit(1)
     quiet = args.quiet
-    fetch_mail(mail_lists, quiet, args.epochs)
+    check_remote_tip = None
+    if args.check_remote_tip:
+        check_remote_tip = True
+    fetch_mail(mail_lists, quiet, args.epochs, args.jobs, args.max_age,
+               check_remote_tip, args.build_gitlog_index)
 
 def set_argparser(parser):
     parser.description = 'fetch mails'
@@ -53,3 +259,18 @@ def set_argparser(parser):
             help='Work silently.')
     parser.add_argument('--epochs', type=int, default=1,
             help='Minimum number of last epochs to fetch')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='<int>',
+            help='Number of mailing lists to fetch in parallel')
+    parser.add_argument('--max_age', type=float, metavar='<seconds>',
+            help=' '.join([
+                'Skip fetching epochs that fetched less than this seconds ago.',
+                'Default is \'fetch-max-age\' config, if set.']))
+    parser.add_argument('--check_remote_tip', action='store_true',
+            help=' '.join([
+                'Skip fetching epochs of same remote tip.',
+                'Default is \'fetch-check-remote-tip\' config, if set.']))
+    parser.add_argument('--build_gitlog_index', action='store_true',
+            help=' '.join([
+                'Build index of the mails in the fetched epochs, for fast',
+                'date range listing.  Built indexes are updated by later',
+                'fetches.']))
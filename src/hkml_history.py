@@ -5,6 +5,7 @@ import json
 import os
 
 import _hkml
+import _hkml_state
 
 class HistoryEvent:
     timestamp = None
@@ -45,6 +46,7 @@ class History:
                 }
 
 history = None
+max_nr_events = 256
 
 def history_file_path():
     return os.path.join(_hkml.get_hkml_dir(), 'hkml_history')
@@ -65,19 +67,25 @@ def get_history():
     return history
 
 def writeback_history():
-    file_path = history_file_path()
-    with open(file_path, 'w') as f:
-        json.dump(history.to_kvpairs(), f, indent=4)
+    _hkml_state.write_json(history_file_path(), history.to_kvpairs())
+
+def append_event_kvpairs(history_kvpairs, event_kvpairs):
+    events = history_kvpairs['events'][-1 * (max_nr_events - 1):]
+    return {'events': events + [event_kvpairs]}
 
 def add_event(desc):
     timestamp = datetime.datetime.now().timestamp()
     event = HistoryEvent(timestamp, desc)
 
     history = get_history()
-    if len(history.events) >= 256:
+    if len(history.events) >= max_nr_events:
         history.events = history.events[1:]
     history.events.append(event)
-    writeback_history()
+    # events from other hkml processes may be added in the meantime
+    _hkml_state.update_json(
+            history_file_path(),
+            lambda kvpairs: append_event_kvpairs(kvpairs, event.to_kvpairs()),
+            default={'events': []}, defer=True)
 
 def main(args):
     if args.action == 'list':
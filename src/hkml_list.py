@@ -17,17 +17,21 @@ import _hkml
 import _hkml_cli
 import _hkml_date
 import _hkml_fmtstr
+import _hkml_git_batch
+import _hkml_gitlog_index
 import _hkml_list_cache
+import _hkml_pisearch
+import _hkml_search_index
 import _hkml_subproc
 import hkml_cache
 import hkml_fetch
 import hkml_history
 import hkml_manifest
-import hkml_open
-import hkml_patch
 import hkml_tag
-import hkml_view
-import hkml_view_mails
+
+# hkml_open, hkml_patch, hkml_view and hkml_view_mails are imported by the
+# functions using those, since importing those takes long time and those are
+# not needed for listing to stdout.
 
 def args_to_lists_cache_key(args):
     dict_ = copy.deepcopy(args.__dict__)
@@ -116,10 +120,39 @@ class MailListDecorator:
             setattr(self, key, value)
         return self
 
+def find_ancestor_items_from_thread_index(
+        ancestor_msgids, msgid_items, found_parents):
+    '''Returns the item of the oldest ancestor that newly found, or None if
+    the remaining ancestors are already found or not cached'''
+    ancestor_item = None
+    for msgid in ancestor_msgids:
+        if msgid in msgid_items:
+            return None
+        ancestor = hkml_cache.get_mail(key=msgid)
+        if ancestor is None:
+            return None
+        ancestor_item = MailListMailItem(
+                mail_cache_key=hkml_cache.get_cache_key(
+                    ancestor.gitid, ancestor.gitdir, msgid), mail=ancestor,
+                prdepth=None, parent_item=None, added_by_tag=None)
+        msgid_items[msgid] = ancestor_item
+        found_parents.append(ancestor_item)
+    return ancestor_item
+
 def find_ancestor_items_from_cache(mail_item, msgid_items, found_parents):
     parent_msgid = mail_item.mail.get_in_reply_to_msgid()
     if parent_msgid is None or parent_msgid in msgid_items:
         return
+    ancestor_msgids = hkml_cache.get_ancestor_msgids(parent_msgid)
+    if ancestor_msgids:
+        oldest_item = find_ancestor_items_from_thread_index(
+                ancestor_msgids, msgid_items, found_parents)
+        # mails that cached without mbox are not in the index.  Look up the
+        # parent of the oldest one from the mail.
+        if oldest_item is not None:
+            find_ancestor_items_from_cache(
+                    oldest_item, msgid_items, found_parents)
+        return
     parent = hkml_cache.get_mail(key=parent_msgid)
 
     if parent is None:
@@ -319,6 +352,9 @@ class MailListFilter:
                 and not self.from_to_cc_keywords and not self.subject_keywords
                 and not self.body_keywords and not self.patches_for)
 
+    def needs_mail_body(self):
+        return self.body_keywords or self.patches_for
+
     def fill_thread_items_with(self, mail_item, thread_items):
         thread_items.append(mail_item)
         for reply in mail_item.reply_items:
@@ -357,10 +393,21 @@ class MailListFilter:
             return True
         if not keywords_in(self.subject_keywords, mail.subject):
             return True
-        if not keywords_in(self.body_keywords, mail.get_body()):
+        if not self.body_keywords_in(mail):
             return True
         return False
 
+    def body_keywords_in(self, mail):
+        if self.body_keywords is None:
+            return True
+        found = _hkml_search_index.keywords_in_field(
+                self.body_keywords, 'body', _hkml_search_index.mail_key(mail))
+        if found is not None:
+            return found
+        found = keywords_in(self.body_keywords, mail.get_body())
+        _hkml_search_index.index_mail(mail)
+        return found
+
     def should_filter_out_keywords(self, mails):
         # if any mail is ok to filter in, filter in.
         if mails is None:
@@ -375,6 +422,8 @@ class MailListFilter:
             return False
         if not 'patch' in mail.subject_tags:
             return True
+        import hkml_patch
+        import hkml_view_mails
         if self.patches_for in [['review'], ['pick']]:
             if hkml_patch.is_cover_letter(mail):
                 return True
@@ -506,6 +555,9 @@ class RuntimeProfile:
         self.runtime = self.end_time - self.start_time
 
 class RuntimeProfiles:
+    # categories in the order of the execution
+    categories = ['get_mails', 'threads_extract', 'set_index', 'filtering',
+                  'etc']
     profiles = None # category name to RuntimeProfile dict
     print_progress = None
 
@@ -523,6 +575,11 @@ class RuntimeProfiles:
         if self.print_progress:
             print('# %s done (%s)' % (category, self.profiles[category].runtime))
 
+    def mails_to_list_decided(self, mail_items, list_decorator):
+        '''Called when the mails to list are sorted and filtered, before
+        those are formatted'''
+        pass
+
 def sort_filter_mails(mail_items, do_find_ancestors_from_cache,
                       mails_filter, list_decorator, show_thread_of,
                       runtime_profile, runtime_profiles):
@@ -648,45 +705,72 @@ def child_of(mail_item, parents):
         return True
     return child_of(mail_item.parent_item, parents)
 
-def fmt_mails_text(mail_items, list_decorator, mails_to_collapse):
+def thread_end_idx(mail_items, idx):
     '''
-    Format a text for showing the mail items as a list.
+    Returns the index of the first item after mail_items[idx] that is not a
+    reply of mail_items[idx].  Replies of an item are placed right after the
+    item.
+    '''
+    root = mail_items[idx]
+    end_idx = idx + 1
+    while end_idx < len(mail_items) and child_of(mail_items[end_idx], [root]):
+        end_idx += 1
+    return end_idx
 
-    mail items contains all fields that are needed to be formatted, and sorted
-    in the listing order.
+def max_digits_for_idx_of(mail_items):
+    max_index = len(mail_items) - 1
+    if max_index == 0:
+        max_index = 1
+    return math.ceil(math.log(max_index, 10))
+
+def fmt_mail_items_lines(mail_items, start_idx, end_idx, list_decorator,
+                         mails_to_collapse, max_digits_for_idx):
+    '''
+    Format lines for showing mail_items[start_idx:end_idx] as a part of the
+    list.  Returns the lines and the mail_items index of each line.
     '''
     lines = []
-    line_nr_mail_idx_map = {}
-    if len(mail_items) == 0:
-        return lines, line_nr_mail_idx_map
+    line_mail_idxs = []
     collapse_threads = list_decorator.collapse
     show_url = list_decorator.show_url
     nr_cols = list_decorator.cols
 
-    max_index = len(mail_items) - 1
-    if max_index == 0:
-        max_index = 1
-    max_digits_for_idx = math.ceil(math.log(max_index, 10))
-
-    collapse_root_items = []
-    for idx, mail_item in enumerate(mail_items):
+    idx = start_idx
+    while idx < end_idx:
+        mail_item = mail_items[idx]
         show_nr_replies = False
         if collapse_threads == True:
             if mail_item.prdepth > 0:
+                idx += 1
                 continue
             show_nr_replies = True
+        next_idx = idx + 1
         if idx in mails_to_collapse:
             show_nr_replies = True
-            collapse_root_items.append(mail_item)
-        if child_of(mail_item, collapse_root_items):
-            continue
+            # skip the replies
+            next_idx = thread_end_idx(mail_items, idx)
         mail_lines = format_entry(
                 mail_item, idx, max_digits_for_idx, show_nr_replies, show_url,
                 nr_cols)
-        for line_nr in range(len(lines), len(lines) + len(mail_lines)):
-            line_nr_mail_idx_map[line_nr] = idx
+        line_mail_idxs += [idx] * len(mail_lines)
         lines += mail_lines
-    return lines, line_nr_mail_idx_map
+        idx = next_idx
+    return lines, line_mail_idxs
+
+def fmt_mails_text(mail_items, list_decorator, mails_to_collapse):
+    '''
+    Format a text for showing the mail items as a list.
+
+    mail items contains all fields that are needed to be formatted, and sorted
+    in the listing order.
+
+    Returns the lines of the text and the mail_items index of each line.
+    '''
+    if len(mail_items) == 0:
+        return [], []
+    return fmt_mail_items_lines(
+            mail_items, 0, len(mail_items), list_decorator, mails_to_collapse,
+            max_digits_for_idx_of(mail_items))
 
 def format_stat_lines(mail_items, filtered_items, stat_authors):
     stat_lines = []
@@ -718,12 +802,12 @@ def format_runtime_profile_lines(runtime_profile, show_always, timestamp,
     return runtime_profile_lines
 
 class MailListMailItem:
-    mail_cache_key = None
-    mail = None
-    prdepth = None
-    parent_item = None
-    added_by_tag = None
-    reply_items = None  # list of MailListMailItem objects
+    # Tens of thousands of items can be made for a list.  Use slots to save
+    # memory.
+    __slots__ = ['mail_cache_key', 'mail', 'prdepth', 'parent_item',
+                 'added_by_tag',
+                 'reply_items',  # list of MailListMailItem objects
+                 ]
 
     def __init__(self, mail_cache_key, mail, prdepth, parent_item,
                  added_by_tag):
@@ -779,8 +863,7 @@ class MailsListData:
     comments_lines = None
     mail_lines = None
     mail_items = None    # list of MailListMailItem
-    # line number to mail_items index map
-    # line number starts from non-comment
+    # mail_items index of each line.  line number starts from non-comment
     line_nr_mail_idx_map = None
 
     def __init__(self, text, len_comments, mail_items=None,
@@ -801,6 +884,12 @@ class MailsListData:
         self.comments_lines = lines[:len_comments]
         self.mail_lines = lines[len_comments:]
 
+    def replace_mail_lines(self, start, end, lines, line_mail_idxs):
+        '''Replace mail lines of line numbers [start, end) with lines'''
+        self.mail_lines[start:end] = lines
+        self.line_nr_mail_idx_map[start:end] = line_mail_idxs
+        self.text = '\n'.join(self.comments_lines + self.mail_lines)
+
     def append_comments(self, comments_lines):
         self.comments_lines += comments_lines
         self.len_comments += len(comments_lines)
@@ -815,6 +904,9 @@ def mails_to_list_data(
     if len(mails_to_show) == 0:
         return None, 'no mail to list'
 
+    if mails_filter is not None and mails_filter.needs_mail_body():
+        _hkml.prefetch_mboxes(mails_to_show)
+
     mail_items_to_show = []
     for mail in mails_to_show:
         cache_key = hkml_cache.get_cache_key(
@@ -834,6 +926,9 @@ def mails_to_list_data(
     if add_tagged_mails:
         update_special_tagged_mail_items(filtered_items)
 
+    if runtime_profiles is not None:
+        runtime_profiles.mails_to_list_decided(filtered_items, list_decorator)
+
     lines, line_nr_mail_idx_map = fmt_mails_text(
             filtered_items, list_decorator, mails_to_collapse={})
 
@@ -852,6 +947,11 @@ def mails_to_list_data(
     else:
         text = '\n'.join(runtime_profile_lines + stat_lines + lines)
         len_comments = len(runtime_profile_lines) + len(stat_lines)
+    # headers for the list are parsed.  Drop mboxes of the listed mails, which
+    # can be kept in the memory for long time, e.g., by the interactive viewer.
+    for item in filtered_items:
+        if item.mail is not None:
+            item.mail.drop_mbox()
     return MailsListData(
             text, len_comments, mail_items=filtered_items,
             line_nr_mail_idx_map=line_nr_mail_idx_map), None
@@ -932,6 +1032,13 @@ def get_mails_gitlog_lines(mdir, since, until, min_nr_mails, max_nr_mails,
     lines = []
     if not os.path.isdir(mdir):
         return lines
+    if commits_range is None:
+        lines = _hkml_gitlog_index.get_gitlog_lines(
+                mdir, since, until, max_nr_mails,
+                min_nr_mails if use_min_nr_mails else None)
+        if lines is not None:
+            return lines
+        lines = []
     base_cmd = ['git', '--git-dir=%s' % mdir, 'log',
             '--date=iso-strict', '--pretty=%H %ad %s']
     if commits_range is not None:
@@ -957,6 +1064,21 @@ def get_mails_gitlog_lines(mdir, since, until, min_nr_mails, max_nr_mails,
             lines, mdir, since, commits_range, max_nr_mails)
     return lines
 
+def prefetch_uncached_mboxes(gitlog_lines, mdir):
+    gitdir = os.path.relpath(mdir, _hkml.get_hkml_dir())
+    gitids = []
+    for line in gitlog_lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        if hkml_cache.get_kvpairs(fields[0], gitdir) is None:
+            gitids.append(fields[0])
+    try:
+        _hkml_git_batch.prefetch_blobs(mdir, ['%s:m' % g for g in gitids])
+    except:
+        # mails will be read one by one
+        pass
+
 def get_mails_from_git(mail_list, since, until,
                        min_nr_mails, max_nr_mails, commits_range=None,
                        use_min_nr_mails=False):
@@ -966,9 +1088,11 @@ def get_mails_from_git(mail_list, since, until,
 
     mails = []
     for mdir in mdirs:
-        for line in get_mails_gitlog_lines(
+        lines = get_mails_gitlog_lines(
                 mdir, since, until, min_nr_mails, max_nr_mails, commits_range,
-                use_min_nr_mails=use_min_nr_mails):
+                use_min_nr_mails=use_min_nr_mails)
+        prefetch_uncached_mboxes(lines, mdir)
+        for line in lines:
             mail = git_log_output_line_to_mail(line, mdir)
             # mbox can be empty string if the commit is invalid one.
             if mail is None or mail.mbox == '':
@@ -1022,8 +1146,13 @@ def get_mails_from_atom(atom_file, mailing_list):
         mails.append(_hkml.Mail(atom_entry=entry, atom_ml=mailing_list))
     return mails, None
 
-def get_mails_from_pisearch(mailing_list, query_str):
+def get_mails_from_pisearch(mailing_list, query_str, fetch=False):
     '''Get mails from public inbox search query'''
+    if _hkml_pisearch.is_mirrored(mailing_list):
+        if fetch:
+            hkml_fetch.fetch_mail([mailing_list], True, 1)
+        return _hkml_pisearch.search_mails(mailing_list, query_str)
+
     pi_url = _hkml.get_manifest()['site']
     query_str = query_str.replace(' ', '+')
     query_url = '%s/%s/?q=%s&x=A' % (pi_url, mailing_list, query_str)
@@ -1122,15 +1251,12 @@ def get_thread_mails_from_web(msgid):
     if subprocess.call(['wget', down_url, '--directory-prefix=%s' % tmp_path],
                        stderr=subprocess.DEVNULL) != 0:
         return None, 'downloading mbox failed'
-    if subprocess.call(['gunzip', os.path.join(tmp_path, 't.mbox.gz')]) != 0:
-        return None, 'extracting mbox failed'
-    mails, err = get_mails(
-            os.path.join(tmp_path, 't.mbox'), False, None, None, None, None,
-            suggest_manifest_update=False)
-    os.remove(os.path.join(tmp_path, 't.mbox'))
+    # public-inbox provides mboxrd
+    mails = _hkml.read_mbox_file(
+            os.path.join(tmp_path, 't.mbox.gz'), mboxrd=True)
+    mails.sort(key=lambda mail: mail.date)
+    os.remove(os.path.join(tmp_path, 't.mbox.gz'))
     os.rmdir(tmp_path)
-    if err is not None:
-        return None, 'parsing mbox failed (%s)' % err
 
     deduped_mails = []
     msgids = {}
@@ -1162,9 +1288,7 @@ def get_mails(source, fetch, since, until,
         return mails, None
 
     if source_type == 'mbox':
-        mails = _hkml.read_mbox_file(source)
-        if max_nr_mails is not None:
-            mails = mails[:max_nr_mails]
+        mails = _hkml.read_mbox_file(source, max_nr_mails)
         mails.sort(key=lambda mail: mail.date)
         return mails, None
 
@@ -1172,7 +1296,7 @@ def get_mails(source, fetch, since, until,
         return hkml_tag.mails_of_tag(source), None
 
     if pisearch:
-        return get_mails_from_pisearch(source, pisearch)
+        return get_mails_from_pisearch(source, pisearch, fetch)
 
     if source_type == 'msgid':
         mails, err = get_thread_mails_from_web(source)
@@ -1215,6 +1339,7 @@ def show_list(text, to_stdout):
     if to_stdout:
         print(text)
         return
+    import hkml_open
     hkml_open.pr_with_pager_if_needed(text)
 
 def validate_set_source_type(args):
@@ -1259,10 +1384,12 @@ def use_cached_output(args):
         return False
     return True
 
-def args_to_mails_list_data(args, suggest_manifest_update):
+def args_to_mails_list_data(args, suggest_manifest_update,
+                            runtime_profiles=None):
     # return MailsListData and error
     # if cached output is used, line_nr_to_mail_idx_map and len_comments of the
     # list data becomes None.  Caller should make it when those on demand.
+    # runtime_profiles is a RuntimeProfiles object for receiving the progress.
     err = validate_set_source_type(args)
     if err is not None:
         return None, err
@@ -1306,7 +1433,8 @@ def args_to_mails_list_data(args, suggest_manifest_update):
         args.min_nr_mails = args.nr_mails
         args.max_nr_mails = args.nr_mails
 
-    runtime_profiles = RuntimeProfiles(using_hkml_view(args))
+    if runtime_profiles is None:
+        runtime_profiles = RuntimeProfiles(using_hkml_view(args))
     runtime_profiles.start('get_mails')
 
     timestamp = time.time()
@@ -1328,7 +1456,8 @@ def args_to_mails_list_data(args, suggest_manifest_update):
     if err is not None:
         return None, err
     if args.source_type == ['msgid']:
-        for line_nr, mail_idx in list_data.line_nr_mail_idx_map.items():
+        for line_nr, mail_idx in enumerate(
+                list_data.line_nr_mail_idx_map):
             mail = list_data.mail_items[mail_idx].mail
             # drop enclosing <>
             mail_msgid = mail.get_msgid()[1:-1]
@@ -1400,6 +1529,8 @@ def main(args):
         return print_history(args)
 
     if using_hkml_view(args):
+        import hkml_view
+        import hkml_view_mails
         return hkml_view.view(
                 draw_fn=hkml_view_mails.gen_show_mails_list, fn_args=args)
     list_data, err = args_to_mails_list_data(
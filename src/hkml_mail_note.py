@@ -4,6 +4,7 @@ import json
 import os
 
 import _hkml
+import _hkml_state
 
 class Note:
     text = None # string
@@ -52,12 +53,35 @@ class Notes:
 def mail_notes_file_path():
     return os.path.join(_hkml.get_hkml_dir(), 'mail_notes')
 
-def write_mail_notes_file(notes):
-    kvpairs = {
-            'mail_notes': [n.to_kvpairs() for n in notes],
-            }
-    with open(mail_notes_file_path(), 'w') as f:
-        json.dump(kvpairs, f, indent=4, sort_keys=True)
+def set_notes_of(kvpairs, msgid, notes):
+    '''Set notes of the mail in the json-loaded content of the notes file.
+    Remove those if notes is None'''
+    mail_notes = []
+    found = False
+    for kvp in kvpairs['mail_notes']:
+        if kvp['msgid'] != msgid:
+            mail_notes.append(kvp)
+            continue
+        found = True
+        if notes is not None:
+            mail_notes.append(notes.to_kvpairs())
+    if not found and notes is not None:
+        mail_notes.append(notes.to_kvpairs())
+    kvpairs['mail_notes'] = mail_notes
+    return kvpairs
+
+def write_mail_notes_file(msgid, notes):
+    '''Write notes of the mail of msgid to the latest content of the file,
+    which another hkml process might have changed.  Remove those if notes is
+    None'''
+    global global_mail_notes
+
+    kvpairs = _hkml_state.update_json(
+            mail_notes_file_path(),
+            lambda kvpairs: set_notes_of(kvpairs, msgid, notes),
+            default={'mail_notes': []}, sort_keys=True)
+    global_mail_notes = [Notes.from_kvpairs(kvp)
+                         for kvp in kvpairs['mail_notes']]
 
 def read_mail_notes_file():
     file_path = mail_notes_file_path()
@@ -94,7 +118,7 @@ def add_note(msgid, line_nr, text):
         notes.line_notes[line_nr] = []
     note = Note(text=text)
     notes.line_notes[line_nr].append(note)
-    write_mail_notes_file(full_mail_notes)
+    write_mail_notes_file(msgid, notes)
 
 def remove_notes(msgid, line_nr, indices):
     deleted = False
@@ -115,12 +139,13 @@ def remove_notes(msgid, line_nr, indices):
             del notes.line_notes[line_nr]
         if len(notes.line_notes) == 0:
             del full_mail_notes[notes_idx]
+            notes = None
         deleted = True
         break
     if not deleted:
         return 'No note for the msgid?'
 
-    write_mail_notes_file(full_mail_notes)
+    write_mail_notes_file(msgid, notes)
 
 def main(args):
     full_mail_notes = get_mail_notes()
@@ -2,15 +2,21 @@
 
 import copy
 import datetime
+import fcntl
+import heapq
 import json
-import math
 import os
+import signal
+import subprocess
 import sys
-import tempfile
 import time
 
 import _hkml
 import _hkml_date
+import _hkml_noti_queue
+import _hkml_state
+import hkml_cache
+import hkml_fetch
 import hkml_list
 
 class HkmlMonitorRequest:
@@ -93,16 +99,26 @@ def get_requests():
 
     return requests
 
-def write_requests_file():
-    requests = get_requests()
-    requests_file_path = get_requests_file_path()
-    with open(requests_file_path, 'w') as f:
-        json.dump([r.to_kvpairs() for r in requests], f, indent=4)
+def update_requests_file(update_fn):
+    '''Apply update_fn to the latest content of the requests file, which
+    another hkml process might have changed after get_requests()'''
+    global requests
+
+    requests = [HkmlMonitorRequest.from_kvpairs(kvp) for kvp in
+                _hkml_state.update_json(get_requests_file_path(), update_fn,
+                                        default=[])]
+
+def remove_request_kvpairs(requests_kvpairs, request_kvpairs):
+    for idx, kvpairs in enumerate(requests_kvpairs):
+        # the file might be written by an old version of hkml
+        if HkmlMonitorRequest.from_kvpairs(
+                kvpairs).to_kvpairs() == request_kvpairs:
+            del requests_kvpairs[idx]
+            break
+    return requests_kvpairs
 
 def add_requests(request):
-    requests = get_requests()
-    requests.append(request)
-    write_requests_file()
+    update_requests_file(lambda kvpairs: kvpairs + [request.to_kvpairs()])
 
 def remove_requests(name=None, idx=None):
     '''Returns whether removal has success'''
@@ -118,8 +134,9 @@ def remove_requests(name=None, idx=None):
 
     if idx >= len(requests):
         return False
-    del requests[idx]
-    write_requests_file()
+    request_kvpairs = requests[idx].to_kvpairs()
+    update_requests_file(
+            lambda kvpairs: remove_request_kvpairs(kvpairs, request_kvpairs))
     return True
 
 def pr_w_time(text):
@@ -133,43 +150,261 @@ def mail_in(mail, mails):
             return True
     return False
 
-def get_mails_to_check(request, ignore_mails_before, last_monitored_mails):
+# _hkml_noti_queue.NotiQueue for sending notification mails
+noti_queue = None
+
+class MonitorTarget:
+    '''Mails of a mailing list that fetched but not yet checked by every
+    monitoring request for the mailing list'''
+    mailing_list = None
+    # gitid of the last fetched commit
+    last_gitid = None
+    # gitid of the last mail that checked by every request for the list
+    checkpoint = None
+    # gitids of commits that not yet fetched, in the commit order
+    backlog = None
+    # gitids of backlog commits that start a new epoch.  Commits of different
+    # epochs are not in the same history.
+    epoch_starts = None
+    mails = None
+    # sequence number of mails[0]
+    mails_seq = None
+
+    def __init__(self, mailing_list, checkpoint):
+        self.mailing_list = mailing_list
+        self.last_gitid = checkpoint
+        self.checkpoint = checkpoint
+        self.backlog = []
+        self.epoch_starts = set()
+        self.mails = []
+        self.mails_seq = 0
+
+    def end_seq(self):
+        return self.mails_seq + len(self.mails)
+
+    def mails_from(self, seq):
+        return self.mails[max(seq - self.mails_seq, 0):]
+
+    def seq_after(self, gitid):
+        '''Return the sequence number of the mail next to the mail of the
+        gitid, or None if the mail is not yet fetched'''
+        for idx, mail in enumerate(self.mails):
+            if mail.gitid == gitid:
+                return self.mails_seq + idx + 1
+        if gitid in self.backlog:
+            return None
+        return self.mails_seq
+
+    def drop_mails_before(self, seq):
+        nr_drop = seq - self.mails_seq
+        if nr_drop <= 0:
+            return
+        self.checkpoint = self.mails[nr_drop - 1].gitid
+        self.mails = self.mails[nr_drop:]
+        self.mails_seq = seq
+
+def commit_in(mdir, gitid):
+    return subprocess.call(
+            ['git', '--git-dir=%s' % mdir, 'cat-file', '-e',
+             '%s^{commit}' % gitid], stderr=subprocess.DEVNULL) == 0
+
+def get_new_gitids(target, ignore_mails_before):
+    '''Return lists of gitids of commits of the mailing list that not yet
+    fetched to the target, one list per epoch in the epoch order, and an
+    error.  Each list is in the commit order'''
+    mdirs = _hkml.mail_list_data_paths(target.mailing_list)
+    if not mdirs:
+        return None, 'mailing list %s not found' % target.mailing_list
+    # mail_list_data_paths() returns newest epoch first
+    mdirs = [mdir for mdir in reversed(mdirs) if os.path.isdir(mdir)]
+    if target.last_gitid is not None:
+        # skip epochs before the one having the last fetched commit
+        for idx, mdir in enumerate(mdirs):
+            if commit_in(mdir, target.last_gitid):
+                mdirs = mdirs[idx:]
+                break
+        else:
+            return None, 'last fetched commit %s not found' % (
+                    target.last_gitid)
+
+    gitids_list = []
+    for idx, mdir in enumerate(mdirs):
+        cmd = ['git', '--git-dir=%s' % mdir, 'rev-list', '--reverse']
+        if target.last_gitid is None:
+            cmd += ['--since=%s' %
+                    ignore_mails_before.strftime('%Y-%m-%d %H:%M:%S'),
+                    'HEAD']
+        elif idx == 0:
+            cmd += ['%s..' % target.last_gitid]
+        else:
+            # epochs made after the last fetch
+            cmd += ['HEAD']
+        try:
+            gitids_list.append(
+                    [l for l in _hkml.cmd_lines_output(cmd) if l != ''])
+        except Exception as e:
+            return None, 'git rev-list failed (%s)' % e
+    return gitids_list, None
+
+def update_backlog(target, ignore_mails_before):
+    gitids_list, err = get_new_gitids(target, ignore_mails_before)
+    if err is not None:
+        return err
+    target.backlog = []
+    target.epoch_starts = set()
+    for gitids in gitids_list:
+        if len(target.backlog) > 0 and len(gitids) > 0:
+            target.epoch_starts.add(gitids[0])
+        target.backlog += gitids
+    return None
+
+def fetch_next_batch(target, ignore_mails_before, batch_size):
+    '''Read up to batch_size oldest mails in the backlog of the target.
+    Returns an error string or None'''
+    batch = target.backlog[:batch_size]
+    if len(batch) == 0:
+        return None
+    # a range of commits cannot span epochs
+    for idx in range(1, len(batch)):
+        if batch[idx] in target.epoch_starts:
+            batch = batch[:idx]
+            break
+    since = None
+    if target.last_gitid is None:
+        # the backlog is made with the same since
+        since = ignore_mails_before
+        commits_range = batch[-1]
+    elif batch[0] in target.epoch_starts:
+        # the backlog has all commits of the epoch
+        commits_range = batch[-1]
+    else:
+        commits_range = '%s..%s' % (target.last_gitid, batch[-1])
+
+    fetched_mails, err = hkml_list.get_mails(
+            source=target.mailing_list, fetch=False,
+            since=since, until=None, min_nr_mails=None, max_nr_mails=None,
+            commits_range=commits_range)
+    if err is not None:
+        return 'hkml_list.get_mails() failed (%s)' % err
+    batch_gitids = set(batch)
+    fetched_mails = [m for m in fetched_mails if m.gitid in batch_gitids]
+    target.backlog = target.backlog[len(batch):]
+    target.last_gitid = batch[-1]
+    target.mails += fetched_mails
+    monitor_threads.add_mails(fetched_mails)
+    return None
+
+def get_mails_to_check(request, targets, cursors, last_checked):
+    '''Return mails of the request's mailing lists that the request didn't
+    check so far.  cursors is a dict having the mailing lists as keys and the
+    sequence number of the next mail for the request to check, or the gitid
+    of the last checked mail if the sequence number is not yet known, as
+    values.  last_checked is a dict having the mailing lists as keys and the
+    gitid of the last checked mail as values'''
     mails_to_check = []
     msgids = {}
     for mailing_list in request.mailing_lists:
-        if not mailing_list in last_monitored_mails:
-            last_monitored_mails[mailing_list] = None
-        last_mail = last_monitored_mails[mailing_list]
-        if last_mail is None:
-            since = ignore_mails_before
-            commits_range = None
-        else:
-            since = None
-            commits_range = '%s..' % last_mail.gitid
-
-        fetched_mails, err = hkml_list.get_mails(
-                source=mailing_list, fetch=True,
-                since=since, until=None, min_nr_mails=None, max_nr_mails=None,
-                commits_range=commits_range)
-        if err is not None:
-            print('hkml_list.get_mails() failed (%s)' % err)
-            return []
-        if len(fetched_mails) > 0:
-            last_monitored_mails[mailing_list] = fetched_mails[-1]
-        for mail in fetched_mails:
+        target = targets[mailing_list]
+        cursor = cursors[mailing_list]
+        if type(cursor) is str:
+            cursor = target.seq_after(cursor)
+            if cursor is None:
+                # the mails in the buffer are already checked
+                continue
+        for mail in target.mails_from(cursor):
             msgid = mail.get_msgid()
             if not msgid in msgids:
                 mails_to_check.append(mail)
             msgids[msgid] = True
+        cursors[mailing_list] = target.end_seq()
+        if len(target.mails) > 0:
+            last_checked[mailing_list] = target.mails[-1].gitid
     return mails_to_check
 
+class MonitorThreads:
+    '''Reply trees of monitored mails.  Updated incrementally for each new
+    mail, so that thread-aware filters can be applied without re-threading
+    or re-fetching old mails'''
+    # key: msgid, value: MailListMailItem
+    items = None
+    # key: msgid of unknown parent mail, value: list of MailListMailItem
+    # objects replying to the parent
+    orphans = None
+    # drop old items if the number of items exceeds this
+    max_nr_items = 100000
+
+    def __init__(self):
+        self.items = {}
+        self.orphans = {}
+
+    def link(self, parent_item, item):
+        item.parent_item = parent_item
+        parent_item.reply_items.append(item)
+
+    def add_cached_ancestors(self, msgid):
+        '''Add the mail of the msgid and its ancestors from the mails
+        cache'''
+        ancestors = []
+        while msgid is not None and not msgid in self.items:
+            mail = hkml_cache.get_mail(key=msgid)
+            if mail is None:
+                break
+            ancestors.append(mail)
+            msgid = mail.get_in_reply_to_msgid()
+            if msgid in [m.get_msgid() for m in ancestors]:
+                break
+        for mail in reversed(ancestors):
+            self.add_mail(mail, find_cached_ancestors=False)
+
+    def add_mail(self, mail, find_cached_ancestors=True):
+        '''Add the mail to the reply trees, and return the MailListMailItem
+        for the mail'''
+        msgid = mail.get_msgid()
+        if msgid in self.items:
+            return self.items[msgid]
+        # threading needs only the header.  Don't keep the mbox for long.
+        mail.drop_mbox()
+        item = hkml_list.MailListMailItem(
+                mail_cache_key=None, mail=mail, prdepth=None,
+                parent_item=None, added_by_tag=None)
+        self.items[msgid] = item
+        for reply in self.orphans.pop(msgid, []):
+            self.link(item, reply)
+
+        parent_msgid = mail.get_in_reply_to_msgid()
+        if parent_msgid is None:
+            return item
+        # parent of orphans is already searched from the cache
+        if (find_cached_ancestors and not parent_msgid in self.items and
+                not parent_msgid in self.orphans):
+            self.add_cached_ancestors(parent_msgid)
+        if parent_msgid in self.items:
+            self.link(self.items[parent_msgid], item)
+        else:
+            if not parent_msgid in self.orphans:
+                self.orphans[parent_msgid] = []
+            self.orphans[parent_msgid].append(item)
+        return item
+
+    def add_mails(self, mails):
+        for mail in mails:
+            self.add_mail(mail)
+        if len(self.items) > self.max_nr_items:
+            # drop older half.  Remaining items keep links to the dropped
+            # items.
+            msgids = list(self.items.keys())
+            for msgid in msgids[:len(msgids) // 2]:
+                del self.items[msgid]
+            parent_msgids = list(self.orphans.keys())
+            for msgid in parent_msgids[:len(parent_msgids) // 2]:
+                del self.orphans[msgid]
+
+monitor_threads = MonitorThreads()
+
 def get_mails_to_noti(mails_to_check, request):
-    items_to_check = []
-    for mail in mails_to_check:
-        items_to_check.append(hkml_list.MailListMailItem(
-            mail_cache_key=None, mail=mail, prdepth=None, parent_item=None,
-            added_by_tag=None))
-    # todo: set item parent/replies
+    # replies and parents of the items are set by monitor_threads
+    items_to_check = [monitor_threads.add_mail(mail)
+                      for mail in mails_to_check]
 
     mails_to_noti = []
     for mail_item in items_to_check:
@@ -178,6 +413,9 @@ def get_mails_to_noti(mails_to_check, request):
 
         mails_to_noti.append(mail_item.mail)
 
+    # filters might read the mbox again
+    for mail_item in items_to_check:
+        mail_item.mail.drop_mbox()
     return mails_to_noti
 
 def format_noti_text(request, mails_to_noti):
@@ -200,9 +438,7 @@ def format_noti_text(request, mails_to_noti):
     noti_text = '\n'.join(lines)
     return noti_text
 
-def do_monitor(request, ignore_mails_before, last_monitored_mails):
-    mails_to_check = get_mails_to_check(request, ignore_mails_before,
-                                        last_monitored_mails)
+def do_monitor(request, mails_to_check):
     mails_to_noti = get_mails_to_noti(mails_to_check, request)
 
     print('%d mails to noti' % len(mails_to_noti))
@@ -221,62 +457,220 @@ def do_monitor(request, ignore_mails_before, last_monitored_mails):
 
     if request.noti_files is not None:
         for file in request.noti_files:
-            lines = []
-            if os.path.isfile(file):
-                with open(file, 'r') as f:
-                    lines.append(f.read())
-            with open(file, 'w') as f:
-                f.write('\n'.join(lines + [noti_text]))
+            with open(file, 'a') as f:
+                if f.tell() > 0:
+                    f.write('\n')
+                f.write(noti_text)
 
     if request.noti_mails is not None:
-        mail_content = '\n'.join([
-                'Subject: [hkml-noti] for monitor request %s' % request.name,
-                '',
-                noti_text])
-        fd, tmp_path = tempfile.mkstemp(prefix='hkml_monitor_')
-        with open(tmp_path, 'w') as f:
-            f.write(mail_content)
-
-        try:
-            _hkml.cmd_str_output(['git', 'send-email', tmp_path,
-                                  '--8bit-encoding=UTF-8', '--confirm', 'never',
-                                  '--to'] + request.noti_mails)
-        except Exception as e:
-            print('git send-email fail (%s)' % e)
-        os.remove(tmp_path)
+        noti_queue.add(request.noti_mails, request.name, noti_text)
 
 def get_monitor_stop_file_path():
     return os.path.join(_hkml.get_hkml_dir(), 'monitor_stop')
 
-def start_monitoring(ignore_mails_before):
-    requests = get_requests()
+def get_monitor_pid_file_path():
+    return os.path.join(_hkml.get_hkml_dir(), 'monitor_pid')
+
+def lock_monitor_pid_file():
+    '''Write pid of this process to the pid file, and lock the file until the
+    returned file descriptor is closed.  The lock tells other processes that
+    the pid is of a running monitor.  Returns None if another monitor holds
+    the lock'''
+    fd = os.open(get_monitor_pid_file_path(), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    os.ftruncate(fd, 0)
+    os.write(fd, b'%d' % os.getpid())
+    return fd
+
+def running_monitor_pid():
+    '''Return pid of the running monitor, or None if no monitor is running'''
+    try:
+        fd = os.open(get_monitor_pid_file_path(), os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        # the monitor holds the lock
+        try:
+            return int(os.read(fd, 64))
+        except ValueError:
+            # the monitor is not yet written its pid
+            return None
+        finally:
+            os.close(fd)
+    # left by a monitor that killed
+    os.remove(get_monitor_pid_file_path())
+    os.close(fd)
+    return None
+
+def get_monitor_state_file_path():
+    return os.path.join(_hkml.get_hkml_dir(), 'monitor_state')
+
+def request_state_key(request):
+    return json.dumps(request.to_kvpairs(), sort_keys=True)
+
+def read_monitor_state():
+    '''Return a dict having below keys and values.
+    'last_monitored_mails': a dict having mailing lists as keys and gitid of
+    the last mail that all requests for the list checked as values.
+    'requests': a dict having request_state_key() of requests as keys and
+    dicts having mailing lists as keys and gitid of the last mail that the
+    request checked as values.'''
+    state = _hkml_state.read_json(get_monitor_state_file_path(), {})
+    for key in ['last_monitored_mails', 'requests']:
+        if not key in state:
+            state[key] = {}
+    return state
+
+def write_monitor_state(requests, targets, last_checked):
+    state = read_monitor_state()
+    for mailing_list, target in targets.items():
+        if target.checkpoint is not None:
+            state['last_monitored_mails'][mailing_list] = target.checkpoint
+    state['requests'] = {request_state_key(r): last_checked[idx]
+                         for idx, r in enumerate(requests)}
+    _hkml_state.write_json(get_monitor_state_file_path(), state)
+
+def monitor_requests(requests, due_idxs, targets, cursors, last_checked,
+                     ignore_mails_before, batch_size):
+    '''Do monitoring for requests of due_idxs.  Each mailing list is fetched
+    only once, and the new mails are checked by each request.  If there are
+    more than batch_size new mails, those are checked in batches of
+    batch_size mails'''
+    mailing_lists = []
+    for idx in due_idxs:
+        for mailing_list in requests[idx].mailing_lists:
+            if not mailing_list in mailing_lists:
+                mailing_lists.append(mailing_list)
+    for mailing_list in mailing_lists:
+        hkml_fetch.fetch_mail([mailing_list], True, 1)
+        target = targets[mailing_list]
+        err = update_backlog(target, ignore_mails_before)
+        if err is not None:
+            print(err)
+        if len(target.backlog) > batch_size:
+            pr_w_time('catch up %d mails of %s in batches of %d mails' %
+                      (len(target.backlog), mailing_list, batch_size))
+
+    while True:
+        for mailing_list in mailing_lists:
+            err = fetch_next_batch(targets[mailing_list], ignore_mails_before,
+                                   batch_size)
+            if err is not None:
+                print(err)
+                targets[mailing_list].backlog = []
+
+        for idx in due_idxs:
+            do_monitor(requests[idx], get_mails_to_check(
+                requests[idx], targets, cursors[idx], last_checked[idx]))
 
-    # math.gcd() supports arbitrary number of positional args starting from
-    # Python 3.9.  Support lower versions.
+        # drop mails that checked by every request
+        for mailing_list in mailing_lists:
+            target = targets[mailing_list]
+            target.drop_mails_before(min(
+                [c[mailing_list] if type(c[mailing_list]) is int
+                 else target.end_seq()
+                 for c in cursors if mailing_list in c]))
+        write_monitor_state(requests, targets, last_checked)
 
-    monitor_interval_gcd = requests[0].monitor_interval
-    for r in requests[1:]:
-        monitor_interval_gcd = math.gcd(monitor_interval_gcd, r.monitor_interval)
-    if monitor_interval_gcd < 60:
-        print('<60 seconds monitoring interval is too short!')
+        if sum([len(targets[l].backlog) for l in mailing_lists]) == 0:
+            break
+
+class MonitorWakeup(Exception):
+    pass
+
+# whether the monitoring loop is sleeping for next monitoring
+monitor_sleeping = False
+
+def handle_stop_signal(signum, frame):
+    if monitor_sleeping:
+        raise MonitorWakeup()
+
+def sleep_until(timestamp):
+    '''Sleep until the time or 'hkml monitor stop' is issued'''
+    global monitor_sleeping
+
+    if os.path.isfile(get_monitor_stop_file_path()):
+        return
+    try:
+        monitor_sleeping = True
+        time.sleep(max(timestamp - time.time(), 0))
+    except MonitorWakeup:
+        pass
+    finally:
+        monitor_sleeping = False
+
+def start_monitoring(ignore_mails_before, batch_size, noti_digest_window,
+                     noti_sendmail):
+    global noti_queue
+
+    requests = get_requests()
+
+    for r in requests:
+        if r.monitor_interval < 60:
+            print('<60 seconds monitoring interval is too short!')
+            return 1
+
+    state = read_monitor_state()
+    targets = {}
+    # cursors[i] and last_checked[i] are those for requests[i]
+    cursors = []
+    last_checked = []
+    for r in requests:
+        request_state = state['requests'].get(request_state_key(r), {})
+        cursors.append({})
+        last_checked.append({})
+        for mailing_list in r.mailing_lists:
+            if not mailing_list in targets:
+                targets[mailing_list] = MonitorTarget(
+                        mailing_list,
+                        state['last_monitored_mails'].get(mailing_list))
+            if mailing_list in request_state:
+                cursors[-1][mailing_list] = request_state[mailing_list]
+                last_checked[-1][mailing_list] = request_state[mailing_list]
+            else:
+                cursors[-1][mailing_list] = 0
+
+    pid_fd = lock_monitor_pid_file()
+    if pid_fd is None:
+        print('another monitor is running')
         return 1
+    signal.signal(signal.SIGUSR1, handle_stop_signal)
 
-    last_monitor_time = [None] * len(requests)
-    last_monitored_mails = []
-    for i in range(len(requests)):
-        last_monitored_mails.append({})
+    noti_queue = _hkml_noti_queue.NotiQueue(noti_digest_window,
+                                            noti_sendmail)
+    noti_queue.start()
 
-    while not os.path.isfile(get_monitor_stop_file_path()):
-        for idx, req in enumerate(requests):
-            last_monitor = last_monitor_time[idx]
+    # heap of (next monitoring time, request index)
+    schedule = [(0, idx) for idx in range(len(requests))]
+    try:
+        while not os.path.isfile(get_monitor_stop_file_path()):
             now = time.time()
-            if (last_monitor is None or
-                now - last_monitor >= req.monitor_interval):
-                do_monitor(req, ignore_mails_before, last_monitored_mails[idx])
-
-                last_monitor_time[idx] = now
-        pr_w_time('sleep %d seconds' % monitor_interval_gcd)
-        time.sleep(monitor_interval_gcd)
+            due_idxs = []
+            while len(schedule) > 0 and schedule[0][0] <= now:
+                due_idxs.append(heapq.heappop(schedule)[1])
+            if len(due_idxs) > 0:
+                monitor_requests(requests, sorted(due_idxs), targets,
+                                 cursors, last_checked, ignore_mails_before,
+                                 batch_size)
+                for idx in due_idxs:
+                    heapq.heappush(schedule,
+                                   (now + requests[idx].monitor_interval, idx))
+
+            next_time = schedule[0][0]
+            pr_w_time('sleep %d seconds' % max(next_time - time.time(), 0))
+            sleep_until(next_time)
+    finally:
+        # send pending notification mails
+        noti_queue.stop()
+        # remove the file before unlocking it, to not race with a new monitor
+        os.remove(get_monitor_pid_file_path())
+        os.close(pid_fd)
 
     os.remove(get_monitor_stop_file_path())
     return 0
@@ -284,6 +678,14 @@ def start_monitoring(ignore_mails_before):
 def stop_monitoring():
     with open(get_monitor_stop_file_path(), 'w') as f:
         f.write('issued at %s' % datetime.datetime.now())
+    # wake up the monitoring instance if it is sleeping
+    pid = running_monitor_pid()
+    if pid is None:
+        return
+    try:
+        os.kill(pid, signal.SIGUSR1)
+    except OSError:
+        pass
 
 def main(args):
     if args.action == 'add':
@@ -312,7 +714,8 @@ def main(args):
                 print('parsing --since failed (%s)' % err)
                 exit(1)
 
-        return start_monitoring(ignore_mails_before)
+        return start_monitoring(ignore_mails_before, args.catchup_batch,
+                                args.noti_digest_window, args.noti_sendmail)
     elif args.action == 'stop':
         stop_monitoring()
 
@@ -363,6 +766,22 @@ def set_argparser(parser):
             'start', help='start monitoring')
     _hkml_date.add_date_arg(
             parser_start, '--since',
-            'Ignore monitoring target mails that sent before this time')
+            ' '.join(['Ignore monitoring target mails that sent before this',
+                      'time.  Applied to only mailing lists that not',
+                      'monitored before']))
+    parser_start.add_argument(
+            '--catchup_batch', type=int, metavar='<number>', default=1000,
+            help='check new mails in batches of this number of mails')
+    parser_start.add_argument(
+            '--noti_digest_window', type=int, metavar='<seconds>', default=0,
+            help=' '.join([
+                'send notifications for same recipients that made within',
+                'this time as one mail']))
+    parser_start.add_argument(
+            '--noti_sendmail', metavar='<command>',
+            help=' '.join([
+                'sendmail-like command to send notification mails, instead',
+                'of \'git send-email\'.  The command receives the recipients',
+                'as arguments and the mail via stdin']))
 
     subparsers.add_parser('stop', help='stop monitoring')
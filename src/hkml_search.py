@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: GPL-2.0
+
+import os
+
+import _hkml
+import _hkml_list_cache
+import _hkml_search_index
+import hkml_cache
+import hkml_list
+
+def mail_has_keywords(mail, keywords, fields):
+    texts = []
+    for field in fields:
+        if field == 'body':
+            text = mail.get_body()
+        else:
+            text = mail.get_field(field)
+        if text is not None:
+            texts.append(text)
+    for keyword in keywords:
+        found = False
+        for text in texts:
+            if keyword in text:
+                found = True
+                break
+        if not found:
+            return False
+    return True
+
+def search_mails(keywords, fields):
+    '''Return cached mails having all the keywords in any of the fields, and
+    an error'''
+    nr_indexed, err = _hkml_search_index.update_index(print_progress=True)
+    if err is not None:
+        return None, err
+    keys, exact = _hkml_search_index.search(keywords, fields)
+    mails = []
+    for key in keys:
+        mail = hkml_cache.get_mail(key=key)
+        if mail is None:
+            continue
+        if not exact and not mail_has_keywords(mail, keywords, fields):
+            continue
+        mails.append(mail)
+    return mails, None
+
+def main(args):
+    if args.update_only:
+        nr_indexed, err = _hkml_search_index.update_index(print_progress=True)
+        if err is not None:
+            print(err)
+            exit(1)
+        print('%d mails newly indexed' % nr_indexed)
+        return
+
+    if not args.keywords:
+        print('no keyword is given')
+        exit(1)
+    mails, err = search_mails(args.keywords, args.fields)
+    if err is not None:
+        print('search failed (%s)' % err)
+        exit(1)
+    if len(mails) == 0:
+        print('no mail found')
+        return
+
+    list_decorator = hkml_list.MailListDecorator(None)
+    list_decorator.collapse = False
+    list_decorator.sort_threads_by = ['last_date']
+    list_decorator.ascend = False
+    list_decorator.show_url = args.url
+    list_decorator.hide_stat = True
+    try:
+        list_decorator.cols = int(os.get_terminal_size().columns * 9 / 10)
+    except OSError:
+        pass
+    list_data, err = hkml_list.mails_to_list_data(
+            mails, do_find_ancestors_from_cache=False, mails_filter=None,
+            list_decorator=list_decorator, show_thread_of=None,
+            runtime_profile=[], stat_only=False, stat_authors=False)
+    if err is not None:
+        print('mails_to_list_data() fail (%s)' % err)
+        exit(1)
+    hkml_cache.writeback_mails()
+    _hkml_list_cache.set_item('search_output', list_data)
+    hkml_list.show_list(list_data.text, to_stdout=args.stdout)
+
+def set_argparser(parser):
+    parser.description = 'search cached mails'
+    _hkml.set_manifest_option(parser)
+    parser.add_argument(
+            'keywords', metavar='<keyword>', nargs='*',
+            help='keywords that mails to find should have')
+    parser.add_argument(
+            '--fields', metavar='<field>', nargs='+',
+            choices=list(_hkml_search_index.field_bits.keys()),
+            default=list(_hkml_search_index.field_bits.keys()),
+            help='fields to search keywords from')
+    parser.add_argument('--url', action='store_true',
+            help='print URLs for mails')
+    parser.add_argument('--stdout', action='store_true',
+            help='print the output to stdout instead of the pager')
+    parser.add_argument('--update_only', action='store_true',
+            help='only update the search index')
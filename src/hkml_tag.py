@@ -6,54 +6,194 @@ import sys
 
 import _hkml
 import _hkml_list_cache
+import _hkml_state
 import hkml_sync
 
 '''
-Tags information is saved in a json file called 'tags' under the hkml
-directory.
+Tags information is saved in json files called 'tags' and 'tags_<number>'
+under the hkml directory.  Each file has tags information for up to 100 mails.
 
 The data structure is a map.  Keys are msgid of mails.  Values are map having
 keys 'mail' and 'tags'.  'mail' is _hkml.Mail.to_kvpairs() output of the mail
 of the message id.  'tags' is a list of tags for the mail.
+
+Previously, the mails were sorted by the msgid and distributed to the files
+in the order, so every file was rewritten for every change.  Now the mails
+stay in the file that they are first written, and only changed files are
+written.
 '''
 
+max_mails_per_file = 100
+
+# Tags information is read once and cached.  Below are for the cache.
+# the map.  read_tags_file() returns a copy of it.
+tags_map_cache = None
+# key: file name, value: (mtime, size) of the file when it is read/written
+tags_files_stat = {}
+# key: msgid, value: the file having the mail
+msgid_tags_file = {}
+# key: tag, value: list of msgids of the tag
+tag_msgids = None
+# key: msgid, value: (mail kvpairs, Mail object)
+tagged_mails = {}
+
 def tag_file_path():
     return os.path.join(_hkml.get_hkml_dir(), 'tags')
 
-def read_tags_file():
-    tags_map = {}
-    for filename in os.listdir(_hkml.get_hkml_dir()):
-        if not filename.startswith('tags'):
-            continue
+def list_tags_files():
+    return sorted([f for f in os.listdir(_hkml.get_hkml_dir())
+                   if f.startswith('tags')])
+
+def tags_file_stat(filename):
+    stat = os.stat(os.path.join(_hkml.get_hkml_dir(), filename))
+    return [stat.st_mtime_ns, stat.st_size]
+
+def tags_files_changed():
+    '''Return whether tags files are changed after last read/write'''
+    filenames = list_tags_files()
+    if sorted(tags_files_stat.keys()) != filenames:
+        return True
+    for filename in filenames:
+        if tags_file_stat(filename) != tags_files_stat[filename]:
+            return True
+    return False
+
+def copy_tags_entry(entry):
+    # 'mail' is never modified in place
+    copied = dict(entry)
+    copied['tags'] = list(entry['tags'])
+    return copied
+
+def get_tags_map():
+    '''Return the cached tags map.  Callers should not modify it'''
+    global tags_map_cache
+    global tag_msgids
+
+    if tags_map_cache is not None and not tags_files_changed():
+        return tags_map_cache
+
+    tags_map_cache = {}
+    tags_files_stat.clear()
+    msgid_tags_file.clear()
+    tag_msgids = None
+    for filename in list_tags_files():
         with open(os.path.join(_hkml.get_hkml_dir(), filename), 'r') as f:
-            for k, v in json.load(f).items():
-                tags_map[k] = v
-    return tags_map
+            tags_map = json.load(f)
+        tags_files_stat[filename] = tags_file_stat(filename)
+        for k, v in tags_map.items():
+            tags_map_cache[k] = v
+            msgid_tags_file[k] = filename
+    return tags_map_cache
 
-def write_tags_single_file(tags_map, file_idx):
-    if file_idx is not None:
-        suffix = '_%d' % file_idx
-    else:
-        suffix = ''
-    file_path = os.path.join(_hkml.get_hkml_dir(), 'tags%s' % suffix)
-    with open(file_path, 'w') as f:
-        json.dump(tags_map, f, indent=4, sort_keys=True)
+def read_tags_file():
+    '''Return the tags map.  Callers can modify it and pass it to
+    write_tags_file()'''
+    return {msgid: copy_tags_entry(entry)
+            for msgid, entry in get_tags_map().items()}
+
+def new_tags_file_name(nr_file_mails):
+    for filename in sorted(nr_file_mails.keys(),
+                           key=lambda f: (f != 'tags', f)):
+        if nr_file_mails[filename] < max_mails_per_file:
+            return filename
+    if not 'tags' in nr_file_mails:
+        return 'tags'
+    idx = 0
+    while 'tags_%d' % idx in nr_file_mails:
+        idx += 1
+    return 'tags_%d' % idx
+
+def apply_tags_changes(latest_map, changes):
+    '''Apply changes, a dict having msgids as keys and new entries or None
+    for removed ones as values, to latest_map'''
+    for msgid, entry in changes.items():
+        if entry is None:
+            latest_map.pop(msgid, None)
+        else:
+            latest_map[msgid] = entry
+    return latest_map
 
 def write_tags_file(tags_map, sync_after):
-    max_mails_per_file = 100
-    tags_map_to_write = {}
-    file_idx = 0
+    global tag_msgids
+
+    # changes are what the caller made to the map that this process read,
+    # regardless of changes from other hkml processes after the read.
+    cache = tags_map_cache
+    if cache is None:
+        cache = get_tags_map()
+    # key: file name, value: changes of the mails in the file
+    files_changes = {}
+    nr_file_mails = None
     for msgid in sorted(tags_map.keys()):
-        tags_map_to_write[msgid] = tags_map[msgid]
-        if len(tags_map_to_write) == max_mails_per_file:
-            write_tags_single_file(tags_map_to_write, file_idx)
-            tags_map_to_write = {}
-            file_idx += 1
-    write_tags_single_file(tags_map_to_write, None)
+        if tags_map[msgid] == cache.get(msgid):
+            continue
+        if not msgid in msgid_tags_file:
+            if nr_file_mails is None:
+                nr_file_mails = {f: 0 for f in tags_files_stat}
+                for filename in msgid_tags_file.values():
+                    nr_file_mails[filename] = nr_file_mails.get(
+                            filename, 0) + 1
+            filename = new_tags_file_name(nr_file_mails)
+            msgid_tags_file[msgid] = filename
+            nr_file_mails[filename] = nr_file_mails.get(filename, 0) + 1
+        filename = msgid_tags_file[msgid]
+        if not filename in files_changes:
+            files_changes[filename] = {}
+        files_changes[filename][msgid] = copy_tags_entry(tags_map[msgid])
+    for msgid in cache:
+        if not msgid in tags_map:
+            filename = msgid_tags_file.pop(msgid)
+            if not filename in files_changes:
+                files_changes[filename] = {}
+            files_changes[filename][msgid] = None
+    if not 'tags' in tags_files_stat and not 'tags' in files_changes:
+        files_changes['tags'] = {}
+
+    externally_changed = False
+    for filename, changes in files_changes.items():
+        path = os.path.join(_hkml.get_hkml_dir(), filename)
+        if filename in tags_files_stat and (not os.path.isfile(path) or
+                tags_file_stat(filename) != tags_files_stat[filename]):
+            externally_changed = True
+        # another hkml process might changed other mails of the file
+        _hkml_state.update_json(
+                path, lambda latest_map: apply_tags_changes(
+                    latest_map, changes),
+                default={}, sort_keys=True)
+        tags_files_stat[filename] = tags_file_stat(filename)
+        apply_tags_changes(cache, changes)
+    tag_msgids = None
+    if externally_changed:
+        # read the changes at next read_tags_file()
+        tags_files_stat.clear()
 
     if hkml_sync.syncup_ready() and sync_after is True:
         hkml_sync.syncup(_hkml.get_hkml_dir(), remote=None)
 
+def get_tag_msgids():
+    '''Return a dict having tags as keys and lists of msgids of the tag as
+    values'''
+    global tag_msgids
+
+    tags_map = get_tags_map()
+    if tag_msgids is None:
+        tag_msgids = {}
+        for msgid in tags_map:
+            for tag in tags_map[msgid]['tags']:
+                if not tag in tag_msgids:
+                    tag_msgids[tag] = []
+                tag_msgids[tag].append(msgid)
+    return tag_msgids
+
+def get_tagged_mail(msgid):
+    '''Return Mail object of the tagged mail, constructing it only once'''
+    kvpairs = get_tags_map()[msgid]['mail']
+    if msgid in tagged_mails and tagged_mails[msgid][0] == kvpairs:
+        return tagged_mails[msgid][1]
+    mail = _hkml.Mail(kvpairs=kvpairs)
+    tagged_mails[msgid] = [kvpairs, mail]
+    return mail
+
 class TagChange:
     mail = None
     add = None
@@ -65,13 +205,8 @@ class TagChange:
         self.remove = remove
 
 def mails_of_tag(tag):
-    tags_map = read_tags_file()
-    mails = []
-    for msgid in tags_map:
-        tags = tags_map[msgid]['tags']
-        if tag in tags:
-            mails.append(_hkml.Mail(kvpairs=tags_map[msgid]['mail']))
-    return mails
+    return [get_tagged_mail(msgid)
+            for msgid in get_tag_msgids().get(tag, [])]
 
 def ask_sync_before_change(do_confirm=True):
     description = 'Gonna read/write tags.  Sync before and after'
@@ -87,23 +222,14 @@ def ask_sync_before_change(do_confirm=True):
     return False
 
 def get_mails_of_subject_tag(subject, tag):
-    mails = []
-    tags_map = read_tags_file()
-    for msgid in tags_map:
-        tags = tags_map[msgid]['tags']
-        if not tag in tags:
-            continue
-        mail = _hkml.Mail(kvpairs=tags_map[msgid]['mail'])
-        if mail.subject == subject:
-            mails.append(mail)
-    return mails
+    return [mail for mail in mails_of_tag(tag) if mail.subject == subject]
 
 def suggest_removing_drafts_of_subject(subject, tags_map, do_confirm=True):
     for msgid in tags_map:
         tags = tags_map[msgid]['tags']
         if not 'drafts' in tags:
             continue
-        draft_mail = _hkml.Mail(kvpairs=tags_map[msgid]['mail'])
+        draft_mail = get_tagged_mail(msgid)
         if draft_mail.subject != subject:
             continue
         while True:
@@ -180,17 +306,10 @@ def get_tag_nr_mails():
     '''
     Return dict having tags as key, numbers of mails of the tag as value
     '''
-    tag_nr_mails = {}
-    tags_map = read_tags_file()
-    for msgid in tags_map:
-        for tag in tags_map[msgid]['tags']:
-            if not tag in tag_nr_mails:
-                tag_nr_mails[tag] = 0
-            tag_nr_mails[tag] += 1
-    return tag_nr_mails
+    return {tag: len(msgids) for tag, msgids in get_tag_msgids().items()}
 
 def tag_exists(tagname):
-    return tagname in get_tag_nr_mails()
+    return tagname in get_tag_msgids()
 
 def list_tags():
     tag_nr_mails = get_tag_nr_mails()
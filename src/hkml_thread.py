@@ -8,6 +8,22 @@ import _hkml_list_cache
 import hkml_cache
 import hkml_list
 
+def get_thread_mails_from_cache(msgid):
+    '''Return mails of the thread of msgid from the cache, or None'''
+    if not msgid.startswith('<'):
+        msgid = '<%s>' % msgid
+    msgids = hkml_cache.get_thread_msgids(msgid)
+    if not msgids:
+        return None
+    mails = []
+    for thread_msgid in msgids:
+        mail = hkml_cache.get_mail(key=thread_msgid)
+        if mail is not None:
+            mails.append(mail)
+    if len(mails) == 0:
+        return None
+    return mails
+
 def thread_str(mail_id, dont_use_internet, show_url):
     if mail_id.isdigit():
         mail_id = int(mail_id)
@@ -29,6 +45,10 @@ def thread_str(mail_id, dont_use_internet, show_url):
             print(err)
         else:
             mail_id = None
+    if mails_to_show is None and msgid is not None:
+        mails_to_show = get_thread_mails_from_cache(msgid)
+        if mails_to_show is not None:
+            mail_id = None
     if mails_to_show is None:
         list_data = _hkml_list_cache.get_last_list(except_thread=False)
         if list_data is None:
@@ -38,7 +58,6 @@ def thread_str(mail_id, dont_use_internet, show_url):
         for mitem in mail_items:
             mitem.set_mail()
         mails_to_show = [i.mail for i in mail_items]
-        # TODO: Support msgid
 
     nr_cols_in_line = int(os.get_terminal_size().columns * 9 / 10)
     list_decorator = hkml_list.MailListDecorator(None)
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0
 
+import bisect
 import curses
 import datetime
 import os
+import re
 import subprocess
 import tempfile
 import time
 
 import _hkml_cli
+import _hkml_state
 import hkml_write
 
 '''
@@ -36,6 +39,9 @@ class InputHandler:
         return self.handler_fn(input_chr, arg)
 
 def tabs_to_spaces(line, spaces_per_tab):
+    # str.expandtabs() resets the column at line breaks
+    if not '\r' in line and not '\n' in line:
+        return line.expandtabs(spaces_per_tab)
     chrs = []
     idx = 0
     for chr in line:
@@ -59,24 +65,28 @@ def get_prefix(line):
             break
     return ''.join(prefix_chrs)
 
+space_pattern = re.compile(r'\s')
+last_space_pattern = re.compile(r'.*\s', re.DOTALL)
+
 def wrap_line(line, cols):
-    if len(line) < cols:
-        return [line]
-    prefix = get_prefix(line)
-    line = line[len(prefix):]
-    last_space = None
-    for idx, c in enumerate(line):
-        if c.isspace():
-            last_space = idx
-        if idx >= cols and last_space is not None:
-            break
-    if last_space is None:
-        last_space = len(line)
-    wrapped_lines = ['%s%s' % (prefix, line[:last_space])]
-    next_line = line[last_space + 1:]
-    if len(next_line) > 0:
-        next_line = '%s%s' % (prefix, next_line)
-        wrapped_lines += wrap_line(next_line, cols)
+    wrapped_lines = []
+    while len(line) >= cols:
+        prefix = get_prefix(line)
+        line = line[len(prefix):]
+        # last space within cols, or the first space after cols
+        match = last_space_pattern.match(line, 0, cols + 1)
+        if match is None:
+            match = space_pattern.search(line, cols + 1)
+        if match is None:
+            last_space = len(line)
+        else:
+            last_space = match.end() - 1
+        wrapped_lines.append('%s%s' % (prefix, line[:last_space]))
+        next_line = line[last_space + 1:]
+        if len(next_line) == 0:
+            return wrapped_lines
+        line = '%s%s' % (prefix, next_line)
+    wrapped_lines.append(line)
     return wrapped_lines
 
 def wrap_text(lines, cols):
@@ -85,6 +95,143 @@ def wrap_text(lines, cols):
         wrapped_lines += wrap_line(line, cols)
     return wrapped_lines
 
+class TextLines:
+    '''
+    List-like read-only sequence of the text lines to display on
+    ScrollableList.  Tabs of each line are converted to spaces only when the
+    line is accessed, so that only the lines on the screen are converted for
+    each drawing.
+    '''
+    lines = None
+    # tabs-converted lines.  None for not yet converted ones.
+    converted = None
+    # WrappedTextLines of this text for each number of columns
+    wrapped_lines = None
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.converted = [None] * len(lines)
+        self.wrapped_lines = {}
+
+    def __len__(self):
+        return len(self.lines)
+
+    def line(self, idx):
+        line = self.converted[idx]
+        if line is None:
+            line = self.lines[idx]
+            if '\t' in line:
+                line = tabs_to_spaces(line, 8)
+            self.converted[idx] = line
+        return line
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.line(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('line index out of range')
+        return self.line(idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.line(idx)
+
+    def index(self, value):
+        for idx, line in enumerate(self):
+            if line == value:
+                return idx
+        raise ValueError('%s is not in the lines' % value)
+
+    def replace(self, start, end, lines):
+        '''Replace lines [start, end) with given lines'''
+        self.lines[start:end] = lines
+        self.converted[start:end] = [None] * len(lines)
+        self.wrapped_lines = {}
+
+    def max_len_estimate(self):
+        '''Returns the length of the longest line, assuming each tab is one
+        column wide'''
+        return max(map(len, self.lines), default=0)
+
+    def wrap(self, cols):
+        if not cols in self.wrapped_lines:
+            self.wrapped_lines[cols] = WrappedTextLines(self, cols)
+        return self.wrapped_lines[cols]
+
+class WrappedTextLines(TextLines):
+    '''
+    TextLines of a text that wrapped for given columns.  Each source line is
+    wrapped only when its wrapped lines are accessed.  Number of wrapped lines
+    for each source line is counted only up to the accessed line, except
+    len(), which needs to count those for all source lines.
+    '''
+    source = None
+    cols = None
+    # index of first wrapped line for each counted source line, and the
+    # number of wrapped lines for counted source lines at the end
+    wrapped_starts = None
+    # wrapped lines of recently accessed source lines having more than one
+    # wrapped lines
+    wrapped_of_source = None
+    max_nr_wrapped_of_source = 1024
+
+    def __init__(self, source, cols):
+        self.source = source
+        self.cols = cols
+        self.wrapped_starts = [0]
+        self.wrapped_of_source = {}
+        self.wrapped_lines = {}
+
+    def wrap_source_line(self, src_idx):
+        raw_line = self.source.lines[src_idx]
+        # fast path for most lines
+        if len(raw_line) < self.cols and not '\t' in raw_line:
+            return [raw_line]
+        if src_idx in self.wrapped_of_source:
+            return self.wrapped_of_source[src_idx]
+        wrapped = wrap_line(self.source.line(src_idx), self.cols)
+        if len(wrapped) > 1:
+            if len(self.wrapped_of_source) >= self.max_nr_wrapped_of_source:
+                self.wrapped_of_source.clear()
+            self.wrapped_of_source[src_idx] = wrapped
+        return wrapped
+
+    def count_up_to(self, idx):
+        '''Count wrapped lines of source lines until idx-th wrapped line is
+        counted, or all source lines are counted'''
+        starts = self.wrapped_starts
+        nr_source_lines = len(self.source)
+        while starts[-1] <= idx and len(starts) <= nr_source_lines:
+            starts.append(starts[-1] +
+                          len(self.wrap_source_line(len(starts) - 1)))
+
+    def __len__(self):
+        self.count_up_to(float('inf'))
+        return self.wrapped_starts[-1]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice) or idx < 0:
+            return super().__getitem__(idx)
+        # avoid counting all wrapped lines via len()
+        self.count_up_to(idx)
+        if idx >= self.wrapped_starts[-1]:
+            raise IndexError('line index out of range')
+        return self.line(idx)
+
+    def line(self, idx):
+        self.count_up_to(idx)
+        src_idx = bisect.bisect_right(self.wrapped_starts, idx) - 1
+        return self.wrap_source_line(src_idx)[
+                idx - self.wrapped_starts[src_idx]]
+
+    def max_len_estimate(self):
+        return min(self.source.max_len_estimate(), self.cols)
+
+    def wrap(self, cols):
+        return self.source.wrap(cols)
+
 class ScrollableList:
     screen = None
     lines = None
@@ -120,17 +267,27 @@ class ScrollableList:
     effect_underline = curses.A_UNDERLINE
 
     def set_lines(self, lines):
-        converted = []
-        for line in lines:
-            converted.append(tabs_to_spaces(line, 8))
-        lines = converted
+        if not isinstance(lines, TextLines):
+            lines = TextLines(lines)
         self.lines = lines
-        self.longest_line_len = sorted([len(line) for line in lines])[-1]
+        # updated as the lines are drawn
+        self.longest_line_len = lines.max_len_estimate()
         if self.focus_col is not None:
             self.focus_col = min(self.focus_col, self.longest_line_len - 1)
         if self.focus_row is not None:
             self.focus_row = min(self.focus_row, len(lines) - 1)
 
+    def replace_lines(self, start, end, lines):
+        '''Replace self.lines[start:end] with lines'''
+        if isinstance(self.lines, TextLines) and not self.wrapped_text():
+            self.lines.replace(start, end, lines)
+            self.longest_line_len = max(
+                    [self.longest_line_len] + [len(l) for l in lines])
+        else:
+            self.set_lines(
+                    self.lines[:start] + lines + self.lines[end:])
+        self.focus_row = min(self.focus_row, len(self.lines) - 1)
+
     def __init__(self, screen, lines, input_handlers):
         self.screen = screen
 
@@ -174,6 +331,15 @@ class ScrollableList:
             self.screen.addstr(0, 0, 'X')
             return
 
+        nr_rows_for_lines = scr_rows - 1
+        if self.bottom_lines is not None:
+            nr_rows_for_lines -= len(self.bottom_lines)
+        end_row = min(start_row + nr_rows_for_lines, len(self.lines))
+
+        for line_idx in range(start_row, end_row):
+            self.longest_line_len = max(self.longest_line_len,
+                                        len(self.lines[line_idx]))
+
         max_horizon_scroll_len = self.longest_line_len - scr_cols
         if max_horizon_scroll_len < 0:
             # no need to horizon-scroll at all
@@ -184,21 +350,17 @@ class ScrollableList:
             # don't scroll right if it will not show something more
             draw_start_col = max_horizon_scroll_len
 
-        nr_rows_for_lines = scr_rows - 1
-        if self.bottom_lines is not None:
-            nr_rows_for_lines -= len(self.bottom_lines)
-
         if self.highlight_row_col is not None:
             highlight_row, highlight_col = self.highlight_row_col
         else:
             highlight_row = None
             highlight_col = None
 
-        for row in range(nr_rows_for_lines):
-            line_idx = start_row + row
-            if line_idx >= len(self.lines):
-                break
+        if self.draw_callback:
+            self.draw_callback(self)
 
+        for line_idx in range(start_row, end_row):
+            row = line_idx - start_row
             line = self.lines[line_idx]
             if self.line_callback:
                 line = self.line_callback(self, line_idx)
@@ -215,9 +377,6 @@ class ScrollableList:
             else:
                 color_attrib = curses.A_NORMAL
 
-            if self.draw_callback:
-                self.draw_callback(self)
-
             if line_idx in self.searched_lines and self.enable_highlight:
                 self.screen.addstr(row, 0, line, highlight_color | color_attrib)
             elif line_idx == highlight_row:
@@ -271,7 +430,15 @@ class ScrollableList:
         while True:
             self.__draw()
 
+            # flush deferred state file updates when idle for a second
+            if _hkml_state.has_pending_updates():
+                self.screen.timeout(1000)
+            else:
+                self.screen.timeout(-1)
             x = self.screen.getch()
+            if x == -1:
+                _hkml_state.flush()
+                continue
             if x == curses.KEY_DOWN:
                 c = 'key_down'
             elif x == curses.KEY_UP:
@@ -319,8 +486,10 @@ class ScrollableList:
     def wrap_text(self):
         _, scr_cols = self.screen.getmaxyx()
         self.unwrapped_lines = self.lines
-        wrapped_lines = wrap_text(self.lines, scr_cols)
-        self.set_lines(wrapped_lines)
+        lines = self.lines
+        if not isinstance(lines, TextLines):
+            lines = TextLines(lines)
+        self.set_lines(lines.wrap(scr_cols))
 
     def unwrap_text(self):
         self.set_lines(self.unwrapped_lines)
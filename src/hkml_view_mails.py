@@ -1,19 +1,28 @@
 # SPDX-License-Identifier: GPL-2.0
 
 import argparse
+import contextlib
+import curses
 import datetime
 import fnmatch
+import io
 import os
+import shutil
+import threading
 import time
 
+import _hkml
 import _hkml_cli
 import _hkml_date
 import _hkml_list_cache
+import _hkml_prefetch
+import _hkml_search_index
 import hkml_cache
 import hkml_config
 import hkml_export
 import hkml_forward
 import hkml_list
+import hkml_manifest
 import hkml_open
 import hkml_patch
 import hkml_reply
@@ -35,7 +44,7 @@ def mail_item_of_row(slist, row):
         refresh_list(slist, show_tagged_mails=False)
         line_nr_mail_idx_map = slist.data.list_data.line_nr_mail_idx_map
     row -= slist.data.list_data.len_comments
-    if not row in line_nr_mail_idx_map:
+    if row < 0 or row >= len(line_nr_mail_idx_map):
         return None
     mail_idx = line_nr_mail_idx_map[row]
     mail_items = slist.data.list_data.mail_items
@@ -48,7 +57,7 @@ def mail_of_row(slist, row):
         refresh_list(slist, show_tagged_mails=False)
         line_nr_mail_idx_map = slist.data.list_data.line_nr_mail_idx_map
     row -= slist.data.list_data.len_comments
-    if not row in line_nr_mail_idx_map:
+    if row < 0 or row >= len(line_nr_mail_idx_map):
         return None
     mail_idx = line_nr_mail_idx_map[row]
     mail_items = slist.data.list_data.mail_items
@@ -69,6 +78,8 @@ def focused_mail_idx(slist):
         refresh_list(slist, show_tagged_mails=False)
         line_nr_mail_idx_map = slist.data.list_data.line_nr_mail_idx_map
     row -= slist.data.list_data.len_comments
+    if row < 0 or row >= len(line_nr_mail_idx_map):
+        return None
     return line_nr_mail_idx_map[row]
 
 def open_focused_mail(c, slist):
@@ -242,16 +253,52 @@ def refresh_list(slist, show_tagged_mails):
     slist.data.display_effect_cache = {}
     slist.screen.clear()
 
+def refresh_thread(slist, mail_idx):
+    '''
+    Update only the lines for the mail of mail_idx and its replies, after the
+    mail is collapsed or expanded.  The mail should be focused.
+    '''
+    if slist.wrapped_text():
+        refresh_list(slist, show_tagged_mails=False)
+        return
+    list_data = slist.data.list_data
+    mail_items = get_complete_mail_items(slist)
+    line_nr_mail_idx_map = list_data.line_nr_mail_idx_map
+
+    start = slist.focus_row - list_data.len_comments
+    while start > 0 and line_nr_mail_idx_map[start - 1] == mail_idx:
+        start -= 1
+    end_idx = hkml_list.thread_end_idx(mail_items, mail_idx)
+    end = start
+    while end < len(line_nr_mail_idx_map) and \
+            line_nr_mail_idx_map[end] < end_idx:
+        end += 1
+
+    decorator = hkml_list.MailListDecorator(slist.data.list_args)
+    lines, line_mail_idxs = hkml_list.fmt_mail_items_lines(
+            mail_items, mail_idx, end_idx, decorator,
+            slist.data.collapsed_mails,
+            hkml_list.max_digits_for_idx_of(mail_items))
+    list_data.replace_mail_lines(start, end, lines, line_mail_idxs)
+    slist.replace_lines(list_data.len_comments + start,
+                        list_data.len_comments + end, lines)
+    slist.data.display_effect_cache = {}
+
 def collapse_focused_thread(c, slist):
     collapsed_mails = slist.data.collapsed_mails
-
-    collapsed_mails[focused_mail_idx(slist)] = True
-    refresh_list(slist, show_tagged_mails=False)
+    mail_idx = focused_mail_idx(slist)
+    if mail_idx is None or mail_idx in collapsed_mails:
+        return
+    collapsed_mails[mail_idx] = True
+    refresh_thread(slist, mail_idx)
 
 def expand_focused_thread(c, slist):
     collapsed_mails = slist.data.collapsed_mails
-    del collapsed_mails[focused_mail_idx(slist)]
-    refresh_list(slist, show_tagged_mails=False)
+    mail_idx = focused_mail_idx(slist)
+    if not mail_idx in collapsed_mails:
+        return
+    del collapsed_mails[mail_idx]
+    refresh_thread(slist, mail_idx)
 
 def write_mail_draft(slist, mail):
     hkml_view.shell_mode_start(slist)
@@ -744,6 +791,8 @@ class MailsViewData:
     last_cursor_position = None
     focus_row_display_effect = None
     focus_row_color = None
+    # list_data that set as the last list of the list cache
+    cached_list_data = None
 
     # cache for per-line display effect decisions that made by display_rule.
     display_effect_cache = None
@@ -786,7 +835,8 @@ def menu_refresh_mails(slist, answer, selection):
         if answer.lower() != 'n':
             gen_args.fetch = True
 
-    mails_view_data, err = generate_mails_view_data(gen_args)
+    hkml_view.shell_mode_end(slist)
+    mails_view_data, err = generate_mails_view_data(slist.screen, gen_args)
     if err is not None:
         print('Generating mails list again failed (%s).' % err)
         return
@@ -822,12 +872,11 @@ def menu_search_mail_body_keywords(handler_common_data, user_input, selection):
         mail = mail_of_row(slist, row)
         if mail is None:
             continue
-        body = mail.get_body()
-        searched = True
-        for keyword in keywords:
-            if not keyword in body:
-                searched = False
-                continue
+        searched = _hkml_search_index.keywords_in_field(
+                [keywords], 'body', _hkml_search_index.mail_key(mail))
+        if searched is None:
+            searched = hkml_list.keywords_in([keywords], mail.get_body())
+            _hkml_search_index.index_mail(mail)
         if searched:
             searched_lines. append(row)
     handle_searched_lines(slist, searched_lines)
@@ -1140,8 +1189,24 @@ def get_mails_list_input_handlers():
                 ['m'], show_mails_list_menu, 'open menu'),
             ]
 
+def prefetch_around_focus(slist):
+    list_data = slist.data.list_data
+    line_nr_mail_idx_map = list_data.line_nr_mail_idx_map
+    # mail_items of cached output reuse are not completed
+    if list_data.mail_items is None or not line_nr_mail_idx_map:
+        return
+    row = slist.focus_row - list_data.len_comments
+    row = min(max(row, 0), len(line_nr_mail_idx_map) - 1)
+    _hkml_prefetch.set_focus(list_data.mail_items, line_nr_mail_idx_map[row])
+
 def after_input_handle_callback(slist):
+    prefetch_around_focus(slist)
     list_data = slist.data.list_data
+    # check and update the list cache only once per list, since this is
+    # called for every keypress
+    if slist.data.cached_list_data is list_data:
+        return
+    slist.data.cached_list_data = list_data
     mail_items = list_data.mail_items
     if mail_items is None:
         return
@@ -1151,7 +1216,7 @@ def after_input_handle_callback(slist):
     else:
         last_mail_items = last_list_data.mail_items
     if mail_items != last_mail_items:
-        _hkml_list_cache.set_item('thread_output', list_data)
+        _hkml_list_cache.set_item('thread_output', list_data, defer=True)
 
 def mails_display_effect_callback(slist, line_idx):
     attrib = slist.data.display_effect_for(line_idx, slist)
@@ -1194,12 +1259,14 @@ def show_mails_list(screen, mails_view_data):
         if err is None:
             slist.focus_row, slist.focus_col = row_col
     elif list_args.source_type == ['msgid']:
-        for line_nr, mail_idx in list_data.line_nr_mail_idx_map.items():
+        for line_nr, mail_idx in enumerate(
+                list_data.line_nr_mail_idx_map):
             mail = list_data.mail_items[mail_idx].mail
             mail_msgid = mail.get_msgid()[1:-1]
             if mail_msgid in list_args.sources[0]:
                 slist.focus_row = list_data.len_comments + line_nr
                 slist.focus_col = 0
+    prefetch_around_focus(slist)
     slist.draw()
     return slist
 
@@ -1234,13 +1301,177 @@ def should_fetch(list_args, list_data, err):
                         'do listing again?') == 'y'
     return False
 
-def generate_mails_list_data(list_args):
-    list_data, err = hkml_list.args_to_mails_list_data(
-            list_args, suggest_manifest_update=True)
+class ListGenerationCancelled(Exception):
+    pass
+
+class ListGenerationProgress(hkml_list.RuntimeProfiles):
+    '''
+    Show the progress of the list generation as a progress bar of the runtime
+    profile categories, and the first screenful of the list as soon as the
+    mails to list are decided, on the curses screen.  Raise
+    ListGenerationCancelled at the start and end of each category after the
+    cancellation is requested.
+    '''
+    bar_width = 30
+    cancel_requested = None     # threading.Event
+    screen = None
+    nr_rows = None
+    status_line = None
+    first_rows = None
+
+    def __init__(self, screen=None):
+        super().__init__(print_progress=False)
+        self.cancel_requested = threading.Event()
+        self.screen = screen
+        if screen is not None:
+            self.nr_rows = screen.getmaxyx()[0] - 4
+        else:
+            self.nr_rows = shutil.get_terminal_size().lines - 4
+        self.first_rows = []
+
+    def check_cancel(self):
+        if self.cancel_requested.is_set():
+            raise ListGenerationCancelled()
+
+    def start(self, category):
+        self.check_cancel()
+        super().start(category)
+        if category in self.categories:
+            nr_done = self.categories.index(category)
+        else:
+            nr_done = len(self.categories) - 1
+        nr_filled = int(self.bar_width * nr_done / len(self.categories))
+        self.status_line = '# [%s%s] %d/%d %s' % (
+            '#' * nr_filled, '.' * (self.bar_width - nr_filled), nr_done + 1,
+            len(self.categories), category)
+
+    def end(self, category):
+        super().end(category)
+        self.check_cancel()
+
+    def mails_to_list_decided(self, mail_items, list_decorator):
+        # small lists will be shown soon
+        if len(mail_items) <= self.nr_rows:
+            return
+        lines, _ = hkml_list.fmt_mail_items_lines(
+                mail_items, 0, self.nr_rows, list_decorator, {},
+                hkml_list.max_digits_for_idx_of(mail_items))
+        self.first_rows = lines[:self.nr_rows]
+
+    def lines(self):
+        lines = ['# generating the list.  Press Ctrl-C to cancel.']
+        if self.status_line is not None:
+            lines.append(self.status_line)
+        if self.cancel_requested.is_set():
+            lines.append('# cancelling after the current step')
+        if len(self.first_rows) > 0:
+            lines.append('# first rows of the list, while formatting the rest')
+            lines += self.first_rows
+        return lines
+
+    def draw(self):
+        '''Should be called from the main thread only'''
+        if self.screen is None:
+            return
+        scr_rows, scr_cols = self.screen.getmaxyx()
+        self.screen.erase()
+        for row, line in enumerate(self.lines()[:scr_rows]):
+            try:
+                self.screen.addstr(row, 0, line[:scr_cols - 1])
+            except curses.error:
+                # e.g., wide characters going out of the screen
+                pass
+        self.screen.refresh()
+
+def generate_mails_list_data(list_args, runtime_profiles=None):
+    '''
+    Generate the mails list without asking any question to the user, since
+    this is called from the worker thread.  generate_mails_list_data_in_view()
+    asks the questions.
+    '''
+    return hkml_list.args_to_mails_list_data(
+            list_args, suggest_manifest_update=False,
+            runtime_profiles=runtime_profiles)
+
+def generate_mails_list_data_in_background(list_args, screen=None):
+    '''
+    Run generate_mails_list_data() in a worker thread while showing the
+    progress and the first rows of the list on the curses screen, so that the
+    user can cancel it using Ctrl-C.  Messages that the worker prints are
+    buffered until the worker finishes, and then printed in the shell mode.
+    Should be called in the curses mode, and returns in the shell mode.
+    '''
+    progress = ListGenerationProgress(screen)
+    results = []
+
+    def generate():
+        _hkml.interactive.enabled = False
+        try:
+            results.append(generate_mails_list_data(list_args, progress))
+        except ListGenerationCancelled:
+            results.append((None, 'cancelled'))
+        except BaseException as e:
+            results.append(e)
+        finally:
+            # the connection is usable in only this thread
+            hkml_cache.close_sqlite_conn()
+
+    worker_output = io.StringIO()
+    worker = threading.Thread(target=generate, daemon=True)
+    with contextlib.redirect_stdout(worker_output), \
+            contextlib.redirect_stderr(worker_output):
+        worker.start()
+        while worker.is_alive():
+            progress.draw()
+            try:
+                worker.join(0.1)
+            except KeyboardInterrupt:
+                # second Ctrl-C stops hkml
+                if progress.cancel_requested.is_set():
+                    raise
+                progress.cancel_requested.set()
+    if screen is not None:
+        hkml_view.shell_mode_start(screen)
+    print(worker_output.getvalue(), end='')
+    # Ctrl-C is sent to running git commands, too.  Ignore their failures.
+    if progress.cancel_requested.is_set():
+        return None, 'cancelled'
+    if isinstance(results[0], BaseException):
+        raise results[0]
+    return results[0]
+
+def should_update_manifest(list_args, list_data):
+    if list_args.source_type is None or \
+            'mailing_list' not in list_args.source_type:
+        return False
+    if list_data.mail_items is None:
+        return False
+    return hkml_list.should_update_manifest_and_retry(
+            list_args.fetch, True, len(list_data.mail_items))
+
+def generate_mails_list_data_in_view(screen, list_args):
+    '''
+    Generate the mails list in background, and ask the questions for the
+    generation, e.g., whether to fetch the mails, from the main thread in the
+    shell mode.  Should be called in the curses mode, and returns in the shell
+    mode.
+    '''
+    list_data, err = generate_mails_list_data_in_background(
+            list_args, screen)
+    if err == 'cancelled':
+        return list_data, err
     if should_fetch(list_args, list_data, err):
         list_args.fetch = True
-        list_data, err = hkml_list.args_to_mails_list_data(
-                list_args, suggest_manifest_update=True)
+        hkml_view.shell_mode_end(screen)
+        list_data, err = generate_mails_list_data_in_background(
+                list_args, screen)
+    if err is None and should_update_manifest(list_args, list_data):
+        err = hkml_manifest.fetch_lore()
+        if err is not None:
+            return None, 'updating lore fail (%s)' % err
+        hkml_view.shell_mode_end(screen)
+        list_data, err = generate_mails_list_data_in_background(
+                list_args, screen)
     return list_data, err
 
 def ask_focus_row_display_effect(mails_view_data, called_from_menu):
@@ -1281,9 +1512,10 @@ def ask_focus_row_display_effect(mails_view_data, called_from_menu):
     mails_view_data.focus_row_display_effect = display_effect
     mails_view_data.focus_row_color = color
 
-def generate_mails_view_data(args):
-    # returns MailsViewData and error
-    list_data, err = generate_mails_list_data(args)
+def generate_mails_view_data(screen, args):
+    # returns MailsViewData and error.  Should be called in the curses mode,
+    # and returns in the shell mode.
+    list_data, err = generate_mails_list_data_in_view(screen, args)
     if err is not None:
         return None, err
 
@@ -1292,7 +1524,8 @@ def generate_mails_view_data(args):
         thread_msgids = []
         if args.source_type == ['msgid'] and list_data.line_nr_mail_idx_map:
             thread_msgids = []
-            for line_nr, mail_idx in list_data.line_nr_mail_idx_map.items():
+            for line_nr, mail_idx in enumerate(
+                list_data.line_nr_mail_idx_map):
                 mail = list_data.mail_items[mail_idx].mail
                 msgid = mail.get_msgid()
                 if len(thread_msgids) > 0 and thread_msgids[-1] == msgid:
@@ -1322,9 +1555,9 @@ def gen_show_mails_list(screen, list_args):
     '''
     This function will be passed to hkml_view.view() as draw_fn.
     '''
-    hkml_view.shell_mode_start(screen)
-
-    mails_view_data, err = generate_mails_view_data(list_args)
+    # the list generation progress is shown on the curses screen
+    hkml_view.shell_mode_end(screen)
+    mails_view_data, err = generate_mails_view_data(screen, list_args)
     if err is not None:
         print('Failed mails list generating (%s).' % err)
     hkml_view.shell_mode_end(screen)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+'''
+Measure memory usage of Mail and MailListMailItem objects for a synthetic
+mails list.  Not a unit test, so not executed by run.sh.
+
+Usage: bench_hkml_mail_memory.py [nr_mails]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import hkml_cache
+import hkml_list
+
+def synthetic_kvpairs(idx):
+    msgid = '<%d.synthetic@hkml.test>' % idx
+    header = [
+            'From: Author %d <author%d@hkml.test>' % (idx % 100, idx % 100),
+            'To: linux-mm@kvack.org',
+            'Cc: akpm@linux-foundation.org, linux-kernel@vger.kernel.org',
+            'Subject: [PATCH %d/10] mm/synthetic: change %d' % (
+                idx % 10 + 1, idx),
+            'Message-ID: %s' % msgid,
+            'Date: Mon, 1 Jan 2024 00:%02d:%02d +0000' % (
+                idx // 60 % 60, idx % 60)]
+    if idx % 10 != 0:
+        header.append('In-Reply-To: <%d.synthetic@hkml.test>' %
+                      (idx - idx % 10))
+    body = ['line %d of the synthetic mail body' % i for i in range(40)]
+    return {'gitid': '%040x' % idx,
+            'gitdir': 'archives/linux-mm/git/0.git',
+            'subject': None, 'msgid': msgid,
+            'mbox': '\n'.join(header + [''] + body)}
+
+def measure(nr_mails, drop_mbox):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    mail_items = []
+    for idx in range(nr_mails):
+        # mbox strings are also newly made when mails are read from the cache
+        mail = _hkml.Mail(kvpairs=synthetic_kvpairs(idx))
+        # fields that listing and threading need
+        mail.get_from()
+        mail.get_in_reply_to_msgid()
+        if drop_mbox:
+            mail.drop_mbox()
+        mail_items.append(hkml_list.MailListMailItem(
+            mail_cache_key=None, mail=mail, prdepth=None,
+            parent_item=None, added_by_tag=None))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / nr_mails
+
+def main():
+    nr_mails = 50000
+    if len(sys.argv) > 1:
+        nr_mails = int(sys.argv[1])
+
+    hkml_dir = tempfile.mkdtemp(prefix='hkml_bench_mail_memory_')
+    _hkml.set_hkml_dir(hkml_dir)
+    hkml_cache.set_cache_config(100 * 1024 * 1024, 9, 'json')
+    try:
+        print('%d mails' % nr_mails)
+        print('%.1f bytes per mail' % measure(nr_mails, False))
+        print('%.1f bytes per mail with mbox dropped' %
+              measure(nr_mails, True))
+    finally:
+        shutil.rmtree(hkml_dir)
+
+if __name__ == '__main__':
+    main()
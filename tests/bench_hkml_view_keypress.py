@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+'''
+Measure the latency of handling a keypress on the mails list view, for a
+synthetic mails list.  ScrollableList.draw() is driven against a fake curses
+screen.  Not a unit test, so not executed by run.sh.
+
+Usage: bench_hkml_view_keypress.py [nr_mails] [nr_keypresses]
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_list_cache
+import _hkml_state
+import hkml_list
+import hkml_view
+import hkml_view_mails
+
+class FakeScreen:
+    '''Fake curses screen that returns given keys and records the time of
+    each getch() call'''
+    rows = 50
+    cols = 200
+    keys = None
+    getch_times = None
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.getch_times = []
+
+    def getmaxyx(self):
+        return self.rows, self.cols
+
+    def erase(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def addstr(self, row, col, text, attr=0):
+        pass
+
+    def move(self, row, col):
+        pass
+
+    def timeout(self, delay):
+        pass
+
+    def refresh(self):
+        pass
+
+    def getch(self):
+        self.getch_times.append(time.perf_counter())
+        return ord(self.keys.pop(0))
+
+def synthetic_list_data(nr_mails):
+    mail_items = []
+    mail_lines = []
+    for idx in range(nr_mails):
+        mail_items.append(hkml_list.MailListMailItem(
+            mail_cache_key='%040x' % idx, mail=None, prdepth=idx % 10,
+            parent_item=None, added_by_tag=None))
+        mail_lines.append('[%04d] %s[PATCH] mm/synthetic: change %d' % (
+            idx, '  ' * (idx % 10), idx))
+    comments_lines = ['# %d mails' % nr_mails]
+    return hkml_list.MailsListData(
+            '\n'.join(comments_lines + mail_lines), len(comments_lines),
+            mail_items=mail_items,
+            line_nr_mail_idx_map=list(range(nr_mails)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('nr_mails', type=int, nargs='?', default=5000)
+    parser.add_argument('nr_keypresses', type=int, nargs='?', default=1000)
+    args = parser.parse_args()
+
+    hkml_dir = tempfile.mkdtemp(prefix='hkml_bench_keypress_')
+    _hkml.set_hkml_dir(hkml_dir)
+    hkml_view.normal_color = 0
+    hkml_view.highlight_color = 0
+
+    list_data = synthetic_list_data(args.nr_mails)
+    _hkml_list_cache.set_item('{"source": "synthetic"}', list_data)
+    view_data = hkml_view_mails.MailsViewData(
+            list_data, argparse.Namespace(), None)
+
+    screen = FakeScreen(['j'] * args.nr_keypresses + ['q'])
+    slist = hkml_view.ScrollableList(
+            screen, list_data.text.split('\n'),
+            hkml_view_mails.get_mails_list_input_handlers())
+    slist.data = view_data
+    slist.after_input_handle_callback = \
+            hkml_view_mails.after_input_handle_callback
+    slist.display_effect_callback = hkml_view_mails.mails_display_effect_callback
+    slist.color_callback = hkml_view_mails.mails_color_callback
+    slist.draw()
+    _hkml_state.flush()
+    shutil.rmtree(hkml_dir)
+
+    latencies = sorted([(b - a) * 1000 for a, b in zip(
+        screen.getch_times[:-1], screen.getch_times[1:])])
+    print('%d keypresses on %d mails list' % (len(latencies), args.nr_mails))
+    print('mean: %.3f ms' % (sum(latencies) / len(latencies)))
+    print('p50: %.3f ms' % latencies[len(latencies) // 2])
+    print('p99: %.3f ms' % latencies[int(len(latencies) * 0.99)])
+    print('max: %.3f ms' % latencies[-1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_state
+import hkml_cache
+import hkml_list
+
+def mail_mbox(idx, parent_idx):
+    header = [
+        'From: Foo <foo@bar.com>',
+        'Subject: [PATCH %d/3] test mail' % idx,
+        'Message-ID: <%d@bar.com>' % idx,
+        'Date: Mon, 1 Jan 2024 00:00:00 +0000']
+    if parent_idx is not None:
+        header.append('In-Reply-To: <%d@bar.com>' % parent_idx)
+    return '\n'.join(header + ['', 'body %d' % idx])
+
+def mail_kvpairs(idx, parent_idx=None):
+    return {'gitid': 'gitid%d' % idx, 'gitdir': 'gitdir',
+            'subject': '[PATCH %d/3] test mail' % idx,
+            'msgid': '<%d@bar.com>' % idx,
+            'mbox': mail_mbox(idx, parent_idx)}
+
+class TestHkmlCache(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_cache_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+        self.reset_cache_states()
+
+    def tearDown(self):
+        _hkml_state.flush()
+        self.reset_cache_states()
+        shutil.rmtree(self.hkml_dir)
+
+    def reset_cache_states(self):
+        hkml_cache.close_sqlite_conn()
+        hkml_cache.cache_config = None
+        hkml_cache.active_cache = None
+        hkml_cache.archived_caches = {}
+        hkml_cache.archived_cache_keys = {}
+        hkml_cache.need_file_update = False
+
+    def test_sqlite_set_get(self):
+        mail = _hkml.Mail(kvpairs=mail_kvpairs(1))
+        hkml_cache.writeback_mails()
+        self.reset_cache_states()
+
+        kvpairs = hkml_cache.get_kvpairs(gitid='gitid1', gitdir='gitdir')
+        self.assertEqual(kvpairs, mail.to_kvpairs())
+        self.assertEqual(hkml_cache.get_kvpairs(key='<1@bar.com>'), kvpairs)
+        self.assertIsNone(hkml_cache.get_kvpairs(key='<2@bar.com>'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.hkml_dir, 'mails_cache_active')))
+
+    def test_sqlite_commit(self):
+        orig_batch_size = hkml_cache.sqlite_commit_batch_size
+        hkml_cache.sqlite_commit_batch_size = 2
+        try:
+            _hkml.Mail(kvpairs=mail_kvpairs(1))
+            # other processes can read the database meanwhile
+            conn = sqlite3.connect(hkml_cache.sqlite_db_path(), timeout=0)
+            self.assertEqual(
+                    conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            nr_mails_sql = 'SELECT COUNT(*) FROM mails'
+            self.assertEqual(conn.execute(nr_mails_sql).fetchone()[0], 0)
+
+            # committed per batch
+            _hkml.Mail(kvpairs=mail_kvpairs(2))
+            self.assertEqual(conn.execute(nr_mails_sql).fetchone()[0], 2)
+
+            # and at the flush
+            _hkml.Mail(kvpairs=mail_kvpairs(3))
+            self.assertEqual(conn.execute(nr_mails_sql).fetchone()[0], 2)
+            _hkml_state.flush()
+            self.assertEqual(conn.execute(nr_mails_sql).fetchone()[0], 3)
+            # no write lock is held
+            conn.execute('INSERT INTO meta VALUES (?, ?)', ('foo', 'bar'))
+            conn.commit()
+            conn.close()
+        finally:
+            hkml_cache.sqlite_commit_batch_size = orig_batch_size
+
+    def test_thread_index(self):
+        for idx, parent_idx in [[0, None], [1, 0], [2, 0], [3, 2], [4, None]]:
+            _hkml.Mail(kvpairs=mail_kvpairs(idx, parent_idx))
+        hkml_cache.writeback_mails()
+        self.reset_cache_states()
+
+        self.assertEqual(hkml_cache.get_ancestor_msgids('<3@bar.com>'),
+                         ['<3@bar.com>', '<2@bar.com>', '<0@bar.com>'])
+        self.assertEqual(hkml_cache.get_thread_msgids('<2@bar.com>'),
+                         ['<0@bar.com>', '<1@bar.com>', '<2@bar.com>',
+                          '<3@bar.com>'])
+        self.assertEqual(hkml_cache.get_thread_msgids('<4@bar.com>'),
+                         ['<4@bar.com>'])
+        self.assertEqual(hkml_cache.get_thread_msgids('<5@bar.com>'), [])
+
+        # index of mails cached before the thread index is built at once
+        conn = hkml_cache.get_sqlite_conn()
+        conn.execute('DELETE FROM thread_parents')
+        conn.execute('DELETE FROM meta WHERE name = ?',
+                     ('thread_index_built',))
+        conn.commit()
+        self.reset_cache_states()
+        self.assertEqual(hkml_cache.get_ancestor_msgids('<1@bar.com>'),
+                         ['<1@bar.com>', '<0@bar.com>'])
+
+    def test_find_ancestors(self):
+        for idx, parent_idx in [[0, None], [1, 0], [2, 1]]:
+            mail = _hkml.Mail(kvpairs=mail_kvpairs(idx, parent_idx))
+        # mails cached without mbox are not indexed
+        conn = hkml_cache.get_sqlite_conn()
+        conn.execute('DELETE FROM thread_parents WHERE msgid = ?',
+                     ('<1@bar.com>',))
+        mail_items = [hkml_list.MailListMailItem(
+            mail_cache_key=None, mail=mail, prdepth=0, parent_item=None,
+            added_by_tag=None)]
+        threads = hkml_list.thread_items_of(
+                mail_items, do_find_ancestors_from_cache=True)
+        self.assertEqual([i.mail.get_msgid() for i in mail_items],
+                         ['<2@bar.com>', '<1@bar.com>', '<0@bar.com>'])
+        self.assertEqual([t.mail.get_msgid() for t in threads],
+                         ['<0@bar.com>'])
+
+    def test_json_migration(self):
+        cache = {'gitid1/gitdir': mail_kvpairs(1),
+                 'msgid_key_map': {'<1@bar.com>': 'gitid1/gitdir'}}
+        with open(os.path.join(self.hkml_dir, 'mails_cache_active'),
+                  'w') as f:
+            json.dump(cache, f)
+        with open(os.path.join(
+            self.hkml_dir, 'mails_cache_archive_2024-01-01-00-00-00'),
+                  'w') as f:
+            json.dump({'gitid2/gitdir': mail_kvpairs(2)}, f)
+
+        self.assertEqual(hkml_cache.get_kvpairs(key='<1@bar.com>'),
+                         mail_kvpairs(1))
+        self.assertEqual(
+                hkml_cache.get_kvpairs(gitid='gitid2', gitdir='gitdir'),
+                mail_kvpairs(2))
+
+    def test_json_backend(self):
+        hkml_cache.set_cache_config(100 * 1024 * 1024, 9, 'json')
+        _hkml.Mail(kvpairs=mail_kvpairs(1))
+        hkml_cache.writeback_mails()
+        self.reset_cache_states()
+
+        self.assertEqual(hkml_cache.get_kvpairs(key='<1@bar.com>'),
+                         mail_kvpairs(1))
+        self.assertFalse(os.path.exists(hkml_cache.sqlite_db_path()))
+
+    def test_config_keep_backend(self):
+        hkml_cache.set_cache_config(100 * 1024 * 1024, 9, 'json')
+        parser = argparse.ArgumentParser()
+        hkml_cache.set_argparser(parser)
+        hkml_cache.main(parser.parse_args(['config', '1024', '3']))
+        self.reset_cache_states()
+        self.assertEqual(hkml_cache.load_cache_config(), {
+            'max_active_cache_sz': 1024, 'max_archived_caches': 3,
+            'backend': 'json'})
+        self.assertFalse(os.path.isfile(hkml_cache.sqlite_db_path()))
+
+    def test_archive_keys_file(self):
+        hkml_cache.set_cache_config(1, 9, 'json')
+        with open(os.path.join(self.hkml_dir, 'mails_cache_active'),
+                  'w') as f:
+            json.dump({'gitid1/gitdir': mail_kvpairs(1),
+                       'msgid_key_map': {'<1@bar.com>': 'gitid1/gitdir'}}, f)
+        # the active cache is bigger than the limit, so archived.
+        self.assertIsNone(hkml_cache.get_kvpairs(key='<2@bar.com>'))
+        archive_files = hkml_cache.list_archive_files()
+        self.assertEqual(len(archive_files), 1)
+        with open(hkml_cache.archive_keys_file_path(archive_files[0]),
+                  'r') as f:
+            self.assertEqual(f.read().split('\n'),
+                             ['<1@bar.com>', 'gitid1/gitdir'])
+        # the miss is answered without loading the archive
+        self.assertEqual(hkml_cache.archived_caches, {})
+
+        self.assertEqual(hkml_cache.get_kvpairs(key='<1@bar.com>'),
+                         mail_kvpairs(1))
+        self.assertEqual(list(hkml_cache.archived_caches.keys()),
+                         archive_files)
+
+if __name__ == '__main__':
+    unittest.main()
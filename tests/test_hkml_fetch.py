@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_gitlog_index
+import _hkml_state
+import hkml_fetch
+
+class TestHkmlFetch(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_fetch_')
+        # the remote site
+        self.site = os.path.join(self.hkml_dir, 'site')
+        self.remote = os.path.join(self.site, 'l', 'git', '0.git')
+        self.worktree = os.path.join(self.hkml_dir, 'worktree')
+        os.makedirs(self.worktree)
+        subprocess.check_call(['git', 'init', '-q', '--bare', self.remote])
+        self.add_remote_mail(0)
+        manifest_path = os.path.join(self.hkml_dir, 'manifest')
+        with open(manifest_path, 'w') as f:
+            json.dump({'/l/git/0.git': {}, 'site': self.site}, f)
+        _hkml.set_hkml_dir_manifest(self.hkml_dir, manifest_path)
+
+    def tearDown(self):
+        _hkml_state.flush()
+        shutil.rmtree(self.hkml_dir)
+
+    def add_remote_mail(self, idx):
+        git_cmd = ['git', '--git-dir=%s' % self.remote,
+                   '--work-tree=%s' % self.worktree,
+                   '-c', 'user.name=hkml', '-c', 'user.email=hkml@test']
+        with open(os.path.join(self.worktree, 'm'), 'w') as f:
+            f.write('Subject: mail %d\n\nbody %d\n' % (idx, idx))
+        subprocess.check_call(git_cmd + ['add', 'm'])
+        subprocess.check_call(git_cmd + ['commit', '-q', '-m', 'm%d' % idx])
+
+    def test_fetch_list(self):
+        result = hkml_fetch.fetch_list('l', 1, self.site, None, False,
+                                       measure_bytes=True)
+        self.assertFalse(result.failed)
+        self.assertTrue(result.updated)
+        self.assertTrue(result.outputs[0].startswith('git clone --mirror'))
+        self.assertGreater(result.nr_bytes, 0)
+
+        # outputs of serial fetches are printed as made
+        self.add_remote_mail(1)
+        result = hkml_fetch.fetch_list('l', 1, self.site, None, False,
+                                       stream=True)
+        self.assertFalse(result.failed)
+        self.assertTrue(result.updated)
+        self.assertEqual(result.outputs, [])
+        self.assertEqual(result.nr_bytes, 0)
+
+    def test_gitlog_index(self):
+        mdir = _hkml.mail_list_data_paths('l')[0]
+        hkml_fetch.fetch_list('l', 1, self.site, None, False)
+        # the index is not built unless asked
+        self.assertFalse(_hkml_gitlog_index.index_exists(mdir))
+
+        result = hkml_fetch.fetch_list('l', 1, self.site, None, False,
+                                       build_gitlog_index=True)
+        self.assertFalse(result.failed)
+        self.assertEqual(_hkml_gitlog_index.index_path(mdir), os.path.join(
+            self.hkml_dir, 'gitlog_index', 'l', 'git', '0.git'))
+        self.assertEqual(_hkml_gitlog_index.read_index_tip(mdir),
+                         _hkml_gitlog_index.git_tip(mdir))
+
+        # built index is updated by later fetches
+        self.add_remote_mail(1)
+        hkml_fetch.fetch_list('l', 1, self.site, None, False)
+        self.assertEqual(_hkml_gitlog_index.read_index_tip(mdir),
+                         _hkml_gitlog_index.git_tip(mdir))
+        self.assertEqual(len(_hkml_gitlog_index.get_gitlog_lines(
+            mdir, None, None, None, None)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
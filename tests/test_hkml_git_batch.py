@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml_git_batch
+
+class TestHkmlGitBatch(unittest.TestCase):
+    def setUp(self):
+        self.repo = tempfile.mkdtemp(prefix='hkml_test_git_batch_')
+        subprocess.check_call(['git', '-C', self.repo, 'init', '-q'])
+        self.gitids = []
+        for idx in range(3):
+            with open(os.path.join(self.repo, 'm'), 'w') as f:
+                f.write('Subject: mail %d\n\nbody %d\n' % (idx, idx))
+            subprocess.check_call(['git', '-C', self.repo, 'add', 'm'])
+            subprocess.check_call(
+                    ['git', '-C', self.repo, '-c', 'user.name=hkml',
+                     '-c', 'user.email=hkml@test', 'commit', '-q', '-m',
+                     'mail %d' % idx])
+            self.gitids.append(subprocess.check_output(
+                ['git', '-C', self.repo, 'rev-parse', 'HEAD']).decode().strip())
+        self.gitdir = os.path.join(self.repo, '.git')
+
+    def tearDown(self):
+        _hkml_git_batch.close_batches()
+        _hkml_git_batch.prefetched_blobs.clear()
+        shutil.rmtree(self.repo)
+
+    def test_read_blobs(self):
+        self.assertEqual(
+                _hkml_git_batch.read_blobs(
+                    self.gitdir, ['%s:m' % g for g in self.gitids] +
+                    ['%s:nonexisting' % self.gitids[0]]),
+                ['Subject: mail %d\n\nbody %d' % (i, i) for i in range(3)] +
+                [None])
+        self.assertEqual(len(_hkml_git_batch.batches), 1)
+
+    def test_retry(self):
+        objnames = ['%s:m' % g for g in self.gitids]
+        _hkml_git_batch.read_blobs(self.gitdir, objnames)
+        batch = _hkml_git_batch.get_batch(self.gitdir)
+        # the process is broken
+        batch.proc.stdout.close()
+        self.assertEqual(
+                _hkml_git_batch.read_blobs(self.gitdir, objnames),
+                ['Subject: mail %d\n\nbody %d' % (i, i) for i in range(3)])
+        self.assertIsNotNone(batch.proc.returncode)
+        self.assertIsNot(_hkml_git_batch.get_batch(self.gitdir), batch)
+
+    def test_prefetch_blobs(self):
+        objname = '%s:m' % self.gitids[1]
+        _hkml_git_batch.prefetch_blobs(self.gitdir, [objname])
+        self.assertEqual(len(_hkml_git_batch.prefetched_blobs), 1)
+        self.assertEqual(_hkml_git_batch.read_blob(self.gitdir, objname),
+                         'Subject: mail 1\n\nbody 1')
+        self.assertEqual(len(_hkml_git_batch.prefetched_blobs), 0)
+
+    def test_prefetched_blobs_size(self):
+        blobs = _hkml_git_batch.PrefetchedBlobs(max_bytes=10)
+        for idx in range(3):
+            blobs.add(('gitdir', 'o%d' % idx), '0123')
+        blobs.add(('gitdir', 'missing'), None)
+        # the oldest one is dropped
+        self.assertEqual(blobs.nr_bytes, 8)
+        self.assertFalse(('gitdir', 'o0') in blobs)
+        self.assertEqual(blobs.pop(('gitdir', 'o1')), '0123')
+        self.assertIsNone(blobs.pop(('gitdir', 'missing')))
+        self.assertFalse(blobs.pop(('gitdir', 'o1')))
+        self.assertEqual(blobs.nr_bytes, 4)
+        self.assertEqual(len(blobs), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_git_batch
+import _hkml_gitlog_index
+
+def date_of(day):
+    return datetime.datetime(2024, 1, day, tzinfo=datetime.timezone.utc)
+
+class TestHkmlGitlogIndex(unittest.TestCase):
+    def setUp(self):
+        self.repo = tempfile.mkdtemp(prefix='hkml_test_gitlog_index_')
+        subprocess.check_call(['git', '-C', self.repo, 'init', '-q'])
+        self.mdir = os.path.join(self.repo, '.git')
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_gitlog_index_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+
+    def tearDown(self):
+        _hkml_git_batch.close_batches()
+        shutil.rmtree(self.repo)
+        shutil.rmtree(self.hkml_dir)
+
+    def commit_mail(self, idx, day):
+        with open(os.path.join(self.repo, 'm'), 'w') as f:
+            f.write('\n'.join([
+                'Subject: mail %d' % idx,
+                'Message-ID: <%d@foo.com>' % idx,
+                'In-Reply-To: <0@foo.com>' if idx != 0 else 'X-Foo: bar',
+                '', 'body']))
+        env = dict(os.environ)
+        env['GIT_AUTHOR_DATE'] = date_of(day).isoformat()
+        subprocess.check_call(['git', '-C', self.repo, 'add', 'm'])
+        subprocess.check_call(
+                ['git', '-C', self.repo, '-c', 'user.name=hkml',
+                 '-c', 'user.email=hkml@test', 'commit', '-q', '-m',
+                 'mail %d' % idx], env=env)
+
+    def subjects(self, lines):
+        return [line.split(' ', 2)[2] for line in lines]
+
+    def test_index(self):
+        # mail 2 has misordered date
+        for idx, day in enumerate([1, 5, 2, 6]):
+            self.commit_mail(idx, day)
+        self.assertEqual(_hkml_gitlog_index.get_gitlog_lines(
+            self.mdir, date_of(1), None, None, None), None)
+        self.assertEqual(_hkml_gitlog_index.update_index(self.mdir), None)
+
+        lines = _hkml_gitlog_index.get_gitlog_lines(
+                self.mdir, date_of(2), date_of(5), None, None)
+        self.assertEqual(self.subjects(lines), ['mail 1', 'mail 2'])
+        lines = _hkml_gitlog_index.get_gitlog_lines(
+                self.mdir, date_of(1), None, 2, None)
+        self.assertEqual(self.subjects(lines), ['mail 3', 'mail 1'])
+        lines = _hkml_gitlog_index.get_gitlog_lines(
+                self.mdir, date_of(7), date_of(5), None, 2)
+        self.assertEqual(self.subjects(lines), ['mail 1', 'mail 2'])
+        self.assertEqual(_hkml_gitlog_index.get_gitlog_lines(
+            self.mdir, date_of(7), None, None, None), [])
+
+        with open(_hkml_gitlog_index.index_path(self.mdir), 'r') as f:
+            fields = f.read().split('\n')[2].split()
+        self.assertEqual(fields[3:5], ['<2@foo.com>', '<0@foo.com>'])
+
+        # outdated index is not used
+        self.commit_mail(4, 3)
+        self.assertEqual(_hkml_gitlog_index.get_gitlog_lines(
+            self.mdir, date_of(1), None, None, None), None)
+        self.assertEqual(_hkml_gitlog_index.update_index(self.mdir), None)
+        lines = _hkml_gitlog_index.get_gitlog_lines(
+                self.mdir, date_of(1), None, None, None)
+        self.assertEqual(self.subjects(lines),
+                         ['mail 3', 'mail 1', 'mail 4', 'mail 2', 'mail 0'])
+
+    def read_index(self):
+        with open(_hkml_gitlog_index.index_path(self.mdir), 'r') as f:
+            return f.read()
+
+    def test_update(self):
+        # index made in the git dir by old versions
+        old_index_path = os.path.join(self.mdir, 'hkml_gitlog_index')
+        with open(old_index_path, 'w') as f:
+            f.write('foo\n')
+        self.commit_mail(0, 1)
+        self.commit_mail(1, 3)
+        self.assertEqual(_hkml_gitlog_index.update_index(self.mdir), None)
+        self.assertFalse(os.path.exists(old_index_path))
+        self.assertTrue(_hkml_gitlog_index.index_path(self.mdir).startswith(
+            self.hkml_dir))
+
+        progress = []
+        _hkml_gitlog_index.read_chunk_sz = 1
+        _hkml_gitlog_index.progress_report_interval = 2
+        for idx, day in enumerate([4, 2, 5]):
+            self.commit_mail(idx + 2, day)
+        try:
+            self.assertEqual(_hkml_gitlog_index.update_index(
+                self.mdir, progress.append), None)
+        finally:
+            _hkml_gitlog_index.read_chunk_sz = 1000
+            _hkml_gitlog_index.progress_report_interval = 10000
+        self.assertEqual(progress, ['indexing %s: 2/3 mails' % self.mdir])
+        self.assertEqual(self.subjects(_hkml_gitlog_index.get_gitlog_lines(
+            self.mdir, None, None, None, None)),
+            ['mail 4', 'mail 2', 'mail 1', 'mail 3', 'mail 0'])
+        appended = self.read_index()
+
+        # the update is same to building from scratch
+        os.remove(_hkml_gitlog_index.index_path(self.mdir))
+        self.assertEqual(_hkml_gitlog_index.update_index(self.mdir), None)
+        self.assertEqual(appended, self.read_index())
+
+        # interrupted update is not used, and the index is built again
+        tip = _hkml_gitlog_index.git_tip(self.mdir)
+        with open(_hkml_gitlog_index.index_path(self.mdir), 'r+') as f:
+            f.write('0' * len(tip))
+        self.assertEqual(_hkml_gitlog_index.get_gitlog_lines(
+            self.mdir, None, None, None, None), None)
+        self.assertEqual(_hkml_gitlog_index.update_index(self.mdir), None)
+        self.assertEqual(appended, self.read_index())
+
+if __name__ == '__main__':
+    unittest.main()
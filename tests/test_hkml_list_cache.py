@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_list_cache
+import _hkml_state
+import hkml_list
+
+def list_data_of(text, cache_keys):
+    return hkml_list.MailsListData(
+            text, None, mail_items=[hkml_list.MailListMailItem(
+                mail_cache_key=k, mail=None, prdepth=0, parent_item=None,
+                added_by_tag=None) for k in cache_keys])
+
+class TestHkmlListCache(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_list_cache_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+        self.reset_states()
+
+    def tearDown(self):
+        _hkml_state.flush()
+        self.reset_states()
+        shutil.rmtree(self.hkml_dir)
+
+    def reset_states(self):
+        _hkml_list_cache.mails_lists_cache = None
+        _hkml_list_cache.cached_list_outputs = {}
+        _hkml_list_cache.dirty_keys = set()
+        _hkml_list_cache.files_to_remove = set()
+        _hkml_list_cache.need_index_update = False
+        _hkml_list_cache.cache_history = None
+
+    def test_set_get(self):
+        key = json.dumps({'source': 'foo'})
+        _hkml_list_cache.set_item(key, list_data_of('[0] foo', ['k0']))
+        _hkml_list_cache.set_item(
+                'thread_output', list_data_of('[0] bar', ['k1']))
+        self.reset_states()
+
+        list_data = _hkml_list_cache.get_last_list()
+        self.assertEqual(list_data.text, '# (cached output)\n[0] foo')
+        self.assertEqual([i.mail_cache_key for i in list_data.mail_items],
+                         ['k0'])
+        # only the index and the entry for the last list are read
+        self.assertEqual(list(_hkml_list_cache.cached_list_outputs.keys()),
+                         [key])
+        self.assertEqual(_hkml_list_cache.get_last_thread(),
+                         '# (cached output)\n[0] bar')
+
+        _hkml_list_cache.invalidate_cached_outputs('foo')
+        _hkml_list_cache.writeback_list_output()
+        self.reset_states()
+        self.assertIsNone(_hkml_list_cache.get_last_list())
+        self.assertEqual(len([f for f in os.listdir(
+            _hkml_list_cache.list_output_cache_dir_path())
+                              if not f.startswith('.')]), 2)
+
+    def test_keep_date(self):
+        now = [datetime.datetime(2024, 1, 1)]
+
+        class FakeDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return now[0]
+
+        keys = [json.dumps({'source': s}) for s in ['foo', 'bar']]
+        orig_datetime = datetime.datetime
+        datetime.datetime = FakeDatetime
+        try:
+            _hkml_list_cache.set_item(keys[0], list_data_of('[0] foo', ['k0']))
+            now[0] = orig_datetime(2024, 1, 2)
+            _hkml_list_cache.set_item(keys[1], list_data_of('[0] bar', ['k1']))
+            self.reset_states()
+            # access the older one, and update it keeping the access date
+            now[0] = orig_datetime(2024, 1, 3)
+            _hkml_list_cache.get_list_for(keys[0])
+            _hkml_list_cache.writeback_list_output()
+            self.reset_states()
+            _hkml_list_cache.set_item(
+                    keys[0], list_data_of('[0] baz', ['k2']), keep_date=True)
+        finally:
+            datetime.datetime = orig_datetime
+        self.reset_states()
+        self.assertEqual(_hkml_list_cache.keys_sorted_by_date(),
+                         [keys[1], keys[0]])
+
+    def test_migration(self):
+        key = json.dumps({'source': 'foo'})
+        with open(_hkml_list_cache.list_output_cache_file_path(), 'w') as f:
+            json.dump({key: {'output': '[0] foo', 'mail_items': [
+                {'mail_cache_key': 'k0', 'prdepth': 0,
+                 'added_by_tag': None}],
+                             'date': '2024-01-01-00-00-00'}}, f)
+        list_data = _hkml_list_cache.get_last_list()
+        self.assertEqual(list_data.text, '[0] foo')
+        self.assertFalse(os.path.exists(
+            _hkml_list_cache.list_output_cache_file_path()))
+        self.assertTrue(os.path.isfile(
+            _hkml_list_cache.list_output_cache_index_path()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_state
+import hkml_cache
+import hkml_list
+
+mbox = '\n'.join([
+    'From: =?UTF-8?Q?J=C3=B6rg?= <joerg@foo.com>',
+    'To: a@foo.com',
+    'Cc: b@foo.com,',
+    ' c@foo.com',
+    'Cc: d@foo.com',
+    'Subject: [PATCH v2 2/3] mm: test',
+    'Message-ID: <2@foo.com> (extra)',
+    'In-Reply-To: <1@foo.com> (Jörg\'s message)',
+    'Date: Mon, 1 Jan 2024 00:00:00 +0000',
+    '',
+    'Hello,',
+    '',
+    'Subject: not a header'])
+
+class TestHkmlMail(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_mail_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+
+    def tearDown(self):
+        _hkml_state.flush()
+        hkml_cache.close_sqlite_conn()
+        hkml_cache.cache_config = None
+        shutil.rmtree(self.hkml_dir)
+
+    def test_parse_mbox_raw_header(self):
+        raw_header, body_offset = _hkml.parse_mbox_raw_header(mbox)
+        self.assertEqual(raw_header['cc'], ['b@foo.com, c@foo.com',
+                                            'd@foo.com'])
+        self.assertEqual(raw_header['from'],
+                         ['=?UTF-8?Q?J=C3=B6rg?= <joerg@foo.com>'])
+        self.assertFalse('hello,' in raw_header)
+        self.assertEqual(mbox[body_offset:],
+                         'Hello,\n\nSubject: not a header')
+
+    def test_get_field(self):
+        mail = _hkml.Mail(mbox=mbox)
+        self.assertEqual(mail.subject, '[PATCH v2 2/3] mm: test')
+        self.assertEqual(mail.series, [2, 3])
+        self.assertEqual(mail.get_from(), 'Jörg <joerg@foo.com>')
+        self.assertEqual(mail.get_field('cc'),
+                         'b@foo.com, c@foo.com, d@foo.com')
+        self.assertEqual(mail.get_msgid(), '<2@foo.com>')
+        self.assertEqual(mail.get_in_reply_to_msgid(), '<1@foo.com>')
+        self.assertEqual(mail.get_field('x-not-exist'), None)
+        self.assertEqual(mail.get_body(), 'Hello,\n\nSubject: not a header')
+
+    def test_drop_mbox(self):
+        repo = os.path.join(self.hkml_dir, 'repo')
+        subprocess.check_call(['git', 'init', '-q', repo])
+        with open(os.path.join(repo, 'm'), 'w') as f:
+            f.write(mbox)
+        subprocess.check_call(['git', '-C', repo, 'add', 'm'])
+        subprocess.check_call(
+                ['git', '-C', repo, '-c', 'user.name=hkml', '-c',
+                 'user.email=hkml@test', 'commit', '-q', '-m', 'mail'])
+        gitid = subprocess.check_output(
+                ['git', '-C', repo, 'rev-parse', 'HEAD']).decode().strip()
+        mail = _hkml.Mail.from_gitlog(
+                gitid, os.path.join(repo, '.git'),
+                '2024-01-01T00:00:00+00:00', '[PATCH v2 2/3] mm: test')
+
+        list_decorator = hkml_list.MailListDecorator(None)
+        list_decorator.ascend = True
+        list_decorator.sort_threads_by = ['first_date']
+        list_decorator.collapse = False
+        list_decorator.cols = 80
+        list_data, err = hkml_list.mails_to_list_data(
+                [mail], do_find_ancestors_from_cache=False,
+                mails_filter=hkml_list.MailListFilter(None),
+                list_decorator=list_decorator,
+                show_thread_of=None, runtime_profile=[], stat_only=False,
+                stat_authors=False)
+        self.assertIsNone(err)
+        self.assertTrue(list_data.mail_items[0].mail is mail)
+        # listing parsed the header, so the mbox is dropped
+        self.assertIsNone(mail.mbox)
+        self.assertEqual(mail.get_from(), 'Jörg <joerg@foo.com>')
+        self.assertEqual(mail.get_field('cc'),
+                         'b@foo.com, c@foo.com, d@foo.com')
+        self.assertIsNone(mail.mbox)
+        # body and mbox are read again from git
+        self.assertEqual(mail.get_body(), 'Hello,\n\nSubject: not a header')
+        self.assertEqual(mail.to_kvpairs()['mbox'], mbox)
+
+        # mails that are not from git keep mbox
+        mail = _hkml.Mail(mbox=mbox)
+        mail.drop_mbox()
+        self.assertEqual(mail.mbox, mbox)
+
+    def write_mbox(self, filename, content):
+        path = os.path.join(self.hkml_dir, filename)
+        if filename.endswith('.gz'):
+            with gzip.open(path, 'wb') as f:
+                f.write(content.encode())
+        else:
+            with open(path, 'w') as f:
+                f.write(content)
+        return path
+
+    def test_iter_mbox_messages(self):
+        from_line = 'From mboxrd@z Thu Jan  1 00:00:00 1970'
+        messages = [mbox.replace('<2@foo.com>', '<%d@foo.com>' % i)
+                    for i in range(3)]
+        messages[1] += '\n>From the escaped line\n'
+        content = '\n'.join(['%s\n%s\n' % (from_line, m) for m in messages])
+        expected = [m.strip() for m in messages]
+        unescaped = [m.replace('>From', 'From') for m in expected]
+        for filename in ['test.mbox', 'test.mbox.gz']:
+            path = self.write_mbox(filename, content)
+            self.assertEqual(list(_hkml.iter_mbox_messages(path)), expected)
+            self.assertEqual(
+                    list(_hkml.iter_mbox_messages(path, mboxrd=True)),
+                    unescaped)
+
+        # messages are not separated by blank lines
+        no_blank = '\n'.join(['%s\n%s' % (from_line, m.strip())
+                              for m in messages]) + '\n'
+        for filename in ['no_blank.mbox', 'no_blank.mbox.gz']:
+            path = self.write_mbox(filename, no_blank)
+            self.assertEqual(list(_hkml.iter_mbox_messages(path)), expected)
+
+        # initial From line is missed
+        path = self.write_mbox('no_from.mbox', content[len(from_line) + 1:])
+        self.assertEqual(list(_hkml.iter_mbox_messages(path)), expected)
+
+        mails = _hkml.read_mbox_file(path, max_nr_mails=2)
+        self.assertEqual([m.get_msgid() for m in mails],
+                         ['<0@foo.com>', '<1@foo.com>'])
+
+if __name__ == '__main__':
+    unittest.main()
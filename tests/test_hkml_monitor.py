@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import datetime
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_state
+import hkml_cache
+import hkml_fetch
+import hkml_list
+import hkml_monitor
+
+class FakeMail:
+    def __init__(self, gitid):
+        self.gitid = gitid
+        self.gitdir = None
+
+    def get_msgid(self):
+        return '<%s>' % self.gitid
+
+    def get_in_reply_to_msgid(self):
+        return None
+
+    def drop_mbox(self):
+        pass
+
+def mail_of(idx, parent_idx, subject):
+    lines = ['From: foo <foo@bar.com>',
+             'Subject: %s' % subject,
+             'Message-ID: <%d@foo>' % idx,
+             'Date: Tue, 2 Jan 2024 00:00:%02d +0000' % idx]
+    if parent_idx is not None:
+        lines.append('In-Reply-To: <%d@foo>' % parent_idx)
+    return _hkml.Mail(mbox='\n'.join(lines + ['', 'body']))
+
+def monitor_request(mailing_lists, interval):
+    return hkml_monitor.HkmlMonitorRequest(
+            mailing_lists, hkml_list.MailListFilter(None),
+            hkml_list.MailListDecorator(None), None, None, interval,
+            ','.join(mailing_lists))
+
+class TestHkmlMonitor(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_monitor_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+        self.orig_get_mails = hkml_list.get_mails
+        self.orig_do_monitor = hkml_monitor.do_monitor
+        self.orig_fetch_mail = hkml_fetch.fetch_mail
+        self.orig_get_new_gitids = hkml_monitor.get_new_gitids
+        hkml_monitor.monitor_threads = hkml_monitor.MonitorThreads()
+        # mailing list to list of gitids of the list
+        self.archives = {'a': [], 'b': []}
+        self.fetches = []
+        # list of (request, gitids of mails to check)
+        self.checked = []
+
+        def fetch_mail(mail_lists, quiet=False, epochs=1):
+            self.fetches += mail_lists
+
+        def get_new_gitids(target, ignore_mails_before):
+            gitids = self.archives[target.mailing_list]
+            if target.last_gitid is None:
+                return [gitids], None
+            return [gitids[gitids.index(target.last_gitid) + 1:]], None
+
+        def get_mails(source, fetch, since, until, min_nr_mails,
+                      max_nr_mails, commits_range=None):
+            gitids = self.archives[source]
+            start, end = ([None] + commits_range.split('..'))[-2:]
+            gitids = gitids[:gitids.index(end) + 1]
+            if start is not None:
+                gitids = gitids[gitids.index(start) + 1:]
+            return [FakeMail(g) for g in gitids], None
+
+        def do_monitor(request, mails_to_check):
+            self.checked.append(
+                    (request, [m.gitid for m in mails_to_check]))
+
+        hkml_list.get_mails = get_mails
+        hkml_monitor.do_monitor = do_monitor
+        hkml_fetch.fetch_mail = fetch_mail
+        hkml_monitor.get_new_gitids = get_new_gitids
+
+    def tearDown(self):
+        _hkml_state.flush()
+        hkml_list.get_mails = self.orig_get_mails
+        hkml_monitor.do_monitor = self.orig_do_monitor
+        hkml_fetch.fetch_mail = self.orig_fetch_mail
+        hkml_monitor.get_new_gitids = self.orig_get_new_gitids
+        hkml_cache.close_sqlite_conn()
+        shutil.rmtree(self.hkml_dir)
+
+    def test_shared_fetch(self):
+        requests = [monitor_request(['a'], 60), monitor_request(['a', 'b'],
+                                                                 120)]
+        targets = {'a': hkml_monitor.MonitorTarget('a', None),
+                   'b': hkml_monitor.MonitorTarget('b', None)}
+        cursors = [{'a': 0}, {'a': 0, 'b': 0}]
+        last_checked = [{}, {}]
+
+        self.archives['a'] += ['a0', 'a1']
+        self.archives['b'] += ['b0']
+        hkml_monitor.monitor_requests(requests, [0, 1], targets, cursors,
+                                      last_checked, None, 100)
+        self.assertEqual(self.fetches, ['a', 'b'])
+        self.assertEqual(self.checked, [(requests[0], ['a0', 'a1']),
+                                        (requests[1], ['a0', 'a1', 'b0'])])
+        self.assertEqual(targets['a'].mails, [])
+
+        # mails for requests[1] are kept until it checks those
+        self.archives['a'] += ['a2']
+        hkml_monitor.monitor_requests(requests, [0], targets, cursors,
+                                      last_checked, None, 100)
+        self.assertEqual(self.checked[-1], (requests[0], ['a2']))
+        self.assertEqual([m.gitid for m in targets['a'].mails], ['a2'])
+        self.assertEqual(hkml_monitor.read_monitor_state()[
+            'last_monitored_mails'],
+                         {'a': 'a1', 'b': 'b0'})
+
+        self.archives['a'] += ['a3']
+        hkml_monitor.monitor_requests(requests, [0, 1], targets, cursors,
+                                      last_checked, None, 100)
+        self.assertEqual(self.checked[-1], (requests[1], ['a2', 'a3']))
+        self.assertEqual(hkml_monitor.read_monitor_state()[
+            'last_monitored_mails'],
+                         {'a': 'a3', 'b': 'b0'})
+
+    def test_catchup(self):
+        requests = [monitor_request(['a'], 60), monitor_request(['a'], 120)]
+        self.archives['a'] += ['a%d' % i for i in range(5)]
+        targets = {'a': hkml_monitor.MonitorTarget('a', 'a0')}
+        # requests[1] checked up to 'a3' before
+        cursors = [{'a': 0}, {'a': 'a3'}]
+        last_checked = [{}, {'a': 'a3'}]
+        hkml_monitor.monitor_requests(requests, [0, 1], targets, cursors,
+                                      last_checked, None, 2)
+        self.assertEqual(self.checked, [
+            (requests[0], ['a1', 'a2']), (requests[1], []),
+            (requests[0], ['a3', 'a4']), (requests[1], ['a4'])])
+        self.assertEqual(targets['a'].mails, [])
+        state = hkml_monitor.read_monitor_state()
+        self.assertEqual(state['last_monitored_mails'], {'a': 'a4'})
+        self.assertEqual(
+                state['requests'][hkml_monitor.request_state_key(
+                    requests[1])], {'a': 'a4'})
+
+    def add_archive_mails(self, mdir, idxs):
+        if not os.path.isdir(mdir):
+            subprocess.check_call(['git', 'init', '-q', '--bare', mdir])
+        worktree = os.path.join(self.hkml_dir, 'worktree')
+        os.makedirs(worktree, exist_ok=True)
+        git_cmd = ['git', '--git-dir=%s' % mdir, '--work-tree=%s' % worktree,
+                   '-c', 'user.name=hkml', '-c', 'user.email=hkml@test']
+        gitids = []
+        for idx in idxs:
+            with open(os.path.join(worktree, 'm'), 'w') as f:
+                f.write(mail_of(idx, None, 'mail %d' % idx).mbox)
+            subprocess.check_call(git_cmd + ['add', 'm'])
+            subprocess.check_call(
+                    git_cmd + ['commit', '-q', '-m', 'mail %d' % idx])
+            gitids.append(_hkml.cmd_str_output(
+                git_cmd + ['rev-parse', 'HEAD']))
+        return gitids
+
+    def test_epochs(self):
+        hkml_list.get_mails = self.orig_get_mails
+        hkml_monitor.get_new_gitids = self.orig_get_new_gitids
+        manifest_path = os.path.join(self.hkml_dir, 'manifest')
+        with open(manifest_path, 'w') as f:
+            json.dump({'/l/git/0.git': {}, '/l/git/1.git': {},
+                       'site': 'https://lore.kernel.org'}, f)
+        _hkml.set_hkml_dir_manifest(self.hkml_dir, manifest_path)
+        epochs = [os.path.join(self.hkml_dir, 'archives', 'l', 'git',
+                               '%d.git' % e) for e in [0, 1]]
+        gitids = self.add_archive_mails(epochs[0], [0, 1, 2])
+
+        target = hkml_monitor.MonitorTarget('l', gitids[0])
+        self.assertIsNone(hkml_monitor.update_backlog(target, None))
+        self.assertEqual(target.backlog, gitids[1:])
+
+        # new epoch is made after the last fetch, and the monitor is
+        # restarted after that
+        gitids += self.add_archive_mails(epochs[1], [3, 4])
+        restart_time = datetime.datetime.now().astimezone() + \
+                datetime.timedelta(minutes=1)
+        self.assertIsNone(hkml_monitor.update_backlog(target, restart_time))
+        self.assertEqual(target.backlog, gitids[1:])
+        self.assertIsNone(hkml_monitor.fetch_next_batch(
+            target, restart_time, 10))
+        self.assertEqual([m.gitid for m in target.mails], gitids[1:3])
+        self.assertIsNone(hkml_monitor.fetch_next_batch(
+            target, restart_time, 10))
+        self.assertEqual([m.gitid for m in target.mails], gitids[1:])
+        self.assertEqual(target.backlog, [])
+
+        # the last fetched commit is in the new epoch
+        gitids += self.add_archive_mails(epochs[1], [5])
+        self.assertIsNone(hkml_monitor.update_backlog(target, None))
+        self.assertEqual(target.backlog, gitids[5:])
+
+    def test_stop(self):
+        signals = []
+        orig_handler = signal.signal(
+                signal.SIGUSR1, lambda signum, frame: signals.append(signum))
+        try:
+            # pid file of a monitor that killed
+            with open(hkml_monitor.get_monitor_pid_file_path(), 'w') as f:
+                f.write('%d' % os.getpid())
+            hkml_monitor.stop_monitoring()
+            self.assertEqual(signals, [])
+            self.assertFalse(os.path.exists(
+                hkml_monitor.get_monitor_pid_file_path()))
+
+            pid_fd = hkml_monitor.lock_monitor_pid_file()
+            self.assertIsNone(hkml_monitor.lock_monitor_pid_file())
+            hkml_monitor.stop_monitoring()
+            self.assertEqual(signals, [signal.SIGUSR1])
+            os.close(pid_fd)
+        finally:
+            signal.signal(signal.SIGUSR1, orig_handler)
+
+    def test_requests_file(self):
+        hkml_monitor.requests = None
+        hkml_monitor.add_requests(monitor_request(['a'], 60))
+        # another hkml process adds a request in the meantime
+        with open(hkml_monitor.get_requests_file_path(), 'r') as f:
+            kvpairs = json.load(f)
+        kvpairs.append(monitor_request(['b'], 60).to_kvpairs())
+        with open(hkml_monitor.get_requests_file_path(), 'w') as f:
+            json.dump(kvpairs, f)
+
+        hkml_monitor.add_requests(monitor_request(['c'], 60))
+        self.assertEqual([r.name for r in hkml_monitor.get_requests()],
+                         ['a', 'b', 'c'])
+        self.assertTrue(hkml_monitor.remove_requests(name='b'))
+        hkml_monitor.requests = None
+        self.assertEqual([r.name for r in hkml_monitor.get_requests()],
+                         ['a', 'c'])
+        hkml_monitor.requests = None
+
+    def test_threads(self):
+        threads = hkml_monitor.MonitorThreads()
+        # reply arrives before the parent
+        threads.add_mails([mail_of(2, 1, 'Re: damon: foo')])
+        self.assertEqual(list(threads.orphans.keys()), ['<1@foo>'])
+        threads.add_mails([mail_of(1, None, 'damon: foo'),
+                           mail_of(3, 2, 'Re: Re: damon: foo')])
+        root = threads.items['<1@foo>']
+        self.assertEqual(threads.orphans, {})
+        self.assertEqual([i.mail.get_msgid() for i in root.reply_items],
+                         ['<2@foo>'])
+        self.assertEqual(threads.items['<3@foo>'].parent_item.parent_item,
+                         root)
+
+        hkml_monitor.monitor_threads = threads
+        mail_list_filter = hkml_list.MailListFilter(None)
+        mail_list_filter.subject_keywords = [['damon: foo']]
+        mail_list_filter.keywords_for = 'root'
+        request = monitor_request(['a'], 60)
+        request.mail_list_filter = mail_list_filter
+        # reply to a thread that found in previous monitoring
+        new_mails = [mail_of(4, 3, 'Re: bar'), mail_of(5, None, 'bar')]
+        threads.add_mails(new_mails)
+        self.assertEqual(
+                [m.get_msgid() for m in
+                 hkml_monitor.get_mails_to_noti(new_mails, request)],
+                ['<4@foo>'])
+
+    def test_threads_drop_mbox(self):
+        mdir = os.path.join(self.hkml_dir, 'archives', 'l', 'git', '0.git')
+        gitids = self.add_archive_mails(mdir, [1])
+        mail = _hkml.Mail.from_gitlog(
+                gitids[0], mdir, '2024-01-02T00:00:01+00:00', 'mail 1')
+        threads = hkml_monitor.MonitorThreads()
+        hkml_monitor.monitor_threads = threads
+        threads.add_mails([mail])
+        self.assertEqual(threads.items['<1@foo>'].mail, mail)
+        self.assertIsNone(mail.mbox)
+
+        mail_list_filter = hkml_list.MailListFilter(None)
+        mail_list_filter.body_keywords = [['body']]
+        request = monitor_request(['l'], 60)
+        request.mail_list_filter = mail_list_filter
+        self.assertEqual(hkml_monitor.get_mails_to_noti([mail], request),
+                         [mail])
+        # the mbox that read again for the filter is also dropped
+        self.assertIsNone(mail.mbox)
+        self.assertEqual(mail.get_body(), 'body')
+
+if __name__ == '__main__':
+    unittest.main()
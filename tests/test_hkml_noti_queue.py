@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml_noti_queue
+
+# sendmail stand-in that appends the recipients and the mail to 'sent', after
+# failing as many times as the number written in 'nr_failures'
+sendmail_script = '''
+import os, sys
+dirpath = os.path.dirname(os.path.realpath(__file__))
+nr_failures_path = os.path.join(dirpath, 'nr_failures')
+if os.path.isfile(nr_failures_path):
+    with open(nr_failures_path, 'r') as f:
+        nr_failures = int(f.read())
+    if nr_failures > 0:
+        with open(nr_failures_path, 'w') as f:
+            f.write('%d' % (nr_failures - 1))
+        exit(1)
+with open(os.path.join(dirpath, 'sent'), 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n' + sys.stdin.read() + '\\n\\0')
+'''
+
+class TestHkmlNotiQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='hkml_test_noti_queue_')
+        script_path = os.path.join(self.tmp_dir, 'sendmail.py')
+        with open(script_path, 'w') as f:
+            f.write(sendmail_script)
+        self.sendmail_cmd = '%s %s' % (sys.executable, script_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def sent_mails(self):
+        sent_path = os.path.join(self.tmp_dir, 'sent')
+        if not os.path.isfile(sent_path):
+            return []
+        with open(sent_path, 'r') as f:
+            return f.read().split('\0')[:-1]
+
+    def test_digest(self):
+        queue = _hkml_noti_queue.NotiQueue(3600, self.sendmail_cmd)
+        queue.start()
+        queue.add(['a@foo'], 'req1', 'noti 1')
+        queue.add(['a@foo'], 'req2', 'noti 2')
+        queue.add(['b@foo'], 'req1', 'noti 3')
+        self.assertEqual(self.sent_mails(), [])
+        queue.stop()
+        sent_mails = self.sent_mails()
+        self.assertEqual(len(sent_mails), 2)
+        self.assertTrue(sent_mails[0].startswith('a@foo\nTo: a@foo\n'))
+        self.assertTrue(
+                'Subject: [hkml-noti] 2 notifications for monitor requests '
+                'req1, req2' in sent_mails[0])
+        self.assertTrue(sent_mails[0].endswith('noti 1\n\nnoti 2\n'))
+        self.assertTrue(
+                'Subject: [hkml-noti] for monitor request req1'
+                in sent_mails[1])
+
+    def test_retry(self):
+        with open(os.path.join(self.tmp_dir, 'nr_failures'), 'w') as f:
+            f.write('2')
+        queue = _hkml_noti_queue.NotiQueue(0, self.sendmail_cmd)
+        queue.retry_delays = [0.1, 0.1, 0.1]
+        queue.start()
+        queue.add(['a@foo'], 'req1', 'noti 1')
+        for i in range(100):
+            if len(self.sent_mails()) > 0:
+                break
+            # wait for the retries
+            queue.thread.join(0.1)
+        queue.stop()
+        self.assertEqual(len(self.sent_mails()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_pisearch
+
+mbox = '\n'.join([
+    'From: SeongJae Park <sj@kernel.org>',
+    'To: Andrew Morton <akpm@linux-foundation.org>',
+    'Cc: damon@lists.linux.dev',
+    'Subject: [PATCH] mm/damon: fix a bug',
+    'Message-ID: <20240102.sj@kernel.org>',
+    'Date: Tue, 2 Jan 2024 00:00:00 +0000',
+    '', 'This patch fixes a Bug.'])
+
+class TestHkmlPisearch(unittest.TestCase):
+    def matches(self, query_str):
+        groups, err = _hkml_pisearch.parse_query(query_str)
+        self.assertIsNone(err)
+        date = datetime.datetime(
+                2024, 1, 2, 12, tzinfo=datetime.timezone.utc)
+        return _hkml_pisearch.query_matches(
+                groups, '[PATCH] mm/damon: fix a bug', date,
+                _hkml.Mail.from_mbox_uncached(mbox))
+
+    def test_parse_query(self):
+        groups, err = _hkml_pisearch.parse_query(
+                's:"fix a" -f:akpm OR NOT b:foo d:20240101..')
+        self.assertIsNone(err)
+        self.assertEqual([len(g) for g in groups], [2, 2])
+        self.assertEqual(groups[0][0].fields, ['subject'])
+        self.assertEqual(groups[0][0].value, 'fix a')
+        self.assertTrue(groups[0][1].negated)
+        self.assertTrue(groups[1][0].negated)
+        self.assertEqual(groups[1][1].since, datetime.datetime(
+            2024, 1, 1).astimezone())
+        self.assertIsNone(groups[1][1].until)
+
+        self.assertIsNotNone(_hkml_pisearch.parse_query('(a OR b)')[1])
+        self.assertIsNotNone(_hkml_pisearch.parse_query('s:"foo')[1])
+        self.assertIsNotNone(_hkml_pisearch.parse_query('d:2024x')[1])
+
+    def test_parse_url_encoded_query(self):
+        groups, err = _hkml_pisearch.parse_query('s:foo+AND+d:20240101..')
+        self.assertIsNone(err)
+        self.assertEqual(groups[0][0].value, 'foo')
+        self.assertEqual(groups[0][1].since, datetime.datetime(
+            2024, 1, 1).astimezone())
+        groups, err = _hkml_pisearch.parse_query('s:%22C%2B%2B%22+f:sj')
+        self.assertIsNone(err)
+        self.assertEqual([t.value for t in groups[0]], ['c++', 'sj'])
+        # literal '+' of non-encoded queries are kept
+        for query_str in ['s:"C++" f:sj', 's:C++', 's:"a+b"']:
+            groups, err = _hkml_pisearch.parse_query(query_str)
+            self.assertIsNone(err)
+            self.assertTrue('+' in groups[0][0].value)
+
+    def test_query_date_range(self):
+        groups, _ = _hkml_pisearch.parse_query(
+                'd:20240101..20240201 OR s:foo d:20230101..20240301')
+        since, until = _hkml_pisearch.query_date_range(groups)
+        self.assertEqual(since, datetime.datetime(2023, 1, 1).astimezone())
+        self.assertEqual(until, datetime.datetime(2024, 3, 2).astimezone() -
+                         datetime.timedelta(seconds=1))
+        groups, _ = _hkml_pisearch.parse_query('d:20240101.. OR s:foo')
+        self.assertEqual(_hkml_pisearch.query_date_range(groups),
+                         (None, None))
+
+    def test_search_default_date_range(self):
+        mdir = tempfile.mkdtemp(prefix='hkml_test_pisearch_')
+        orig_data_paths = _hkml.mail_list_data_paths
+        orig_search_mdir = _hkml_pisearch.search_mdir
+        ranges = []
+        def search_mdir(mdir, groups, since, until, max_nr_mails, mails):
+            ranges.append([since, until])
+        _hkml.mail_list_data_paths = lambda mailing_list: [
+                mdir, os.path.join(mdir, 'not_fetched')]
+        _hkml_pisearch.search_mdir = search_mdir
+        outputs = []
+        try:
+            for query in ['s:damon', 's:damon d:..20200101',
+                          's:damon d:20100101..']:
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    _hkml_pisearch.search_mails('foo', query)
+                outputs.append(output.getvalue())
+        finally:
+            _hkml.mail_list_data_paths = orig_data_paths
+            _hkml_pisearch.search_mdir = orig_search_mdir
+            shutil.rmtree(mdir)
+        default_range = datetime.timedelta(
+                days=_hkml_pisearch.default_search_days)
+        since, until = ranges[0]
+        self.assertIsNone(until)
+        self.assertTrue(datetime.datetime.now().astimezone() - since >=
+                        default_range)
+        since, until = ranges[1]
+        self.assertEqual(until - since, default_range)
+        self.assertEqual(ranges[2], [
+            datetime.datetime(2010, 1, 1).astimezone(), None])
+        # users are noticed the search is limited
+        self.assertTrue('only mails of last 365 days' in outputs[0])
+        self.assertFalse('only mails of last' in outputs[2])
+        for output in outputs:
+            self.assertTrue('1 epochs are not fetched' in output)
+            self.assertTrue('pisearch-local false' in output)
+
+        notices = _hkml_pisearch.search_notices('foo', True, [], 200, 200)
+        self.assertEqual(len(notices), 2)
+        self.assertTrue('only newest 200' in notices[0])
+        self.assertEqual(
+                _hkml_pisearch.search_notices('foo', False, [], 10, 200), [])
+
+    def test_query_matches(self):
+        self.assertTrue(self.matches('s:damon f:sj'))
+        self.assertTrue(self.matches('bug'))
+        self.assertTrue(self.matches('b:"fixes a bug"'))
+        self.assertTrue(self.matches('tc:damon@lists m:20240102.sj@kernel.org'))
+        self.assertTrue(self.matches('s:foo OR a:akpm'))
+        self.assertFalse(self.matches('s:damon -t:akpm'))
+        self.assertFalse(self.matches('m:20240102'))
+        self.assertTrue(self.matches('d:20240102'))
+        self.assertFalse(self.matches('d:..20240101'))
+        self.assertTrue(self.matches('d:20240102000000..20240102130000'))
+
+    def test_query_matches_without_mail(self):
+        groups, _ = _hkml_pisearch.parse_query('s:damon b:bug')
+        date = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+        self.assertIsNone(_hkml_pisearch.query_matches(
+            groups, 'mm/damon: fix', date, None))
+        self.assertFalse(_hkml_pisearch.query_matches(
+            groups, 'mm/foo: fix', date, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_prefetch
+import _hkml_state
+import hkml_list
+
+class TestHkmlPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_prefetch_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+        self.repo = os.path.join(self.hkml_dir, 'repo')
+        subprocess.check_call(['git', 'init', '-q', self.repo])
+        self.mail_items = []
+        for idx in range(5):
+            with open(os.path.join(self.repo, 'm'), 'w') as f:
+                f.write('\n'.join([
+                    'From: foo <foo@bar.com>',
+                    'Subject: mail %d' % idx,
+                    'Message-ID: <%d@foo>' % idx,
+                    'Date: Tue, 2 Jan 2024 00:00:%02d +0000' % idx,
+                    '', 'body %d' % idx]))
+            subprocess.check_call(['git', '-C', self.repo, 'add', 'm'])
+            subprocess.check_call(
+                    ['git', '-C', self.repo, '-c', 'user.name=hkml',
+                     '-c', 'user.email=hkml@test', 'commit', '-q', '-m',
+                     'mail %d' % idx])
+            gitid = subprocess.check_output(
+                ['git', '-C', self.repo, 'rev-parse', 'HEAD']).decode().strip()
+            mail = _hkml.Mail.from_gitlog(
+                    gitid, os.path.join(self.repo, '.git'),
+                    '2024-01-02T00:00:%02d+00:00' % idx, 'mail %d' % idx)
+            self.mail_items.append(hkml_list.MailListMailItem(
+                mail_cache_key=None, mail=mail, prdepth=0, parent_item=None,
+                added_by_tag=None))
+
+    def tearDown(self):
+        _hkml_state.flush()
+        _hkml_prefetch.stop()
+        shutil.rmtree(self.hkml_dir)
+
+    def wait_prefetch(self, nr_bodies):
+        cache = _hkml_prefetch.prefetcher.cache
+        for i in range(100):
+            if len(cache.bodies) >= nr_bodies:
+                return
+            time.sleep(0.05)
+        self.fail('prefetching %d bodies is not done' % nr_bodies)
+
+    def test_prefetch(self):
+        _hkml_prefetch.set_focus(self.mail_items, 2)
+        self.wait_prefetch(len(self.mail_items))
+        # bodies should be read from the prefetched ones, not from git
+        shutil.rmtree(self.repo)
+        self.assertEqual([i.mail.get_body() for i in self.mail_items],
+                         ['body %d' % i for i in range(5)])
+
+    def test_switch_list(self):
+        prefetcher = _hkml_prefetch.BodyPrefetcher(
+                _hkml_prefetch.BodyCache(max_bytes=1024))
+        prefetcher.window = 1
+        prefetcher.batch_size = 2
+        prefetcher.set_focus(self.mail_items, 2)
+        self.assertEqual(prefetcher.next_batch(),
+                         [i.mail for i in self.mail_items[2:4]])
+        self.assertEqual(prefetcher.next_batch(), [self.mail_items[1].mail])
+        self.assertEqual(prefetcher.next_batch(),
+                         [i.mail for i in self.mail_items[0:5:4]])
+        self.assertEqual(prefetcher.next_batch(), [])
+
+        other_items = self.mail_items[3:]
+        prefetcher.set_focus(other_items, 0)
+        self.assertEqual(prefetcher.next_batch(),
+                         [i.mail for i in other_items])
+
+    def test_cache_size(self):
+        cache = _hkml_prefetch.BodyCache(max_bytes=10)
+        mails = [i.mail for i in self.mail_items]
+        for mail in mails[:3]:
+            cache.add((mail.gitdir, mail.gitid), '0123')
+        self.assertEqual(cache.nr_bytes, 8)
+        self.assertIsNone(cache.get_body(mails[0]))
+        self.assertEqual(cache.get_body(mails[1]), '0123')
+        cache.add((mails[3].gitdir, mails[3].gitid), '0123')
+        # mails[1] is recently used
+        self.assertIsNone(cache.get_body(mails[2]))
+        self.assertEqual(cache.get_body(mails[1]), '0123')
+        self.assertFalse(cache.full())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_search_index
+import _hkml_state
+import hkml_cache
+
+def mail_kvpairs(idx, sender, subject, body):
+    mbox = '\n'.join([
+        'From: %s' % sender,
+        'To: list@bar.com',
+        'Subject: %s' % subject,
+        'Message-ID: <%d@bar.com>' % idx,
+        'Date: Mon, 1 Jan 2024 00:00:00 +0000',
+        '', body])
+    return {'gitid': 'gitid%d' % idx, 'gitdir': 'gitdir', 'subject': None,
+            'msgid': '<%d@bar.com>' % idx, 'mbox': mbox}
+
+class TestHkmlSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_search_index_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+        self.reset_states()
+        self.mails = [
+                _hkml.Mail(kvpairs=mail_kvpairs(
+                    0, 'Foo <foo@bar.com>', 'mm/damon: fix', 'DAMON is great')),
+                _hkml.Mail(kvpairs=mail_kvpairs(
+                    1, 'Baz <baz@bar.com>', 'mm: cleanup', 'mm/damon-ish')),
+                ]
+
+    def tearDown(self):
+        _hkml_state.flush()
+        self.reset_states()
+        shutil.rmtree(self.hkml_dir)
+
+    def reset_states(self):
+        hkml_cache.close_sqlite_conn()
+        hkml_cache.cache_config = None
+        _hkml_search_index.tables_initialized = False
+        _hkml_search_index.indexed_docs_cache = None
+        _hkml_search_index.candidates_cache = {}
+
+    def test_search(self):
+        self.assertEqual(_hkml_search_index.update_index(), (2, None))
+        self.assertEqual(_hkml_search_index.update_index(), (0, None))
+
+        self.assertEqual(_hkml_search_index.search(['AMO'], ['body']),
+                         ({'gitid0/gitdir'}, True))
+        self.assertEqual(_hkml_search_index.search(['damon'], ['body']),
+                         ({'gitid1/gitdir'}, True))
+        self.assertEqual(_hkml_search_index.search(['baz'], ['from']),
+                         ({'gitid1/gitdir'}, True))
+        self.assertEqual(_hkml_search_index.search(['baz'], ['subject']),
+                         (set(), True))
+        # candidates only, for keywords having non-word characters
+        self.assertEqual(_hkml_search_index.search(['mm/damon'], ['subject']),
+                         ({'gitid0/gitdir'}, False))
+
+    def test_keywords_in_field(self):
+        key = _hkml_search_index.mail_key(self.mails[1])
+        self.assertEqual(key, 'gitid1/gitdir')
+        self.assertIsNone(_hkml_search_index.keywords_in_field(
+            [['damon']], 'body', key))
+
+        _hkml_search_index.index_mail(self.mails[1])
+        self.assertTrue(_hkml_search_index.keywords_in_field(
+            [['damon']], 'body', key))
+        self.assertFalse(_hkml_search_index.keywords_in_field(
+            [['damon', 'cleanup']], 'body', key))
+        self.assertTrue(_hkml_search_index.keywords_in_field(
+            [['foo'], ['amon', 'ish']], 'body', key))
+        self.assertIsNone(_hkml_search_index.keywords_in_field(
+            [['mm/damon']], 'body', key))
+
+        # candidates cache is updated for newly indexed mails
+        key = _hkml_search_index.mail_key(self.mails[0])
+        _hkml_search_index.index_mail(self.mails[0])
+        self.assertFalse(_hkml_search_index.keywords_in_field(
+            [['damon']], 'body', key))
+        self.assertTrue(_hkml_search_index.keywords_in_field(
+            [['DAMON']], 'body', key))
+
+    def test_index_commit(self):
+        _hkml_search_index.index_mail(self.mails[1])
+        _hkml_state.flush()
+        conn = sqlite3.connect(hkml_cache.sqlite_db_path(), timeout=0)
+        self.assertEqual(conn.execute(
+            'SELECT key FROM search_docs').fetchall(), [('gitid1/gitdir',)])
+        conn.close()
+
+    def test_token_trigrams_build(self):
+        self.assertEqual(_hkml_search_index.update_index(), (2, None))
+        # index made with the token suffixes, before the trigrams introduced
+        conn = hkml_cache.get_sqlite_conn()
+        conn.execute('DELETE FROM search_token_trigrams')
+        conn.execute('DELETE FROM meta WHERE name = ?',
+                     ('search_token_trigrams_built',))
+        conn.execute('CREATE TABLE search_token_suffixes '
+                     '(suffix TEXT, token_id INTEGER)')
+        conn.commit()
+        self.reset_states()
+        self.assertEqual(_hkml_search_index.search(['AMO'], ['body']),
+                         ({'gitid0/gitdir'}, True))
+        conn = hkml_cache.get_sqlite_conn()
+        self.assertIsNone(conn.execute(
+            'SELECT name FROM sqlite_master WHERE name = ?',
+            ('search_token_suffixes',)).fetchone())
+
+    def test_long_tokens(self):
+        long_token = 'QUJD' * 19
+        _hkml.Mail(kvpairs=mail_kvpairs(
+            2, 'Foo <foo@bar.com>', 'attachment', 'x %s y' % long_token))
+        self.assertEqual(_hkml_search_index.update_index(), (3, None))
+        conn = hkml_cache.get_sqlite_conn()
+        long_id = conn.execute('SELECT id FROM search_tokens WHERE token = ?',
+                               (long_token,)).fetchone()[0]
+        self.assertIsNone(conn.execute(
+            'SELECT trigram FROM search_token_trigrams WHERE token_id = ?',
+            (long_id,)).fetchone())
+        # long tokens are scanned
+        self.assertEqual(_hkml_search_index.search(['DQUJ'], ['body']),
+                         ({'gitid2/gitdir'}, True))
+        # short keywords are scanned
+        self.assertEqual(_hkml_search_index.search(['D'], ['body']),
+                         ({'gitid0/gitdir', 'gitid2/gitdir'}, True))
+        # the trigrams should be all found
+        self.assertEqual(_hkml_search_index.search(['amon-i'], ['body']),
+                         ({'gitid1/gitdir'}, False))
+        self.assertEqual(_hkml_search_index.search(['AMOD'], ['body']),
+                         (set(), True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml_state
+
+def append_value(values, value):
+    return values + [value]
+
+def append_values(path, start):
+    for i in range(start, start + 50):
+        _hkml_state.update_json(
+                path, lambda values: append_value(values, i), default=[])
+
+class TestHkmlState(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='hkml_test_state_')
+        self.path = os.path.join(self.dir, 'state')
+
+    def tearDown(self):
+        _hkml_state.pending_updates = {}
+        _hkml_state.pending_calls = {}
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def test_write_json(self):
+        _hkml_state.write_json(self.path, {'b': 1, 'a': 2}, sort_keys=True)
+        self.assertEqual(self.read(), {'a': 2, 'b': 1})
+        # only the lock file is left, and it is hidden
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['.state.lock', 'state'])
+
+    def test_deferred_update(self):
+        for i in range(3):
+            _hkml_state.update_json(
+                    self.path, lambda values, i=i: append_value(values, i),
+                    default=[], defer=True)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(_hkml_state.has_pending_updates())
+
+        # changes made by others in the meantime are not clobbered
+        _hkml_state.write_json(self.path, ['other'])
+        _hkml_state.flush()
+        self.assertFalse(_hkml_state.has_pending_updates())
+        self.assertEqual(self.read(), ['other', 0, 1, 2])
+
+    def test_deferred_call(self):
+        for i in range(3):
+            _hkml_state.defer_call(
+                    self.path, lambda i=i: _hkml_state.write_json(
+                        self.path, [i]))
+        self.assertTrue(_hkml_state.has_pending_updates())
+        self.assertFalse(os.path.exists(self.path))
+        _hkml_state.flush()
+        self.assertFalse(_hkml_state.has_pending_updates())
+        # only the last call is made
+        self.assertEqual(self.read(), [2])
+
+    def test_concurrent_updates(self):
+        processes = [multiprocessing.Process(
+            target=append_values, args=(self.path, i * 50))
+                     for i in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        self.assertEqual(sorted(self.read()), list(range(200)))
+
+if __name__ == '__main__':
+    unittest.main()
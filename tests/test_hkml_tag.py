@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bindir, '..', 'src')
+sys.path.append(src_dir)
+
+import _hkml
+import _hkml_state
+import hkml_tag
+
+def tagged_mail_kvpairs(idx):
+    mail = _hkml.Mail(mbox='\n'.join([
+        'From: foo <foo@bar.com>',
+        'Subject: subject %d' % idx,
+        'Message-ID: <%03d@foo>' % idx,
+        'Date: Tue, 2 Jan 2024 00:00:00 +0000',
+        '', 'body']))
+    return {'mail': mail.to_kvpairs(),
+            'tags': ['odd' if idx % 2 else 'even']}
+
+def files_mtime(hkml_dir):
+    return {f: os.stat(os.path.join(hkml_dir, f)).st_mtime_ns
+            for f in hkml_tag.list_tags_files()}
+
+class TestHkmlTag(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_tag_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+        self.reset_states()
+
+    def tearDown(self):
+        _hkml_state.flush()
+        self.reset_states()
+        shutil.rmtree(self.hkml_dir)
+
+    def reset_states(self):
+        hkml_tag.tags_map_cache = None
+        hkml_tag.tags_files_stat = {}
+        hkml_tag.msgid_tags_file = {}
+        hkml_tag.tag_msgids = None
+        hkml_tag.tagged_mails = {}
+
+    def test_sharded_write(self):
+        tags_map = {'<%03d@foo>' % i: tagged_mail_kvpairs(i)
+                    for i in range(250)}
+        hkml_tag.write_tags_file(tags_map, sync_after=False)
+        self.assertEqual(hkml_tag.list_tags_files(),
+                         ['tags', 'tags_0', 'tags_1'])
+        self.reset_states()
+        self.assertEqual(hkml_tag.read_tags_file(), tags_map)
+        self.assertEqual(hkml_tag.get_tag_nr_mails(),
+                         {'even': 125, 'odd': 125})
+        self.assertTrue(hkml_tag.tag_exists('odd'))
+        self.assertFalse(hkml_tag.tag_exists('foo'))
+        self.assertEqual([m.subject for m in
+                          hkml_tag.get_mails_of_subject_tag(
+                              'subject 3', 'odd')], ['subject 3'])
+
+        # changing a mail's tags writes only the file having the mail
+        mtimes = files_mtime(self.hkml_dir)
+        tags_map = hkml_tag.read_tags_file()
+        tags_map['<120@foo>']['tags'].append('foo')
+        hkml_tag.write_tags_file(tags_map, sync_after=False)
+        new_mtimes = files_mtime(self.hkml_dir)
+        self.assertEqual([f for f in mtimes if mtimes[f] != new_mtimes[f]],
+                         ['tags_0'])
+        self.assertEqual(hkml_tag.mails_of_tag('foo')[0].subject,
+                         'subject 120')
+
+        # new mails are added to a file having less than 100 mails
+        tags_map['<999@foo>'] = tagged_mail_kvpairs(999)
+        hkml_tag.write_tags_file(tags_map, sync_after=False)
+        with open(os.path.join(self.hkml_dir, 'tags_1'), 'r') as f:
+            self.assertTrue('<999@foo>' in json.load(f))
+
+    def test_read_copy(self):
+        hkml_tag.write_tags_file({'<000@foo>': tagged_mail_kvpairs(0)},
+                                 sync_after=False)
+        tags_map = hkml_tag.read_tags_file()
+        tags_map['<000@foo>']['tags'].append('foo')
+        tags_map['<001@foo>'] = tagged_mail_kvpairs(1)
+        # not written yet
+        self.assertEqual(hkml_tag.get_tag_nr_mails(), {'even': 1})
+        hkml_tag.write_tags_file(tags_map, sync_after=False)
+        self.assertEqual(hkml_tag.get_tag_nr_mails(),
+                         {'even': 1, 'foo': 1, 'odd': 1})
+
+        del tags_map['<000@foo>']
+        hkml_tag.write_tags_file(tags_map, sync_after=False)
+        self.reset_states()
+        self.assertEqual(hkml_tag.read_tags_file(),
+                         {'<001@foo>': tagged_mail_kvpairs(1)})
+
+    def test_external_change(self):
+        hkml_tag.write_tags_file({'<000@foo>': tagged_mail_kvpairs(0)},
+                                 sync_after=False)
+        self.assertTrue(hkml_tag.tag_exists('even'))
+        # e.g., tags files updated by 'hkml sync' or another hkml process
+        with open(os.path.join(self.hkml_dir, 'tags_0'), 'w') as f:
+            json.dump({'<001@foo>': tagged_mail_kvpairs(1)}, f)
+        self.assertEqual(sorted(hkml_tag.read_tags_file().keys()),
+                         ['<000@foo>', '<001@foo>'])
+        self.assertTrue(hkml_tag.tag_exists('odd'))
+
+    def test_concurrent_change(self):
+        hkml_tag.write_tags_file({'<000@foo>': tagged_mail_kvpairs(0)},
+                                 sync_after=False)
+        tags_map = hkml_tag.read_tags_file()
+        # another hkml process tags another mail in the meantime
+        with open(os.path.join(self.hkml_dir, 'tags'), 'r') as f:
+            file_map = json.load(f)
+        file_map['<001@foo>'] = tagged_mail_kvpairs(1)
+        with open(os.path.join(self.hkml_dir, 'tags'), 'w') as f:
+            json.dump(file_map, f)
+
+        tags_map['<000@foo>']['tags'].append('foo')
+        hkml_tag.write_tags_file(tags_map, sync_after=False)
+        tags_map = hkml_tag.read_tags_file()
+        self.assertEqual(sorted(tags_map.keys()), ['<000@foo>', '<001@foo>'])
+        self.assertEqual(tags_map['<000@foo>']['tags'], ['even', 'foo'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,5 +34,33 @@ class TestHkmlViewText(unittest.TestCase):
         self.assertEqual(
                 hkml_view.wrap_text(['> abc def'], 5), ['> abc', '> def'])
 
+    def test_text_lines(self):
+        lines = hkml_view.TextLines(['a\tb', 'cd', '', 'e'])
+        self.assertEqual(lines.converted, [None] * 4)
+        self.assertEqual(lines[0], 'a       b')
+        self.assertEqual(lines.converted, ['a       b', None, None, None])
+        self.assertEqual(lines[-1], 'e')
+        self.assertEqual(lines[1:3], ['cd', ''])
+        self.assertEqual(lines.index(''), 2)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(list(lines), ['a       b', 'cd', '', 'e'])
+        self.assertEqual(lines[:1] + ['x'], ['a       b', 'x'])
+        with self.assertRaises(IndexError):
+            lines[4]
+
+    def test_wrapped_text_lines(self):
+        src_lines = ['0123 567 9abcd', '> abc def', 'ab', '\t0123 567']
+        lines = hkml_view.TextLines(src_lines)
+        wrapped = lines.wrap(9)
+        self.assertIs(lines.wrap(9), wrapped)
+        self.assertEqual(wrapped[0], '0123 567')
+        # only the first source line is wrapped and counted
+        self.assertEqual(wrapped.wrapped_starts, [0, 2])
+        self.assertEqual(list(wrapped), hkml_view.wrap_text(
+            [hkml_view.tabs_to_spaces(l, 8) for l in src_lines], 9))
+        self.assertEqual(len(wrapped), 7)
+        self.assertEqual(wrapped[-1], '        567')
+        self.assertIs(wrapped.wrap(9), wrapped)
+
 if __name__ == '__main__':
     unittest.main()
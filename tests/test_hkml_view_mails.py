@@ -1,18 +1,112 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0
 
+import argparse
+import io
 import unittest
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
+import _thread
 
 bindir = os.path.dirname(os.path.realpath(__file__))
 src_dir = os.path.join(bindir, '..', 'src')
 sys.path.append(src_dir)
 
+import _hkml
+import _hkml_state
+import hkml_cache
+import hkml_list
+import hkml_view
 import hkml_view_mails
 from unittest.mock import patch, MagicMock
 
+def mail_of(idx, parent_idx):
+    lines = ['From: foo <foo@bar.com>',
+             'Subject: mail %d' % idx,
+             'Message-ID: <%d@foo>' % idx,
+             'Date: Tue, 2 Jan 2024 00:00:%02d +0000' % idx]
+    if parent_idx is not None:
+        lines.append('In-Reply-To: <%d@foo>' % parent_idx)
+    return _hkml.Mail(mbox='\n'.join(lines + ['', 'body']))
+
+def threads_list(parent_idxs):
+    '''Returns ScrollableList for a mails list of given parents.  The mails
+    should be in the listing order'''
+    mail_items = []
+    for idx, parent_idx in enumerate(parent_idxs):
+        if parent_idx is None:
+            parent_item = None
+            prdepth = 0
+        else:
+            parent_item = mail_items[parent_idx]
+            prdepth = parent_item.prdepth + 1
+        mail_items.append(hkml_list.MailListMailItem(
+            mail_cache_key=None, mail=mail_of(idx, parent_idx),
+            prdepth=prdepth, parent_item=parent_item, added_by_tag=None))
+    hkml_list.thread_items_of(mail_items)
+    lines, line_nr_mail_idx_map = hkml_list.fmt_mails_text(
+            mail_items, hkml_list.MailListDecorator(None), {})
+    comments_lines = ['# comment']
+    list_data = hkml_list.MailsListData(
+            '\n'.join(comments_lines + lines), len(comments_lines),
+            mail_items=mail_items, line_nr_mail_idx_map=line_nr_mail_idx_map)
+    screen = MagicMock()
+    screen.getmaxyx.return_value = (50, 200)
+    slist = hkml_view.ScrollableList(
+            screen, list_data.text.split('\n'), None)
+    slist.data = hkml_view_mails.MailsViewData(list_data, None, None)
+    return slist
+
 class TestHkmlViewText(unittest.TestCase):
+    def setUp(self):
+        self.hkml_dir = tempfile.mkdtemp(prefix='hkml_test_view_mails_')
+        _hkml.set_hkml_dir(self.hkml_dir)
+
+    def tearDown(self):
+        _hkml_state.flush()
+        hkml_cache.close_sqlite_conn()
+        shutil.rmtree(self.hkml_dir)
+
+    def assert_fully_formatted(self, slist):
+        list_data = slist.data.list_data
+        lines, line_nr_mail_idx_map = hkml_list.fmt_mails_text(
+                list_data.mail_items, hkml_list.MailListDecorator(None),
+                slist.data.collapsed_mails)
+        self.assertEqual(list(slist.lines), ['# comment'] + lines)
+        self.assertEqual(list_data.mail_lines, lines)
+        self.assertEqual(list_data.line_nr_mail_idx_map, line_nr_mail_idx_map)
+
+    def test_collapse_expand(self):
+        # 0 -+- 1 --- 2
+        #    +- 3
+        # 4 --- 5
+        slist = threads_list([None, 0, 1, 0, None, 4])
+        slist.focus_row = 2
+        hkml_view_mails.collapse_focused_thread(None, slist)
+        self.assertEqual(slist.data.list_data.line_nr_mail_idx_map,
+                         [0, 1, 3, 4, 5])
+        self.assert_fully_formatted(slist)
+
+        slist.focus_row = 1
+        hkml_view_mails.collapse_focused_thread(None, slist)
+        self.assertEqual(slist.data.list_data.line_nr_mail_idx_map, [0, 4, 5])
+        self.assert_fully_formatted(slist)
+
+        hkml_view_mails.expand_focused_thread(None, slist)
+        self.assertEqual(slist.data.list_data.line_nr_mail_idx_map,
+                         [0, 1, 3, 4, 5])
+        self.assert_fully_formatted(slist)
+
+        slist.focus_row = 2
+        hkml_view_mails.expand_focused_thread(None, slist)
+        self.assertEqual(slist.data.list_data.line_nr_mail_idx_map,
+                         [0, 1, 2, 3, 4, 5])
+        self.assert_fully_formatted(slist)
+
     def test_get_files_for_reviewer(self):
         maintainers_file_content = '''
 DATA ACCESS MONITOR
@@ -80,5 +174,111 @@ F:	drivers/net/ethernet/dec/tulip/dmfe.c
         self.assertEqual(mails_view_data.display_rule, new_rule)
         self.assertEqual(mails_view_data.display_effect_cache, {})
 
+    def test_list_generation_cancel(self):
+        steps = []
+
+        def generate_mails_list_data(list_args, runtime_profiles):
+            for category in runtime_profiles.categories * 1000:
+                runtime_profiles.start(category)
+                steps.append(category)
+                if len(steps) == 3:
+                    # user presses Ctrl-C
+                    threading.Timer(0.1, _thread.interrupt_main).start()
+                time.sleep(0.05)
+                runtime_profiles.end(category)
+            return 'list data', None
+
+        orig_fn = hkml_view_mails.generate_mails_list_data
+        hkml_view_mails.generate_mails_list_data = generate_mails_list_data
+        try:
+            self.assertEqual(
+                    hkml_view_mails.generate_mails_list_data_in_background(
+                        None), (None, 'cancelled'))
+        finally:
+            hkml_view_mails.generate_mails_list_data = orig_fn
+        self.assertLess(len(steps), 10)
+
+        progress = hkml_view_mails.ListGenerationProgress()
+        progress.start('get_mails')
+        progress.cancel_requested.set()
+        with self.assertRaises(hkml_view_mails.ListGenerationCancelled):
+            progress.end('get_mails')
+
+    def test_list_generation_noninteractive(self):
+        questions = []
+
+        def generate_mails_list_data(list_args, runtime_profiles):
+            runtime_profiles.start('get_mails')
+            print('a message from the worker')
+            runtime_profiles.end('get_mails')
+            return _hkml.is_interactive(), None
+
+        def should_fetch(list_args, list_data, err):
+            questions.append(threading.current_thread())
+            return False
+
+        screen = MagicMock()
+        screen.getmaxyx.return_value = (50, 200)
+        with patch.object(hkml_view_mails, 'generate_mails_list_data',
+                          generate_mails_list_data), \
+                patch.object(hkml_view_mails, 'should_fetch',
+                             should_fetch), \
+                patch.object(hkml_view, 'shell_mode_start') as start, \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            list_data, err = hkml_view_mails.generate_mails_list_data_in_view(
+                    screen, argparse.Namespace(source_type=['mbox']))
+        self.assertEqual((list_data, err), (False, None))
+        self.assertTrue(_hkml.is_interactive())
+        # questions are asked from the main thread in the shell mode
+        self.assertEqual(questions, [threading.main_thread()])
+        start.assert_called_once_with(screen)
+        # messages from the worker are printed after the worker finishes
+        self.assertEqual(stdout.getvalue(), 'a message from the worker\n')
+
+    def test_list_generation_progress_draw(self):
+        screen = MagicMock()
+        screen.getmaxyx.return_value = (8, 80)
+        progress = hkml_view_mails.ListGenerationProgress(screen)
+        slist = threads_list([None] * 10)
+        progress.start('get_mails')
+        progress.mails_to_list_decided(
+                slist.data.list_data.mail_items,
+                hkml_list.MailListDecorator(None))
+        progress.draw()
+        drawn = [c.args[2] for c in screen.addstr.call_args_list]
+        self.assertEqual(len(drawn), 7)
+        self.assertTrue(drawn[1].startswith('# [....'))
+        self.assertEqual(drawn[3:], progress.first_rows)
+        self.assertEqual(len(progress.first_rows), 4)
+
+    def test_list_generation_in_background_cache(self):
+        mbox_path = os.path.join(self.hkml_dir, 'test.mbox')
+        with open(mbox_path, 'w') as f:
+            for idx in range(3):
+                f.write('From mboxrd@z Thu Jan  1 00:00:00 1970\n')
+                f.write(mail_of(idx, None if idx == 0 else 0).mbox)
+                f.write('\n\n')
+        # mails are cached by the list generation
+        hkml_cache.close_sqlite_conn()
+        hkml_cache.need_file_update = False
+
+        parser = argparse.ArgumentParser()
+        hkml_list.set_argparser(parser)
+        list_args = parser.parse_args(
+                [mbox_path, '--source_type', 'mbox'])
+        list_data, err = \
+                hkml_view_mails.generate_mails_list_data_in_background(
+                        list_args)
+        self.assertIsNone(err)
+        self.assertEqual(len(list_data.mail_items), 3)
+
+        # the cache should be usable from the main thread
+        kvpairs = hkml_cache.get_kvpairs(key='<1@foo>')
+        self.assertEqual(kvpairs['subject'], 'mail 1')
+        self.assertEqual(hkml_cache.get_ancestor_msgids('<2@foo>'),
+                         ['<2@foo>', '<0@foo>'])
+        mail_of(3, 0)
+        hkml_cache.writeback_mails()
+
 if __name__ == '__main__':
     unittest.main()